@@ -2,6 +2,7 @@
 # encoding: utf-8
 # ----------------------------------------------------------------------------
 
+import json
 import logging
 
 VERSION = (1, 3, 2)
@@ -32,9 +33,9 @@ def send_mail(subject, message, from_email, recipient_list,
 
     """
     from django.core.mail import EmailMessage
-    from django.utils.encoding import force_unicode
+    from django.utils.encoding import force_text
 
-    subject = force_unicode(subject)
+    subject = force_text(subject)
     email_message = EmailMessage(subject, message, from_email,
                                  recipient_list)
     queue_email_message(email_message, priority=priority)
@@ -52,13 +53,13 @@ def mail_admins(subject, message, fail_silently=False, priority=None):
 
     """
     from django.conf import settings as django_settings
-    from django.utils.encoding import force_unicode
+    from django.utils.encoding import force_text
     from django_mailer import settings
 
     if priority is None:
         settings.MAIL_ADMINS_PRIORITY
 
-    subject = django_settings.EMAIL_SUBJECT_PREFIX + force_unicode(subject)
+    subject = django_settings.EMAIL_SUBJECT_PREFIX + force_text(subject)
     from_email = django_settings.SERVER_EMAIL
     recipient_list = [recipient[1] for recipient in django_settings.ADMINS]
     send_mail(subject, message, from_email, recipient_list, priority=priority)
@@ -76,13 +77,13 @@ def mail_managers(subject, message, fail_silently=False, priority=None):
 
     """
     from django.conf import settings as django_settings
-    from django.utils.encoding import force_unicode
+    from django.utils.encoding import force_text
     from django_mailer import settings
 
     if priority is None:
         priority = settings.MAIL_MANAGERS_PRIORITY
 
-    subject = django_settings.EMAIL_SUBJECT_PREFIX + force_unicode(subject)
+    subject = django_settings.EMAIL_SUBJECT_PREFIX + force_text(subject)
     from_email = django_settings.SERVER_EMAIL
     recipient_list = [recipient[1] for recipient in django_settings.MANAGERS]
     send_mail(subject, message, from_email, recipient_list, priority=priority)
@@ -103,7 +104,7 @@ def queue_email_message(email_message, fail_silently=False, priority=None):
     (see ``queue_django_mail``).
 
     """
-    from django_mailer import constants, models, settings
+    from django_mailer import constants, models, settings, wakeup
 
     if constants.PRIORITY_HEADER in email_message.extra_headers:
         priority = email_message.extra_headers.pop(constants.PRIORITY_HEADER)
@@ -111,24 +112,200 @@ def queue_email_message(email_message, fail_silently=False, priority=None):
 
     if priority == constants.PRIORITY_EMAIL_NOW:
         if constants.EMAIL_BACKEND_SUPPORT:
-            from django.core.mail import get_connection
             from django_mailer.engine import send_message
-            connection = get_connection(backend=settings.USE_BACKEND)
-            result = send_message(email_message, smtp_connection=connection)
+            from django_mailer.pool import pool
+            connection = pool.acquire(settings.USE_BACKEND)
+            try:
+                result = send_message(email_message,
+                                      smtp_connection=connection)
+            finally:
+                pool.release(connection)
             return (result == constants.RESULT_SENT)
         else:
             return email_message.send()
+    if settings.BULK_ENQUEUE:
+        return _bulk_queue([(email_message, priority)])
+    # The encoded message is identical for every recipient.
+    body_fields = _message_body_fields(email_message)
     count = 0
     for to_email in email_message.recipients():
         message = models.Message.objects.create(
             to_address=to_email, from_address=email_message.from_email,
             subject=email_message.subject,
-            encoded_message=email_message.message().as_string())
+            **_recipient_fields(body_fields, to_email))
         queued_message = models.QueuedMessage(message=message)
         if priority:
             queued_message.priority = priority
         queued_message.save()
         count += 1
+    wakeup.notify()
+    return count
+
+
+def queue_email_messages(email_messages, priority=None):
+    """
+    Add several messages to the email queue at once.
+
+    Each ``EmailMessage`` is only encoded once and the queue rows for all of
+    its recipients are written with bulk inserts (in batches of
+    ``MAILER_BULK_ENQUEUE_BATCH_SIZE`` rows) inside a single transaction.
+
+    Priorities are handled as in ``queue_email_message``; messages with a
+    ``now`` priority are sent immediately rather than queued.
+
+    Returns the number of queued messages (one per recipient).
+
+    """
+    from django_mailer import constants
+
+    pending = []
+    for email_message in email_messages:
+        message_priority = priority
+        if constants.PRIORITY_HEADER in email_message.extra_headers:
+            message_priority = email_message.extra_headers.pop(
+                constants.PRIORITY_HEADER)
+            message_priority = constants.PRIORITIES.get(
+                message_priority.lower())
+        if message_priority == constants.PRIORITY_EMAIL_NOW:
+            queue_email_message(email_message, priority=message_priority)
+        else:
+            pending.append((email_message, message_priority))
+    return _bulk_queue(pending)
+
+
+def _message_body_fields(email_message):
+    """
+    Encode an ``EmailMessage`` and return the field values used to store it
+    on each of its ``Message`` rows.
+
+    If the ``MAILER_STREAM_MESSAGES`` setting is enabled, the message is
+    serialized straight to the storage rather than built as a string. If the
+    ``MAILER_STORED_PART_MIN_SIZE`` setting is set, its large parts are kept
+    in the storage. The manifest of its attachments is recorded too, as well
+    as its search text if the ``MAILER_INDEX_MESSAGES`` setting is enabled
+    (see ``_recipient_fields``).
+
+    """
+    from django_mailer import mime_index, parts, search, settings, streaming
+
+    mime_message = email_message.message()
+    text = None
+    if settings.INDEX_MESSAGES:
+        from pyzmail.parse import PyzMessage
+        text = search.search_text(PyzMessage.factory(mime_message))
+    stored_parts = parts.store_parts(mime_message)
+    if settings.STREAM_MESSAGES:
+        encoded_message = None
+        fields = {'stored_message': streaming.store_message(mime_message)}
+    else:
+        encoded_message = mime_message.as_string()
+        fields = _body_fields(encoded_message)
+    if stored_parts:
+        fields['stored_parts'] = parts.join_names(stored_parts)
+    manifest = mime_index.build_manifest(mime_message, encoded_message)
+    fields['attachment_manifest'] = json.dumps(
+        [attachment.to_dict() for attachment in manifest])
+    if text is not None:
+        fields['search_text'] = text
+    return fields
+
+
+def _recipient_fields(body_fields, to_email):
+    """
+    Return the field values of the ``Message`` row sending a message to one
+    recipient: its ``body_fields``, with the recipient's address in the
+    search text if it is recorded.
+
+    """
+    from django_mailer import search
+
+    if 'search_text' not in body_fields:
+        return body_fields
+    fields = dict(body_fields)
+    fields['search_text'] = search.recipient_text(fields['search_text'],
+                                                  to_email)
+    return fields
+
+
+def _body_fields(encoded_message):
+    """
+    Return the field values used to store an encoded message on each of its
+    ``Message`` rows: a reference to a shared ``MessageBody`` if the
+    ``MAILER_DEDUPLICATE_BODIES`` setting is enabled, otherwise the (possibly
+    compressed) message itself and its hash.
+
+    """
+    from django_mailer import compression, models, settings
+    from django.utils.encoding import force_bytes
+    import hashlib
+
+    if settings.DEDUPLICATE_BODIES:
+        return {'body': models.MessageBody.objects.get_for(encoded_message)}
+    fields = compression.body_fields(encoded_message)
+    fields['content_hash'] = hashlib.sha256(
+        force_bytes(encoded_message)).hexdigest()
+    return fields
+
+
+def _bulk_queue(pending):
+    """
+    Write the queue rows for a list of ``(email_message, priority)`` pairs
+    using bulk inserts, returning the number of queued messages.
+
+    """
+    from django.db import DatabaseError
+    from django_mailer import models, settings, wakeup
+    import uuid
+    try:
+        from django.db.transaction import atomic
+    except ImportError:
+        # Django version < 1.6
+        from django.db.transaction import commit_on_success as atomic
+    try:
+        from django.utils.timezone import now
+    except ImportError:
+        import datetime
+        now = datetime.datetime.now
+
+    batch_size = max(settings.BULK_ENQUEUE_BATCH_SIZE, 1)
+    count = 0
+    with atomic():
+        for email_message, priority in pending:
+            body_fields = _message_body_fields(email_message)
+            recipients = email_message.recipients()
+            for start in range(0, len(recipients), batch_size):
+                batch = recipients[start:start + batch_size]
+                # Bulk inserts don't return primary keys, so the new rows
+                # share a creation date and a marker unique to the batch which
+                # are used to look them up again.
+                date_created = now()
+                marker = uuid.uuid4().hex
+                models.Message.objects.bulk_create([
+                    models.Message(
+                        to_address=to_email,
+                        from_address=email_message.from_email,
+                        subject=email_message.subject,
+                        date_created=date_created, enqueue_marker=marker,
+                        **_recipient_fields(body_fields, to_email))
+                    for to_email in batch])
+                message_ids = list(models.Message.objects.filter(
+                    date_created=date_created, enqueue_marker=marker,
+                ).order_by('pk').values_list('pk', flat=True))
+                if len(message_ids) != len(batch):
+                    raise DatabaseError(
+                        "%s messages were inserted, %s were found again." %
+                        (len(batch), len(message_ids)))
+                queued_messages = []
+                for message_id in message_ids:
+                    queued_message = models.QueuedMessage(
+                        message_id=message_id)
+                    if priority:
+                        queued_message.priority = priority
+                    queued_messages.append(queued_message)
+                models.QueuedMessage.objects.bulk_create(queued_messages)
+                count += len(queued_messages)
+    if count:
+        wakeup.notify()
     return count
 
 
@@ -8,27 +8,89 @@ try:
     from django.conf.urls import patterns, url
 except ImportError:
     from django.conf.urls.defaults import *
-from mail_utils import get_attachments, get_attachment
-from pyzmail.parse import message_from_string
-from django.shortcuts import render
-from django.http import HttpResponse
-from django.core.urlresolvers import reverse
+from django_mailer import mime_index, search, settings
+from django.shortcuts import get_object_or_404, render
+from django.http import Http404
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django version < 1.5
+    from django.http import HttpResponse as StreamingHttpResponse
+from django.core.urlresolvers import get_script_prefix, reverse
+from django_mailer.changelist import LargeTableAdminMixin
+
+
+# A primary key standing in for the real one in a reversed URL.
+PK_PLACEHOLDER = 987654321
+_detail_urls = {}
+
+
+def detail_url(pk):
+    """
+    Return the URL of a message's detail view, reversed only once (per
+    script prefix) rather than for every row of a change list.
+
+    """
+    prefix = get_script_prefix()
+    url = _detail_urls.get(prefix)
+    if url is None:
+        url = _detail_urls[prefix] = reverse('admin:mail_detail',
+                                             args=(PK_PLACEHOLDER,))
+    return url.replace(str(PK_PLACEHOLDER), str(pk))
+
 
+def parent_queryset(parent, request):
+    """
+    Return the queryset of a ``ModelAdmin``'s parent class (``parent`` being
+    a ``super()`` object).
 
-class Message(admin.ModelAdmin):
+    """
+    if hasattr(parent, 'get_queryset'):
+        return parent.get_queryset(request)
+    # Django version < 1.6
+    return parent.queryset(request)
+
+
+class Message(LargeTableAdminMixin, admin.ModelAdmin):
     def message_link(self, obj):
-        url = reverse('admin:mail_detail', args=(obj.id,))
+        url = detail_url(obj.id)
         return """<a href="%s" class="add-another" onclick="return showAddAnotherPopup(this);">show</a>""" % url
     message_link.allow_tags = True
     message_link.short_description = u'Show'
 
-    list_display = ('from_address', 'to_address', 'subject', 'date_created', 'message_link')
+    def attachment_list(self, obj):
+        attachments = obj.get_attachment_manifest()
+        if not attachments:
+            return ''
+        return ', '.join('%s (%s bytes)' % (attachment.filename,
+                                            attachment.size)
+                         for attachment in attachments)
+    attachment_list.short_description = u'Attachments'
+
+    list_display = ('from_address', 'to_address', 'subject', 'date_created',
+                    'attachment_list', 'message_link')
     list_filter = ('date_created',)
     search_fields = ('to_address', 'subject', 'from_address',
             'encoded_message',)
     date_hierarchy = 'date_created'
     ordering = ('-date_created',)
 
+    def get_queryset(self, request):
+        return parent_queryset(super(Message, self), request).defer(
+            *models.BODY_FIELDS)
+    # Django version < 1.6
+    queryset = get_queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        if settings.SEARCH_ENCODED_MESSAGE or not search_term:
+            return super(Message, self).get_search_results(
+                request, queryset, search_term)
+        # Search the indexed headers and text (or only the fields) rather
+        # than scanning the encoded messages.
+        if settings.INDEX_MESSAGES:
+            return search.search(queryset, search_term), False
+        return search.search_fields(queryset, search_term), False
+
     def get_urls(self):
         urls = super(Message, self).get_urls()
         custom_urls = patterns('',
@@ -43,46 +105,63 @@ class Message(admin.ModelAdmin):
                 name="mail_html"))
         return custom_urls + urls
 
+    def get_message(self, pk):
+        """
+        Return a message, without loading its encoded message.
+
+        """
+        return get_object_or_404(models.Message.objects.defer(
+            *models.CONTENT_FIELDS), pk=pk)
+
     def detail_view(self, request, pk):
-        instance = models.Message.objects.get(pk=pk)
-        payload_str = instance.encoded_message.encode('utf-8')
-        msg = message_from_string(payload_str)
+        instance = self.get_message(pk)
+        index = mime_index.get_index(instance)
         context = {}
-        context['subject'] = msg.get_subject()
-        context['from'] = msg.get_address('from')
-        context['to'] = msg.get_addresses('to')
-        context['cc'] = msg.get_addresses('cc')
-        msg_text = msg.text_part.get_payload() if msg.text_part else None
-        msg_html = msg.html_part.get_payload() if msg.html_part else None
-        context['msg_html'] = msg_html
-        context['msg_text'] = msg_text
-        context['attachments'] = get_attachments(msg)
+        context['subject'] = index.subject
+        context['from'] = index.from_address
+        context['to'] = index.to
+        context['cc'] = index.cc
+        context['msg_html'] = index.html
+        context['msg_text'] = index.text
+        context['attachments'] = index.attachments
         context['is_popup'] = True
         context['object'] = instance
         return render(request, 'django_mailer/message_detail.html', context)
 
     def download_view(self, request, pk, firma):
-        payload_str = models.Message.objects.get(
-                pk=pk).encoded_message.encode('utf-8')
-        msg = message_from_string(payload_str)
-        arx = get_attachment(msg, key=firma)
-        response = HttpResponse(mimetype=arx.tipus)
+        instance = self.get_message(pk)
+        # The attachments recorded when the message was queued are looked up
+        # directly, others are found by parsing it.
+        attachments = instance.get_attachment_manifest()
+        if attachments is None:
+            attachments = mime_index.get_index(instance).attachments
+        arx = dict((attachment.firma, attachment)
+                   for attachment in attachments).get(firma)
+        if arx is None:
+            raise Http404
+        response = StreamingHttpResponse(
+            mime_index.iter_attachment(instance, arx),
+            content_type=arx.content_type)
         response['Content-Disposition'] = 'filename=' + arx.filename
-        response.write(arx.payload)
+        response['Content-Length'] = arx.size
         return response
 
     def html_view(self, request, pk):
-        msg = models.Message.objects.get(pk=pk)
-        payload_str = msg.encoded_message.encode('utf-8')
-        msg = message_from_string(payload_str)
-        msg_html = msg.html_part.get_payload() if msg.html_part else None
+        index = mime_index.get_index(self.get_message(pk))
         context = {}
-        context['msg_html'] = msg_html
+        context['msg_html'] = index.html
         return render(request, 'django_mailer/html_detail.html', context)
 
-class MessageRelatedModelAdmin(admin.ModelAdmin):
+class MessageRelatedModelAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_select_related = True
 
+    def get_queryset(self, request):
+        return parent_queryset(super(MessageRelatedModelAdmin, self),
+                               request).select_related('message').defer(
+            *['message__%s' % field for field in models.BODY_FIELDS])
+    # Django version < 1.6
+    queryset = get_queryset
+
     def message__to_address(self, obj):
         return obj.message.to_address
     message__to_address.admin_order_field = 'message__to_address'
@@ -96,7 +175,7 @@ class MessageRelatedModelAdmin(admin.ModelAdmin):
     message__subject.admin_order_field = 'message__subject'
 
     def message__date_created(self, obj):
-        return obj.message.to_address
+        return obj.message.date_created
     message__date_created.admin_order_field = 'message__date_created'
 
 
@@ -107,14 +186,15 @@ class QueuedMessage(MessageRelatedModelAdmin):
     not_deferred.admin_order_field = 'deferred'
 
     def message_link(self, obj):
-        url = reverse('admin:mail_detail', args=(obj.message.id,))
+        url = detail_url(obj.message_id)
         return """<a href="%s" class="add-another" onclick="return showAddAnotherPopup(this);">%s</a>""" % (url, obj.message)
     message_link.allow_tags = True
     message_link.short_description = u'Message'
 
     list_display = ('id', 'message_link', 'message__to_address',
             'message__from_address', 'message__subject',
-            'message__date_created', 'priority', 'not_deferred')
+            'message__date_created', 'priority', 'not_deferred', 'retries',
+            'next_attempt')
 
 
 class Blacklist(admin.ModelAdmin):
@@ -123,7 +203,7 @@ class Blacklist(admin.ModelAdmin):
 
 class Log(MessageRelatedModelAdmin):
     def message_link(self, obj):
-        url = reverse('admin:mail_detail', args=(obj.message.id,))
+        url = detail_url(obj.message_id)
         return """<a href="%s" class="add-another" onclick="return showAddAnotherPopup(this);">show</a>""" % url
     message_link.allow_tags = True
     message_link.short_description = u'Message'
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+An asyncio alternative to ``engine.send_all`` (requires Python 3.5 or later).
+
+A bounded number of backend connections ("sessions", taken from the
+connection pool, see ``MAILER_ROUTES`` for sending to several destinations)
+are used at once and the transactions of each block are spread over them
+from a single event loop.
+Email backends and the ORM are synchronous, so their calls are run in
+executors to keep the loop free: each SMTP call in a thread of the sessions'
+executor and every database query in one dedicated database thread.
+``MAILER_EMAIL_THROTTLE`` is applied as a token bucket rate (one message
+every ``MAILER_EMAIL_THROTTLE`` seconds across all sessions) rather than by
+sleeping after each message.
+
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection as db_connection
+from django_mailer import constants, settings
+from django_mailer.engine import (ConnectionLost, ResultBuffer,
+    blacklist_cache, _apply_rate_limits, _deliver_many, _fetch_body,
+    _limits_reached, _log_connection_lost, _log_totals, _open_queue,
+    _release_body, _remove_blacklisted, _transactions)
+from django_mailer.pool import pool
+from django_mailer.ratelimit import RateLimiter, TokenBucket
+from django_mailer.routing import Router
+
+
+async def send_all_async(block_size=500, backend=None, concurrency=None,
+                         db_executor=None):
+    """
+    Send all non-deferred messages in the queue, using up to ``concurrency``
+    SMTP sessions at once (defaults to the ``MAILER_ASYNC_CONCURRENCY``
+    setting).
+
+    The queue is locked (or leased), iterated in blocks and limited by
+    ``MAILER_EMAIL_MAX_SENT`` and ``MAILER_EMAIL_MAX_DEFERRED`` exactly as by
+    ``send_all``.
+
+    Database queries are run in ``db_executor`` which must use a single
+    thread. By default a new one is created (and its database connection
+    closed when done).
+
+    Returns a ``(sent, deferred, skipped)`` tuple, or ``None`` if the queue
+    is locked.
+
+    """
+    if concurrency is None:
+        concurrency = settings.ASYNC_CONCURRENCY
+    loop = asyncio.get_event_loop()
+    own_db_executor = db_executor is None
+    if own_db_executor:
+        db_executor = ThreadPoolExecutor(1)
+    smtp_executor = ThreadPoolExecutor(concurrency)
+
+    def db(func, *args):
+        return loop.run_in_executor(db_executor, func, *args)
+
+    try:
+        queue = await db(_open_queue, block_size)
+        if queue is None:
+            return None
+        blocks, release = queue
+        start_time = time.time()
+        result_buffer = ResultBuffer()
+        try:
+            totals = await _send_blocks(loop, db, smtp_executor, blocks,
+                                        backend, concurrency, result_buffer)
+        finally:
+            try:
+                await db(result_buffer.flush)
+            finally:
+                await db(release)
+        _log_totals(*(totals + (start_time,)))
+        return totals
+    finally:
+        smtp_executor.shutdown(wait=False)
+        if own_db_executor:
+            await db(_close_db)
+            db_executor.shutdown(wait=False)
+
+
+async def _send_blocks(loop, db, smtp_executor, blocks, backend, concurrency,
+                       result_buffer):
+    """
+    Send the transactions of each block over up to ``concurrency`` sessions,
+    returning a ``(sent, deferred, skipped)`` tuple.
+
+    Sessions are opened as needed for each destination (see
+    ``routing.Router``) and the transactions of the destinations in a block
+    are interleaved, so a slow destination doesn't hold back the others.
+
+    """
+    counts = {'sent': 0, 'deferred': 0, 'skipped': 0, 'in_flight': 0}
+    bucket = TokenBucket.for_throttle(settings.EMAIL_THROTTLE)
+    limiter = RateLimiter.from_settings()
+    router = Router.from_settings(backend)
+    slots = asyncio.Semaphore(concurrency)
+    # The idle sessions of each destination, and how many are open in all.
+    idle = {}
+    opened = [0]
+
+    def allowance():
+        if settings.EMAIL_MAX_SENT is None:
+            return None
+        return settings.EMAIL_MAX_SENT - counts['sent'] - counts['in_flight']
+
+    def record(transaction, outcomes):
+        _release_body(transaction)
+        for queued_message, (result, log_message) in zip(transaction,
+                                                         outcomes):
+            result_buffer.add(queued_message, result, log_message)
+
+    async def get_session(destination):
+        if idle.get(destination):
+            return idle[destination].pop()
+        if opened[0] >= concurrency:
+            # A slot is free, so another destination has an idle session:
+            # close it to make room.
+            sessions = [sessions for sessions in idle.values() if sessions][0]
+            await loop.run_in_executor(smtp_executor, pool.release,
+                                       sessions.pop())
+        else:
+            opened[0] += 1
+        return await loop.run_in_executor(smtp_executor, functools.partial(
+            pool.acquire, destination.backend, **destination.kwargs))
+
+    async def deliver(transaction, destination, session):
+        try:
+            outcomes = await loop.run_in_executor(
+                smtp_executor, _deliver_many,
+                [queued_message.message for queued_message in transaction],
+                session)
+        except ConnectionLost as err:
+            # The messages are left in the queue for the next run.
+            _log_connection_lost(err)
+            outcomes = None
+        finally:
+            idle.setdefault(destination, []).append(session)
+            slots.release()
+            counts['in_flight'] -= len(transaction)
+        if outcomes is None:
+            return True
+        # Counted before the loop is given back, so that the allowance doesn't
+        # include these messages while they are recorded.
+        for result, log_message in outcomes:
+            if result == constants.RESULT_SENT:
+                counts['sent'] += 1
+            elif result == constants.RESULT_FAILED:
+                counts['deferred'] += 1
+        await db(record, transaction, outcomes)
+        return _limits_reached(counts['sent'], counts['deferred'])
+
+    await db(blacklist_cache.refresh)
+    stop = False
+    tasks = set()
+    try:
+        while not stop:
+            block = await db(next, blocks, None)
+            if not block:
+                break
+            messages, skipped = await db(_remove_blacklisted, block,
+                                         blacklist_cache, result_buffer.add)
+            counts['skipped'] += skipped
+            messages = await db(_apply_rate_limits, messages, limiter)
+            for destination, transaction in _interleave([
+                    (destination, _transactions(group, allowance))
+                    for destination, group in router.group(messages)]):
+                while tasks and allowance() is not None and allowance() < 1:
+                    stop = await _wait_first(tasks) or stop
+                if stop:
+                    break
+                if bucket is not None:
+                    delay = bucket.reserve()
+                    if delay:
+                        await asyncio.sleep(delay)
+                await db(_fetch_body, transaction)
+                await slots.acquire()
+                try:
+                    session = await get_session(destination)
+                except BaseException:
+                    slots.release()
+                    raise
+                counts['in_flight'] += len(transaction)
+                tasks.add(asyncio.ensure_future(deliver(
+                    transaction, destination, session)))
+                stop = _reap(tasks) or stop
+            while tasks:
+                stop = await _wait_first(tasks) or stop
+            # The block must be recorded before the next one is fetched.
+            await db(result_buffer.flush)
+    finally:
+        # Let deliveries already in flight be recorded.
+        if tasks:
+            await asyncio.wait(tasks)
+        for sessions in idle.values():
+            for session in sessions:
+                await loop.run_in_executor(smtp_executor, pool.release,
+                                           session)
+    return counts['sent'], counts['deferred'], counts['skipped']
+
+
+def _interleave(pending):
+    """
+    Yield the ``(destination, transaction)`` pairs of the ``(destination,
+    transactions)`` tuples in ``pending``, taking one transaction of each
+    destination in turn.
+
+    """
+    while pending:
+        for destination, transactions in list(pending):
+            try:
+                yield destination, next(transactions)
+            except StopIteration:
+                pending.remove((destination, transactions))
+
+
+async def _wait_first(tasks):
+    """
+    Wait for at least one of the delivery ``tasks`` to complete, returning
+    whether a delivery limit was reached.
+
+    """
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    return _reap(tasks)
+
+
+def _reap(tasks):
+    """
+    Remove the completed delivery ``tasks`` (raising their exceptions),
+    returning whether a delivery limit was reached.
+
+    """
+    stop = False
+    for task in [task for task in tasks if task.done()]:
+        tasks.discard(task)
+        stop = task.result() or stop
+    return stop
+
+
+def _close_db():
+    # Resolved in the database thread (the connection is thread local).
+    db_connection.close()
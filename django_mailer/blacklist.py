@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+An in-memory cache of the blacklist, so the delivery loop can check each
+recipient without querying (or scanning) the ``Blacklist`` table.
+
+"""
+from django_mailer import models
+
+
+def normalize(address):
+    """
+    Return the case-folded form of an email address (or blacklisted domain)
+    used for comparisons.
+
+    """
+    return address.strip().lower()
+
+
+def get_domain(address):
+    """
+    Return the domain part of an email address.
+
+    """
+    return address.rpartition('@')[2]
+
+
+class BlacklistCache(object):
+    """
+    The blacklisted email addresses and domains, as sets.
+
+    An entry starting with ``@`` (for example ``@example.com``) blacklists
+    every address at that domain. Comparisons are case-insensitive.
+
+    The cache is loaded by ``refresh``, which only fetches the entries added
+    since the previous refresh (the whole table is reloaded if entries were
+    removed or otherwise missed).
+
+    """
+
+    def __init__(self):
+        self.addresses = frozenset()
+        self.domains = frozenset()
+        self.last_added = None
+        self.loaded = 0
+
+    def __contains__(self, address):
+        address = normalize(address)
+        return (address in self.addresses or
+                '@' + get_domain(address) in self.domains)
+
+    def __len__(self):
+        return len(self.addresses) + len(self.domains)
+
+    def refresh(self):
+        """
+        Bring the cache up to date with the ``Blacklist`` table.
+
+        """
+        entries = models.Blacklist.objects.order_by()
+        if self.last_added is not None:
+            entries = entries.filter(date_added__gt=self.last_added)
+        addresses, domains = set(self.addresses), set(self.domains)
+        loaded = self.loaded
+        last_added = self.last_added
+        for email, date_added in entries.values_list('email', 'date_added'):
+            email = normalize(email)
+            if email.startswith('@'):
+                domains.add(email)
+            else:
+                addresses.add(email)
+            loaded += 1
+            if last_added is None or date_added > last_added:
+                last_added = date_added
+        if self.last_added is not None and \
+                loaded != models.Blacklist.objects.count():
+            self.clear()
+            return self.refresh()
+        self.addresses = frozenset(addresses)
+        self.domains = frozenset(domains)
+        self.last_added = last_added
+        self.loaded = loaded
+
+    def clear(self):
+        """
+        Empty the cache, so the next refresh reloads the whole table.
+
+        """
+        self.__init__()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Admin change lists for very large tables (see the
+``MAILER_ADMIN_LARGE_TABLES`` setting).
+
+Django's change list counts the rows of the table (twice when filtered),
+pages through them with ``OFFSET`` and runs aggregate queries for its date
+hierarchy, all of which take longer the larger the table grows. The
+``KeysetChangeList`` instead estimates the table's size from the database
+statistics, counts filtered rows only up to ``COUNT_LIMIT``, pages through
+the rows newest first by primary key (with "previous" and "next" links
+rather than page numbers) and leaves out the date hierarchy.
+
+"""
+from django.contrib.admin.views.main import IGNORED_PARAMS, ChangeList
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django_mailer import settings
+
+# The query string parameters holding the primary key the page starts after
+# (or ends before).
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+# Filtered rows are counted up to this many.
+COUNT_LIMIT = 1000
+
+
+def estimated_count(queryset):
+    """
+    Return the approximate number of rows in the table of a queryset's
+    model, from the database statistics if it keeps them (otherwise from
+    the highest primary key).
+
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    cursor = connection.cursor()
+    row = None
+    try:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples FROM pg_class "
+                           "WHERE oid = %s::regclass",
+                           [connection.ops.quote_name(table)])
+            row = cursor.fetchone()
+        elif connection.vendor == 'mysql':
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() "
+                           "AND table_name = %s", [table])
+            row = cursor.fetchone()
+        elif connection.vendor == 'sqlite':
+            # Only kept once the database has been analyzed.
+            cursor.execute("SELECT name FROM sqlite_master "
+                           "WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s",
+                               [table])
+                row = cursor.fetchone()
+                if row:
+                    row = (row[0].split()[0],)
+    except DatabaseError:
+        row = None
+    # Tables which were never analyzed may have no (or a negative) estimate.
+    if row and row[0] is not None and int(row[0]) >= 0:
+        return int(row[0])
+    last_pk = queryset.model._default_manager.db_manager(queryset.db)\
+        .order_by('-pk').values_list('pk', flat=True)[:1]
+    return last_pk[0] if last_pk else 0
+
+
+def limited_count(queryset, limit=COUNT_LIMIT):
+    """
+    Return the number of rows of a queryset, counting no further than
+    ``limit + 1``.
+
+    """
+    return len(queryset.order_by().values_list('pk', flat=True)[:limit + 1])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator with a given (estimated) count, which never counts the
+    rows itself.
+
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super(EstimatedCountPaginator, self).__init__(object_list, per_page,
+                                                      **kwargs)
+        self.estimated_count = count
+
+    @property
+    def count(self):
+        return self.estimated_count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    A change list paging through rows by primary key, newest first, with
+    estimated counts and no date hierarchy.
+
+    """
+    keyset = True
+
+    def __init__(self, request, model, list_display, list_display_links,
+                 list_filter, date_hierarchy, *args):
+        self.after = self._cursor(request, AFTER_VAR)
+        self.before = self._cursor(request, BEFORE_VAR)
+        # The date hierarchy's aggregate queries scan the whole table.
+        super(KeysetChangeList, self).__init__(
+            request, model, list_display, list_display_links, list_filter,
+            None, *args)
+
+    def _cursor(self, request, name):
+        try:
+            return int(request.GET[name])
+        except (KeyError, ValueError):
+            return None
+
+    def get_filters_params(self, params=None):
+        if hasattr(ChangeList, 'get_filters_params'):
+            lookup_params = super(KeysetChangeList, self).get_filters_params(
+                params)
+        else:
+            # Django version < 1.6
+            lookup_params = dict(params or self.params)
+            for name in IGNORED_PARAMS:
+                lookup_params.pop(name, None)
+        for name in (AFTER_VAR, BEFORE_VAR):
+            lookup_params.pop(name, None)
+        return lookup_params
+
+    if not hasattr(ChangeList, 'get_filters_params'):
+        # Django version < 1.6 filters on all the query string parameters.
+        def get_filters(self, request):
+            params = self.params
+            self.params = self.get_filters_params()
+            try:
+                return super(KeysetChangeList, self).get_filters(request)
+            finally:
+                self.params = params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Links to other filters, orderings or searches start from the top.
+        remove = list(remove or []) + [
+            name for name in (AFTER_VAR, BEFORE_VAR)
+            if name not in (new_params or {})]
+        return super(KeysetChangeList, self).get_query_string(new_params,
+                                                              remove)
+
+    def get_ordering(self, request, queryset):
+        return ['-pk']
+
+    def get_results(self, request):
+        per_page = self.list_per_page
+        if hasattr(self, 'queryset'):
+            queryset, root_queryset = self.queryset, self.root_queryset
+        else:
+            # Django version < 1.6
+            queryset, root_queryset = self.query_set, self.root_query_set
+        filtered_queryset = queryset
+        if self.before is not None:
+            rows = list(queryset.filter(pk__gt=self.before)
+                        .order_by('pk')[:per_page + 1])
+            has_previous = len(rows) > per_page
+            rows = rows[:per_page][::-1]
+            has_next = True
+        else:
+            if self.after is not None:
+                queryset = queryset.filter(pk__lt=self.after)
+            rows = list(queryset[:per_page + 1])
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
+            has_previous = self.after is not None
+
+        self.full_result_count = estimated_count(root_queryset)
+        if self.get_filters_params() or self.query:
+            self.result_count = limited_count(filtered_queryset)
+            self.result_count_display = (
+                '%s+' % COUNT_LIMIT if self.result_count > COUNT_LIMIT
+                else str(self.result_count))
+        else:
+            self.result_count = self.full_result_count
+            self.result_count_display = 'about %s' % self.result_count
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_next or has_previous
+        self.paginator = EstimatedCountPaginator(filtered_queryset, per_page,
+                                                 self.result_count)
+        self.previous_url = self.next_url = None
+        if has_previous and rows:
+            self.previous_url = self.get_query_string(
+                {BEFORE_VAR: rows[0].pk}, [AFTER_VAR])
+        if has_next and rows:
+            self.next_url = self.get_query_string(
+                {AFTER_VAR: rows[-1].pk}, [BEFORE_VAR])
+
+
+class LargeTableAdminMixin(object):
+    """
+    A ``ModelAdmin`` mixin using the ``KeysetChangeList`` when the
+    ``MAILER_ADMIN_LARGE_TABLES`` setting is enabled.
+
+    """
+    change_list_template = 'django_mailer/change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        if settings.ADMIN_LARGE_TABLES:
+            return KeysetChangeList
+        return super(LargeTableAdminMixin, self).get_changelist(request,
+                                                                **kwargs)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Compression of stored message bodies (see the ``MAILER_COMPRESS_MESSAGES``
+setting).
+
+Compressed bodies are recognised by the magic number of their format, so
+bodies compressed with either codec can always be read back.
+
+"""
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils.encoding import force_bytes, force_text
+from django_mailer import settings
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+CODECS = ('zlib', 'zstd')
+
+# Compressed bodies are kept in a BinaryField, added in Django 1.6. With older
+# versions the ``compressed_message`` fields don't exist.
+AVAILABLE = hasattr(models, 'BinaryField')
+
+
+def get_codec():
+    """
+    Return the codec used to compress new message bodies, or ``None`` if they
+    are stored uncompressed.
+
+    """
+    codec = settings.COMPRESS_MESSAGES
+    if not codec:
+        return None
+    if codec is True:
+        return 'zlib'
+    if not AVAILABLE:
+        raise ImproperlyConfigured("Compressing messages requires Django 1.6 "
+                                   "or later.")
+    if codec not in CODECS:
+        raise ImproperlyConfigured("MAILER_COMPRESS_MESSAGES must be one of "
+                                   "%s." % ', '.join(CODECS))
+    if codec == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured("The zstandard package is required to "
+                                   "compress messages with zstd.")
+    return codec
+
+
+def compress(encoded_message, codec='zlib'):
+    """
+    Compress an encoded message, returning bytes.
+
+    """
+    data = force_bytes(encoded_message)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def decompress(data):
+    """
+    Decompress bytes returned by ``compress``, returning the encoded message
+    as text.
+
+    """
+    data = bytes(data)
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImproperlyConfigured("The zstandard package is required to "
+                                       "read messages compressed with zstd.")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return force_text(data)
+
+
+def body_fields(encoded_message, codec=None):
+    """
+    Return the ``encoded_message`` and ``compressed_message`` field values
+    used to store an encoded message (only the former if compression isn't
+    available).
+
+    Unless a ``codec`` is given, the ``MAILER_COMPRESS_MESSAGES`` setting
+    decides whether the message is compressed.
+
+    """
+    codec = codec or get_codec()
+    if codec is None:
+        if not AVAILABLE:
+            return {'encoded_message': encoded_message}
+        return {'encoded_message': encoded_message,
+                'compressed_message': None}
+    return {'encoded_message': '',
+            'compressed_message': compress(encoded_message, codec)}
@@ -8,60 +8,200 @@ The "engine room" of django mailer.
 Methods here actually handle the sending of queued messages.
 
 """
-from django.utils.encoding import smart_str
-from django_mailer import constants, models, settings
+from django.db.models import Q
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django version < 1.6
+    from django.db.transaction import commit_on_success as atomic
+from django.utils import six
+from django.utils.six.moves import queue as Queue
+from django_mailer import constants, models, settings, streaming, wakeup
+from django_mailer.blacklist import BlacklistCache, get_domain
+from django_mailer.pool import pool
+from django_mailer.ratelimit import RateLimiter
+from django_mailer.routing import Router
+from django_mailer.scheduler import format_stats, get_scheduler
 from lockfile import FileLock, AlreadyLocked, LockTimeout
 from socket import error as SocketError
 import logging
+import math
 import os
+import signal
 import smtplib
+import socket
+import sys
 import tempfile
+import threading
 import time
-
-if constants.EMAIL_BACKEND_SUPPORT:
-    from django.core.mail import get_connection
-else:
-    from django.core.mail import SMTPConnection as get_connection
+import uuid
 
 LOCK_PATH = settings.LOCK_PATH or os.path.join(tempfile.gettempdir(),
                                                'send_mail')
 
 logger = logging.getLogger('django_mailer.engine')
 
+# Kept between runs so that only new blacklist entries need to be loaded.
+blacklist_cache = BlacklistCache()
+
+
+def _keyset_filter(key, before=False):
+    """
+    Return a ``Q`` object matching the queued messages which sort after (or
+    before) the ``(priority, date_queued, pk)`` queue position ``key``.
+
+    """
+    priority, date_queued, pk = key
+    op = before and 'lt' or 'gt'
+    return (Q(**{'priority__%s' % op: priority}) |
+            Q(**{'priority': priority, 'date_queued__%s' % op: date_queued}) |
+            Q(**{'priority': priority, 'date_queued': date_queued,
+                 'pk__%s' % op: pk}))
+
 
-def _message_queue(block_size):
+def _message_blocks(block_size):
     """
-    A generator which iterates queued messages in blocks so that new
+    A generator which yields blocks (lists) of queued messages so that new
     prioritised messages can be inserted during iteration of a large number of
     queued messages.
 
-    To avoid an infinite loop, yielded messages *must* be deleted or deferred.
+    Blocks are paged through by keyset on ``(priority, date_queued, id)``, so
+    fetching a block costs the same however large the queue is. Before moving
+    on to the next block, any messages which sort before the current position
+    (newly queued higher priority messages or time-delayed messages which are
+    now due) are yielded first.
+
+    The next block is only fetched once the previous one has been handled, so
+    to avoid an infinite loop, yielded messages *must* be deleted or deferred
+    by then.
 
     """
-    def get_block():
-        queue = models.QueuedMessage.objects.non_deferred().select_related()
+    def get_block(*args):
+        # The queryset is rebuilt each time so that "future" messages which
+        # have become due are included.
+        queue = models.QueuedMessage.objects.non_deferred()\
+            .with_message().filter(*args)\
+            .order_by('priority', 'date_queued', 'pk')
         if block_size:
             queue = queue[:block_size]
-        return queue
-    queue = get_block()
-    while queue:
-        for message in queue:
-            yield message
-        queue = get_block()
+        return list(queue)
+    position = None
+    while True:
+        if position is None:
+            block = get_block()
+        else:
+            block = get_block(_keyset_filter(position, before=True))
+            if not block:
+                block = get_block(_keyset_filter(position))
+        if not block:
+            break
+        last = block[-1]
+        key = (last.priority, last.date_queued, last.pk)
+        if position is None or key > position:
+            position = key
+        yield block
+
+
+def _lease_owner():
+    """
+    Return an identifier for this sending process, unique across hosts.
+
+    """
+    return ('%s:%s:%s' % (socket.gethostname(), os.getpid(),
+                          uuid.uuid4().hex[:8]))[-100:]
+
+
+def _claimed_blocks(block_size, owner):
+    """
+    A generator which leases blocks of queued messages to ``owner`` (see
+    ``QueueManager.claim``) and yields them as lists.
+
+    The next block is only claimed once the previous one has been handled,
+    and the generator only stops when no message is left to claim. Messages
+    which are neither deleted nor deferred stay leased until they are
+    released or their lease expires.
+
+    """
+    scheduler = get_scheduler()
+
+    def get_block():
+        limit = block_size or 500
+        if scheduler is None:
+            return list(models.QueuedMessage.objects.claim(owner, limit)
+                        .with_message())
+        while True:
+            pks = scheduler.select(models.QueuedMessage.objects.claimable(),
+                                   limit)
+            if not pks:
+                return []
+            block = list(models.QueuedMessage.objects.claim(
+                owner, limit, pks=pks).with_message())
+            if block:
+                order = dict((pk, i) for i, pk in enumerate(pks))
+                block.sort(
+                    key=lambda queued_message: order[queued_message.pk])
+                return block
+            # Other senders claimed the selected messages first, the
+            # scheduler chooses again from the messages which are left.
+    block = get_block()
+    while block:
+        yield block
+        block = get_block()
+
+
+def _scheduled_blocks(block_size, scheduler):
+    """
+    A generator which yields blocks (lists) of queued messages chosen by the
+    ``scheduler`` (see ``django_mailer.scheduler``), in the order they should
+    be sent.
+
+    Each block is chosen from the whole queue, so to avoid an infinite loop,
+    yielded messages *must* be deleted or deferred before the next block is
+    fetched.
+
+    """
+    while True:
+        queue = models.QueuedMessage.objects.non_deferred()
+        pks = scheduler.select(queue, block_size)
+        if not pks:
+            break
+        messages = dict((queued_message.pk, queued_message)
+                        for queued_message in queue.with_message()
+                        .filter(pk__in=pks))
+        block = [messages[pk] for pk in pks if pk in messages]
+        if block:
+            yield block
+
+
+def _queue_blocks(block_size):
+    """
+    Return a generator of the blocks of queued messages to send from the
+    (locked) queue: in strict priority order, or chosen by the scheduler if
+    the ``MAILER_PRIORITY_WEIGHTS`` or ``MAILER_PRIORITY_MAX_AGE`` settings
+    are used.
+
+    """
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return _message_blocks(block_size)
+    return _scheduled_blocks(block_size, scheduler)
 
 
 def _limits_reached(sent, deferred):
     """
     Evaluate if any of the queue limits has been reached.
 
-    Returns True if any has been reached.
+    Returns True if any has been reached. The counts grow by a whole
+    transaction at a time, so they may go past a limit.
     """
-    if settings.EMAIL_MAX_SENT == sent:
+    if settings.EMAIL_MAX_SENT is not None and \
+            sent >= settings.EMAIL_MAX_SENT:
         logger.info("Stopping delivery. MAILER_EMAIL_MAX_SENT "
                     " (%s) reached." % settings.EMAIL_MAX_SENT)
         return True
 
-    if settings.EMAIL_MAX_DEFERRED == deferred:
+    if settings.EMAIL_MAX_DEFERRED is not None and \
+            deferred >= settings.EMAIL_MAX_DEFERRED:
         logger.warning("Stopping delivery. MAILER_EMAIL_MAX_DEFERRED "
                        " (%s) reached." % settings.EMAIL_MAX_DEFERRED)
         return True
@@ -78,16 +218,480 @@ def _throttle_emails():
         time.sleep(settings.EMAIL_THROTTLE)
 
 
-def send_all(block_size=500, backend=None):
+class ResultBuffer(object):
     """
-    Send all non-deferred messages in the queue.
+    Collects the outcomes of delivery attempts and writes them to the
+    database in batches: the ``Log`` entries with a bulk insert and the sent
+    (or skipped) messages removed from the queue with a single ``DELETE``.
 
-    A lock file is used to ensure that this process can not be started again
-    while it is already running.
+    Deferred messages are still updated straight away.
 
-    The ``block_size`` argument allows for queued messages to be iterated in
-    blocks, allowing new prioritised messages to be inserted during iteration
-    of a large number of queued messages.
+    The buffer is flushed once it holds ``size`` outcomes or ``interval``
+    seconds after the previous flush (checked as outcomes are added). The
+    defaults are retrieved from the ``MAILER_RESULT_BATCH_SIZE`` and
+    ``MAILER_RESULT_FLUSH_INTERVAL`` settings. Callers must ``flush`` when
+    they are done, including when an exception is raised.
+
+    """
+
+    def __init__(self, size=None, interval=None):
+        if size is None:
+            size = settings.RESULT_BATCH_SIZE
+        if interval is None:
+            interval = settings.RESULT_FLUSH_INTERVAL
+        self.size = max(size, 1)
+        self.interval = interval
+        self.logs = []
+        self.delete_ids = []
+        self.last_flush = time.time()
+
+    def __len__(self):
+        return max(len(self.logs), len(self.delete_ids))
+
+    def add(self, queued_message, result, log_message, log=True):
+        """
+        Record the outcome of a delivery attempt.
+
+        """
+        if result == constants.RESULT_FAILED:
+            queued_message.defer()
+        else:
+            self.delete_ids.append(queued_message.pk)
+        if log:
+            self.logs.append(models.Log(message=queued_message.message,
+                                        result=result,
+                                        log_message=log_message))
+        if len(self) >= self.size or (
+                self.interval is not None and
+                time.time() - self.last_flush >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered outcomes to the database.
+
+        """
+        delete_ids, self.delete_ids = self.delete_ids, []
+        logs, self.logs = self.logs, []
+        self.last_flush = time.time()
+        if not (delete_ids or logs):
+            return
+        with atomic():
+            # Keep clear of SQLite's limit on the number of query parameters.
+            for start in range(0, len(delete_ids), 500):
+                models.QueuedMessage.objects.filter(
+                    pk__in=delete_ids[start:start + 500]).delete()
+            models.Log.objects.bulk_create(logs)
+
+
+def _remove_blacklisted(block, blacklist, record):
+    """
+    Skip (and record) the messages of a block whose recipient is blacklisted,
+    returning a ``(messages, skipped)`` tuple of the remaining messages and
+    the number skipped.
+
+    """
+    messages = []
+    for queued_message in block:
+        if _is_blacklisted(queued_message.message, blacklist):
+            _skip_blacklisted(queued_message, record=record)
+        else:
+            messages.append(queued_message)
+    return messages, len(block) - len(messages)
+
+
+def _apply_rate_limits(messages, limiter):
+    """
+    Hold back the messages whose recipient domain or sender is over its rate
+    limit (see ``ratelimit.RateLimiter``), returning the messages to send
+    now. The others stay queued but are scheduled for when their buckets
+    have refilled, so that they aren't fetched again in the meantime.
+
+    """
+    if limiter is None:
+        return messages
+    allowed = []
+    held = {}
+    for queued_message in messages:
+        if limiter.allow(queued_message.message):
+            allowed.append(queued_message)
+        else:
+            delay = int(math.ceil(limiter.retry_after(queued_message.message)))
+            held.setdefault(delay, []).append(queued_message.pk)
+    for delay, pks in held.items():
+        for start in range(0, len(pks), 500):
+            models.QueuedMessage.objects.filter(
+                pk__in=pks[start:start + 500]).postpone(delay)
+    held = len(messages) - len(allowed)
+    if held:
+        logger.info("%s message%s held back by rate limits." %
+                    (held, held != 1 and 's' or ''))
+    return allowed
+
+
+def _transaction_key(message):
+    """
+    Return the key identifying messages which can share an SMTP transaction:
+    the sender and the (stored) body.
+
+    Messages keeping their content in their own row are identified by its
+    ``content_hash``, so that the content doesn't need to be loaded. Those
+    queued before it was recorded are sent on their own.
+
+    """
+    if message.stored_message:
+        body = ('stored', message.stored_message)
+    elif message.body_id is not None:
+        body = ('body', message.body_id)
+    elif message.content_hash:
+        body = ('hash', message.content_hash)
+    else:
+        body = ('message', message.pk)
+    return message.from_address, body
+
+
+def _fetch_body(transaction):
+    """
+    Load the content shared by the messages of a transaction (see
+    ``Message.fetch_body``), right before it is handed to the backend.
+
+    """
+    transaction[0].message.fetch_body()
+
+
+def _release_body(transaction):
+    """
+    Forget the content of the messages of a transaction once it was sent.
+
+    """
+    transaction[0].message.release_body()
+
+
+def _transactions(queued_messages, allowance=None):
+    """
+    A generator which splits queued messages into the lists of messages to
+    send in each SMTP transaction.
+
+    Messages with the same sender and body are sent together, to up to
+    ``MAILER_MAX_RECIPIENTS_PER_TRANSACTION`` distinct recipients. If given,
+    the ``allowance`` callable is checked before each transaction and returns
+    the maximum number of messages it may hold (or ``None`` for no limit).
+
+    """
+    limit = settings.MAX_RECIPIENTS_PER_TRANSACTION
+    if limit == 1:
+        for queued_message in queued_messages:
+            yield [queued_message]
+        return
+    groups = {}
+    ordered_groups = []
+    for queued_message in queued_messages:
+        key = _transaction_key(queued_message.message)
+        if key not in groups:
+            groups[key] = []
+            ordered_groups.append(groups[key])
+        groups[key].append(queued_message)
+    for group in ordered_groups:
+        while group:
+            size = limit
+            remaining = allowance and allowance()
+            if remaining is not None:
+                size = min(size, max(remaining, 1))
+            transaction, addresses, rest = [], set(), []
+            for queued_message in group:
+                address = queued_message.message.to_address
+                if len(transaction) < size and address not in addresses:
+                    transaction.append(queued_message)
+                    addresses.add(address)
+                else:
+                    rest.append(queued_message)
+            group = rest
+            yield transaction
+
+
+class _DeliveryWorker(threading.Thread):
+    """
+    A delivery thread with its own backend connection (from the connection
+    pool) to ``destination`` (see ``routing.Destination``).
+
+    Transactions (lists of queued messages, see ``_transactions``) are taken
+    from the ``tasks`` queue until a ``None`` is received and their outcomes
+    are put on the ``results`` queue as a ``(destination, transaction,
+    outcomes, exc_info)`` tuple, where ``outcomes`` is a list of ``(result,
+    log_message)`` tuples. Database access is left to the thread which
+    handles the results.
+
+    """
+
+    def __init__(self, destination, tasks, results):
+        super(_DeliveryWorker, self).__init__()
+        self.daemon = True
+        self.destination = destination
+        self.tasks = tasks
+        self.results = results
+
+    def run(self):
+        connection = pool.acquire(self.destination.backend,
+                                  **self.destination.kwargs)
+        try:
+            while True:
+                transaction = self.tasks.get()
+                if transaction is None:
+                    break
+                try:
+                    outcomes = _deliver_many(
+                        [queued_message.message
+                         for queued_message in transaction], connection)
+                except Exception:
+                    self.results.put((self.destination, transaction, None,
+                                      sys.exc_info()))
+                    continue
+                self.results.put((self.destination, transaction, outcomes,
+                                  None))
+                # Delay next message based on user settings
+                _throttle_emails()
+        finally:
+            pool.release(connection)
+
+
+class _Lane(object):
+    """
+    The delivery threads sending to one destination, sharing a queue of
+    transactions.
+
+    """
+
+    def __init__(self, destination, workers, results):
+        self.destination = destination
+        self.tasks = Queue.Queue()
+        # The number of transactions handed out and not yet reported.
+        self.in_flight = 0
+        self.threads = [_DeliveryWorker(destination, self.tasks, results)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, transaction):
+        self.tasks.put(transaction)
+        self.in_flight += 1
+
+    def close(self):
+        for thread in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def _send_parallel(blocks, router, workers, blacklist, result_buffer,
+                   stopped):
+    """
+    Send the queued messages from ``blocks`` using ``workers`` delivery
+    threads per destination (see ``routing.Router``), each with its own
+    backend connection.
+
+    Each destination gets its own lane of threads, so a slow destination
+    only holds back its own messages. Up to ``MAILER_MAX_DESTINATIONS``
+    lanes are open at once; idle ones are closed to make room for others.
+
+    Transactions are handed out one at a time so the workers always work on
+    disjoint messages, and a block is completely handled before the next one
+    is fetched. The results are recorded in the ``result_buffer`` (and
+    counted) by the calling thread, which also never lets more messages be in
+    flight than the remaining ``MAILER_EMAIL_MAX_SENT`` allowance. No more
+    transactions are handed out once ``stopped()`` returns true.
+
+    Returns a ``(sent, deferred, skipped)`` tuple.
+
+    """
+    results = Queue.Queue()
+    lanes = {}
+
+    def open_lane(destination, pending):
+        if len(lanes) >= max(settings.MAX_DESTINATIONS, 1):
+            idle = [lane for lane in lanes.values() if not lane.in_flight]
+            # Keep the lanes which still have transactions to send if
+            # possible.
+            idle.sort(key=lambda lane: lane.destination in pending)
+            if not idle:
+                return None
+            del lanes[idle[0].destination]
+            idle[0].close()
+        lanes[destination] = _Lane(destination, workers, results)
+        return lanes[destination]
+
+    sent = deferred = skipped = 0
+    # The number of messages in flight.
+    in_flight = [0]
+
+    def allowance():
+        if settings.EMAIL_MAX_SENT is None:
+            return None
+        return settings.EMAIL_MAX_SENT - sent - in_flight[0]
+    limiter = RateLimiter.from_settings()
+    stop = False
+    exc_info = None
+    try:
+        for block in blocks:
+            messages, block_skipped = _remove_blacklisted(
+                block, blacklist, result_buffer.add)
+            skipped += block_skipped
+            messages = _apply_rate_limits(messages, limiter)
+            pending = [(destination, _transactions(group, allowance))
+                       for destination, group in router.group(messages)]
+            while True:
+                if stopped():
+                    stop = True
+                for destination, transactions in list(pending):
+                    lane = lanes.get(destination)
+                    if lane is None:
+                        if stop or (allowance() is not None and
+                                    allowance() <= 0):
+                            break
+                        lane = open_lane(destination, dict(pending))
+                        if lane is None:
+                            continue
+                    while not stop and lane.in_flight < workers * 2 and (
+                            allowance() is None or allowance() > 0):
+                        try:
+                            transaction = next(transactions)
+                        except StopIteration:
+                            pending.remove((destination, transactions))
+                            break
+                        _fetch_body(transaction)
+                        lane.put(transaction)
+                        in_flight[0] += len(transaction)
+                if not any(lane.in_flight for lane in lanes.values()):
+                    break
+                destination, transaction, outcomes, error = results.get()
+                lanes[destination].in_flight -= 1
+                in_flight[0] -= len(transaction)
+                _release_body(transaction)
+                if error:
+                    # Stop handing out messages, but keep recording the
+                    # results of those already in flight.
+                    if issubclass(error[0], ConnectionLost):
+                        if not stop:
+                            _log_connection_lost(error[1])
+                    else:
+                        exc_info = exc_info or error
+                    stop = True
+                    continue
+                for queued_message, (result, log_message) in zip(transaction,
+                                                                 outcomes):
+                    result_buffer.add(queued_message, result, log_message)
+                    if result == constants.RESULT_SENT:
+                        sent += 1
+                    elif result == constants.RESULT_FAILED:
+                        deferred += 1
+                if _limits_reached(sent, deferred):
+                    stop = True
+            # The block must be recorded before the next one is fetched.
+            result_buffer.flush()
+            if stop:
+                break
+    finally:
+        for lane in lanes.values():
+            lane.close()
+    if exc_info:
+        six.reraise(*exc_info)
+    return sent, deferred, skipped
+
+
+def _send_serial(blocks, backend, blacklist, result_buffer, stopped):
+    """
+    Send the queued messages from ``blocks`` one transaction at a time over a
+    single backend connection (from the connection pool), recording the
+    results in the ``result_buffer``, until ``stopped()`` returns true.
+
+    Returns a ``(sent, deferred, skipped)`` tuple.
+
+    """
+    sent = deferred = skipped = 0
+
+    def allowance():
+        if settings.EMAIL_MAX_SENT is None:
+            return None
+        return settings.EMAIL_MAX_SENT - sent
+    limiter = RateLimiter.from_settings()
+    connection = pool.acquire(backend)
+    stop = False
+    try:
+        for block in blocks:
+            messages, block_skipped = _remove_blacklisted(
+                block, blacklist, result_buffer.add)
+            skipped += block_skipped
+            messages = _apply_rate_limits(messages, limiter)
+            for transaction in _transactions(messages, allowance):
+                if stopped():
+                    stop = True
+                    break
+                _fetch_body(transaction)
+                try:
+                    outcomes = _deliver_many(
+                        [queued_message.message
+                         for queued_message in transaction], connection)
+                except ConnectionLost as err:
+                    _log_connection_lost(err)
+                    stop = True
+                    break
+                finally:
+                    _release_body(transaction)
+                for queued_message, (result, log_message) in zip(
+                        transaction, outcomes):
+                    result_buffer.add(queued_message, result, log_message)
+                    if result == constants.RESULT_SENT:
+                        sent += 1
+                    elif result == constants.RESULT_FAILED:
+                        deferred += 1
+
+                if _limits_reached(sent, deferred):
+                    stop = True
+                    break
+
+                # Delay next message based on user settings
+                _throttle_emails()
+            # The block must be recorded before the next one is fetched.
+            result_buffer.flush()
+            if stop:
+                break
+    except Exception:
+        # The connection may be left in an unknown state.
+        pool.discard(connection)
+        raise
+
+    pool.release(connection)
+    return sent, deferred, skipped
+
+
+def _open_queue(block_size):
+    """
+    Get exclusive access to the queue for sending, returning a ``(blocks,
+    release)`` tuple of the generator of message blocks to send and the
+    function to call when done, or ``None`` if the lock is already held.
+
+    The lock file is acquired unless the ``MAILER_LEASE_QUEUE`` setting is
+    enabled, in which case blocks of messages are leased instead.
+
+    """
+    if settings.LEASE_QUEUE:
+        owner = _lease_owner()
+        logger.debug("Leasing queued messages as %s." % owner)
+
+        def release():
+            logger.debug("Releasing leased messages...")
+            models.QueuedMessage.objects.release(owner)
+            logger.debug("Leased messages released.")
+        return _claimed_blocks(block_size, owner), release
+
+    lock = _acquire_lock()
+    if lock is None:
+        return None
+    return _queue_blocks(block_size), lambda: _release_lock(lock)
+
+
+def _acquire_lock():
+    """
+    Acquire the lock file, returning it (or ``None`` if it is already held).
 
     """
     lock = FileLock(LOCK_PATH)
@@ -99,55 +703,108 @@ def send_all(block_size=500, backend=None):
         lock.acquire(settings.LOCK_WAIT_TIMEOUT)
     except AlreadyLocked:
         logger.debug("Lock already in place. Exiting.")
-        return
+        return None
     except LockTimeout:
         logger.debug("Waiting for the lock timed out. Exiting.")
-        return
+        return None
     logger.debug("Lock acquired.")
+    return lock
+
+
+def _release_lock(lock):
+    logger.debug("Releasing lock...")
+    lock.release()
+    logger.debug("Lock released.")
+
+
+def send_all(block_size=500, backend=None, workers=None):
+    """
+    Send all non-deferred messages in the queue.
+
+    A lock file is used to ensure that this process can not be started again
+    while it is already running. If the ``MAILER_LEASE_QUEUE`` setting is
+    enabled, blocks of messages are leased in the database instead, so that
+    several processes (on several hosts) can safely send the queue at the
+    same time.
+
+    The ``block_size`` argument allows for queued messages to be iterated in
+    blocks, allowing new prioritised messages to be inserted during iteration
+    of a large number of queued messages.
+
+    The ``workers`` argument sets how many delivery threads (each with its
+    own backend connection) are used, per destination if the
+    ``MAILER_ROUTES`` setting is used. The default is retrieved from the
+    ``MAILER_DELIVERY_WORKERS`` setting.
+
+    """
+    queue = _open_queue(block_size)
+    if queue is None:
+        return
+    blocks, release = queue
+    try:
+        _send_queue(blocks, backend, workers)
+    finally:
+        release()
+
+
+def _send_queue(blocks, backend=None, workers=None, stopped=None):
+    """
+    Send the queued messages from ``blocks`` (the queue must already be
+    locked or leased) and log the totals, returning a ``(sent, deferred,
+    skipped)`` tuple.
+
+    If a ``stopped`` function is given, it is checked between transactions
+    and sending stops (once the results so far are recorded) when it returns
+    true.
+
+    """
+    if workers is None:
+        workers = settings.DELIVERY_WORKERS
+    if stopped is None:
+        stopped = lambda: False
 
     start_time = time.time()
 
     sent = deferred = skipped = 0
 
+    result_buffer = ResultBuffer()
     try:
-        if constants.EMAIL_BACKEND_SUPPORT:
-            connection = get_connection(backend=backend)
+        blacklist_cache.refresh()
+        blacklist = blacklist_cache
+        router = Router.from_settings(backend)
+        # Routed messages are sent over one lane of threads per destination.
+        if workers > 1 or router.routes:
+            sent, deferred, skipped = _send_parallel(
+                blocks, router, workers, blacklist, result_buffer, stopped)
         else:
-            connection = get_connection()
-        blacklist = models.Blacklist.objects.values_list('email', flat=True)
-        connection.open()
-        for message in _message_queue(block_size):
-            result = send_queued_message(message, smtp_connection=connection,
-                                  blacklist=blacklist)
-            if result == constants.RESULT_SENT:
-                sent += 1
-            elif result == constants.RESULT_FAILED:
-                deferred += 1
-            elif result == constants.RESULT_SKIPPED:
-                skipped += 1
-
-            if _limits_reached(sent, deferred):
-                break
+            sent, deferred, skipped = _send_serial(
+                blocks, backend, blacklist, result_buffer, stopped)
+    finally:
+        result_buffer.flush()
 
-            # Delay next message based on user settings
-            _throttle_emails()
+    _log_totals(sent, deferred, skipped, start_time)
+    return sent, deferred, skipped
 
-        connection.close()
-    finally:
-        logger.debug("Releasing lock...")
-        lock.release()
-        logger.debug("Lock released.")
 
+def _log_totals(sent, deferred, skipped, start_time):
+    """
+    Log the outcome of a delivery run.
+
+    """
     logger.debug("")
     if sent or deferred or skipped:
         log = logger.warning
     else:
         log = logger.info
     log("%s sent, %s deferred, %s skipped." % (sent, deferred, skipped))
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        logger.info("Scheduled: %s." % format_stats(scheduler.pop_stats()))
     logger.debug("Completed in %.2f seconds." % (time.time() - start_time))
 
 
-def send_loop(empty_queue_sleep=None):
+def send_loop(empty_queue_sleep=None, block_size=500, backend=None,
+              workers=None):
     """
     Loop indefinitely, checking queue at intervals and sending and queued
     messages.
@@ -156,18 +813,85 @@ def send_loop(empty_queue_sleep=None):
     argument. The default is attempted to be retrieved from the
     ``MAILER_EMPTY_QUEUE_SLEEP`` setting (or if not set, 30s is used).
 
+    While the queue is empty, the wait starts at
+    ``MAILER_EMPTY_QUEUE_MIN_SLEEP`` seconds and doubles after each check up
+    to this interval. Queuing new mail wakes the loop up immediately (see
+    ``django_mailer.wakeup``).
+
+    The lock file is held for as long as the loop runs (unless the
+    ``MAILER_LEASE_QUEUE`` setting is enabled) and backend connections are
+    kept open between runs by the connection pool. When a ``SIGTERM`` is
+    received, the loop returns once the transaction being sent is done and
+    recorded, releasing the queue.
+
     """
     empty_queue_sleep = empty_queue_sleep or settings.EMPTY_QUEUE_SLEEP
-    while True:
-        while not models.QueuedMessage.objects.all():
-            logger.debug("Sleeping for %s seconds before checking queue "
-                          "again." % empty_queue_sleep)
-            time.sleep(empty_queue_sleep)
-        send_all()
+    min_sleep = max(min(settings.EMPTY_QUEUE_MIN_SLEEP, empty_queue_sleep),
+                    0.01)
+    lock = None
+    if not settings.LEASE_QUEUE:
+        lock = _acquire_lock()
+        if lock is None:
+            return
+    listener = wakeup.QueueListener()
+    stopping = []
+
+    def stop(signum, frame):
+        logger.info("Received signal %s, stopping." % signum)
+        stopping.append(signum)
+        listener.interrupt()
+
+    try:
+        previous_handler = signal.signal(signal.SIGTERM, stop)
+    except ValueError:
+        # Signals can only be handled in the main thread.
+        previous_handler = None
+    sleep = min_sleep
+    try:
+        while not stopping:
+            if _queue_ready():
+                if lock is None:
+                    queue = _open_queue(block_size)
+                else:
+                    queue = _queue_blocks(block_size), lambda: None
+                blocks, release = queue
+                try:
+                    totals = _send_queue(blocks, backend, workers,
+                                         lambda: bool(stopping))
+                finally:
+                    release()
+                if any(totals):
+                    sleep = min_sleep
+                    continue
+            logger.debug("Sleeping for up to %s seconds before checking queue "
+                         "again." % sleep)
+            if listener.wait(sleep):
+                sleep = min_sleep
+            else:
+                sleep = min(sleep * 2, empty_queue_sleep)
+    finally:
+        if previous_handler is not None:
+            signal.signal(signal.SIGTERM, previous_handler)
+        listener.close()
+        if lock is not None:
+            _release_lock(lock)
+
+
+def _queue_ready():
+    """
+    Return whether there are messages ready to be sent, without counting (or
+    loading) them.
+
+    """
+    if settings.LEASE_QUEUE:
+        queue = models.QueuedMessage.objects.claimable()
+    else:
+        queue = models.QueuedMessage.objects.non_deferred()
+    return queue.exists()
 
 
 def send_queued_message(queued_message, smtp_connection=None, blacklist=None,
-                 log=True):
+                 log=True, result_buffer=None):
     """
     Send a queued message, returning a response code as to the action taken.
 
@@ -177,9 +901,10 @@ def send_queued_message(queued_message, smtp_connection=None, blacklist=None,
     successful sent message.
 
     To allow optimizations if multiple messages are to be sent, an SMTP
-    connection can be provided and a list of blacklisted email addresses.
-    Otherwise an SMTP connection will be opened to send this message and the
-    email recipient address checked against the ``Blacklist`` table.
+    connection can be provided and a list of blacklisted email addresses (or a
+    ``BlacklistCache``). Otherwise an SMTP connection is taken from the
+    connection pool to send this message and the email recipient address
+    checked against the ``Blacklist`` table.
 
     If the message recipient is blacklisted, the message will be removed from
     the queue without being sent. Otherwise, the message is attempted to be
@@ -187,51 +912,207 @@ def send_queued_message(queued_message, smtp_connection=None, blacklist=None,
     deferred so it can be tried again later.
 
     By default, a log is created as to the action. Either way, the original
-    message is not deleted.
+    message is not deleted. If a ``ResultBuffer`` is provided, removing the
+    message from the queue and creating the log are left to it.
 
     """
     message = queued_message.message
+    if result_buffer is None:
+        record = _record_result
+    else:
+        record = result_buffer.add
+
+    if _is_blacklisted(message, blacklist):
+        _skip_blacklisted(queued_message, log=log, record=record)
+        return constants.RESULT_SKIPPED
     if smtp_connection is None:
-        smtp_connection = get_connection()
-    opened_connection = False
+        destination = Router.from_settings().destination(message)
+        connection = pool.acquire(destination.backend, **destination.kwargs)
+        try:
+            result, log_message = _deliver(message, connection)
+        finally:
+            pool.release(connection)
+    else:
+        result, log_message = _deliver(message, smtp_connection)
+    record(queued_message, result, log_message, log=log)
+    return result
+
 
+def _is_blacklisted(message, blacklist=None):
+    """
+    Check the message recipient against the ``blacklist`` (or against the
+    ``Blacklist`` table if no blacklist is provided).
+
+    """
     if blacklist is None:
-        blacklisted = models.Blacklist.objects.filter(email=message.to_address)
-    else:
-        blacklisted = message.to_address in blacklist
+        return models.Blacklist.objects.filter(
+            Q(email__iexact=message.to_address) |
+            Q(email__iexact='@' + get_domain(message.to_address))).exists()
+    return message.to_address in blacklist
 
-    log_message = ''
-    if blacklisted:
-        logger.info("Not sending to blacklisted email: %s" %
-                     message.to_address.encode("utf-8"))
-        queued_message.delete()
-        result = constants.RESULT_SKIPPED
+
+def _skip_blacklisted(queued_message, log=True, record=None):
+    """
+    Remove a queued message with a blacklisted recipient from the queue.
+
+    """
+    logger.info("Not sending to blacklisted email: %s" %
+                 queued_message.message.to_address.encode("utf-8"))
+    record = record or _record_result
+    record(queued_message, constants.RESULT_SKIPPED, '', log=log)
+
+
+def _deliver(message, smtp_connection):
+    """
+    Send a message over an SMTP connection, returning a
+    ``(result, log_message)`` tuple.
+
+    The connection is opened (and closed again afterwards) if it isn't
+    already open. The database is not touched.
+
+    """
+    try:
+        return _deliver_many([message], smtp_connection)[0]
+    except ConnectionLost as err:
+        logger.warning("Message to %s deferred due to failure: %s" %
+                        (message.to_address.encode("utf-8"), err))
+        return constants.RESULT_FAILED, six.text_type(err)
+
+
+def _deliver_many(messages, smtp_connection):
+    """
+    Send messages which share the same sender and body in a single SMTP
+    transaction (one ``RCPT TO`` per message), returning a list of
+    ``(result, log_message)`` tuples, one per message.
+
+    Recipients refused by the server fail individually.
+
+    The connection is opened (and closed again afterwards) if it isn't
+    already open. If the connection to the server is lost, it is reopened
+    (see ``_reconnect``) and the transaction retried once before the
+    messages fail; ``ConnectionLost`` is raised if it can't be reopened.
+    The database is not touched.
+
+    """
+    message = messages[0]
+    recipients = [m.to_address for m in messages]
+    opened_connection = False
+    if len(messages) == 1:
+        logger.info("Sending message to %s: %s" %
+                     (message.to_address.encode("utf-8"),
+                      message.subject.encode("utf-8")))
     else:
+        logger.info("Sending message to %s recipients: %s" %
+                     (len(messages), message.subject.encode("utf-8")))
+    retried = False
+    while True:
         try:
-            logger.info("Sending message to %s: %s" %
-                         (message.to_address.encode("utf-8"),
-                          message.subject.encode("utf-8")))
-            opened_connection = smtp_connection.open()
-            smtp_connection.connection.sendmail(message.from_address,
-                [message.to_address], smart_str(message.encoded_message))
-            queued_message.delete()
-            result = constants.RESULT_SENT
-        except (SocketError, smtplib.SMTPSenderRefused,
-                smtplib.SMTPRecipientsRefused,
-                smtplib.SMTPAuthenticationError,
+            opened_connection = smtp_connection.open() or opened_connection
+            refused = streaming.sendmail(smtp_connection.connection,
+                                         message, recipients) or {}
+            pool.sent(smtp_connection, len(messages))
+            failure = None
+        except smtplib.SMTPRecipientsRefused as err:
+            refused = err.recipients
+            failure = None
+        except (SocketError, smtplib.SMTPServerDisconnected,
+                smtplib.SMTPResponseException,
                 UnicodeEncodeError) as err:
-            queued_message.defer()
+            if _is_connection_error(err) and not retried:
+                if not _reconnect(smtp_connection, err):
+                    raise ConnectionLost(err)
+                retried = True
+                continue
+            refused = {}
+            failure = err
+        break
+
+    outcomes = []
+    for recipient in recipients:
+        if failure is None and recipient in refused:
+            err = smtplib.SMTPRecipientsRefused(
+                {recipient: refused[recipient]})
+        else:
+            err = failure
+        if err is None:
+            outcomes.append((constants.RESULT_SENT, ''))
+        else:
             logger.warning("Message to %s deferred due to failure: %s" %
-                            (message.to_address.encode("utf-8"), err))
-            log_message = unicode(err)
-            result = constants.RESULT_FAILED
-    if log:
-        models.Log.objects.create(message=message, result=result,
-                                  log_message=log_message)
+                            (recipient.encode("utf-8"), err))
+            outcomes.append((constants.RESULT_FAILED, six.text_type(err)))
 
     if opened_connection:
         smtp_connection.close()
-    return result
+    return outcomes
+
+
+class ConnectionLost(Exception):
+    """
+    The connection to the mail server was lost and couldn't be reopened.
+
+    """
+
+
+def _log_connection_lost(err):
+    logger.error("Stopping delivery, the connection to the mail server "
+                 "could not be reopened: %s" % err)
+
+
+def _is_connection_error(err):
+    """
+    Return whether an exception raised while sending means that the
+    connection to the server was lost (rather than the message failing).
+
+    """
+    if isinstance(err, (SocketError, smtplib.SMTPServerDisconnected)):
+        return True
+    # 421: the service is not available and is closing the connection.
+    return isinstance(err, smtplib.SMTPResponseException) and \
+        err.smtp_code == 421
+
+
+def _reconnect(smtp_connection, err):
+    """
+    Reopen a lost connection, trying up to ``MAILER_RECONNECT_ATTEMPTS``
+    times and waiting ``MAILER_RECONNECT_BACKOFF`` seconds (doubled each
+    time) between attempts. Returns whether the connection was reopened.
+
+    """
+    logger.warning("Lost the connection to the mail server (%s), "
+                   "reconnecting." % err)
+    delay = settings.RECONNECT_BACKOFF
+    for attempt in range(settings.RECONNECT_ATTEMPTS):
+        if attempt:
+            time.sleep(delay)
+            delay *= 2
+        try:
+            smtp_connection.close()
+        except Exception:
+            pass
+        try:
+            smtp_connection.open()
+        except (SocketError, smtplib.SMTPException) as err:
+            logger.warning("Reconnection attempt %s failed: %s" %
+                           (attempt + 1, err))
+            continue
+        if getattr(smtp_connection, 'connection', True) is not None:
+            return True
+    return False
+
+
+def _record_result(queued_message, result, log_message, log=True):
+    """
+    Update the queue with the outcome of a delivery attempt: failed messages
+    are deferred, others are removed from the queue.
+
+    """
+    if result == constants.RESULT_FAILED:
+        queued_message.defer()
+    else:
+        queued_message.delete()
+    if log:
+        models.Log.objects.create(message=queued_message.message,
+                                  result=result, log_message=log_message)
 
 
 def send_message(email_message, smtp_connection=None):
@@ -243,14 +1124,18 @@ def send_message(email_message, smtp_connection=None):
     ``RESULT_SENT`` for a successfully sent message.
 
     To allow optimizations if multiple messages are to be sent, an SMTP
-    connection can be provided. Otherwise an SMTP connection will be opened
-    to send this message.
+    connection can be provided. Otherwise an SMTP connection is taken from
+    the connection pool to send this message.
 
     This function does not perform any queueing.
 
     """
     if smtp_connection is None:
-        smtp_connection = get_connection()
+        connection = pool.acquire()
+        try:
+            return send_message(email_message, smtp_connection=connection)
+        finally:
+            pool.release(connection)
     opened_connection = False
 
     try:
@@ -258,6 +1143,7 @@ def send_message(email_message, smtp_connection=None):
         smtp_connection.connection.sendmail(email_message.from_email,
                     email_message.recipients(),
                     email_message.message().as_string())
+        pool.sent(smtp_connection)
         result = constants.RESULT_SENT
     except (SocketError, smtplib.SMTPSenderRefused,
             smtplib.SMTPRecipientsRefused,
@@ -8,8 +8,9 @@ from optparse import make_option
 
 from django.core.management.base import BaseCommand
 
+from django_mailer import parts, streaming
 from django_mailer.management.commands import create_handler
-from django_mailer.models import Message
+from django_mailer.models import BODY_FIELDS, Message, MessageBody
 
 
 class Command(BaseCommand):
@@ -27,7 +28,78 @@ class Command(BaseCommand):
 
         today = datetime.date.today()
         cutoff_date = today - datetime.timedelta(days)
-        count = Message.objects.filter(date_created__lt=cutoff_date).count()
-        Message.objects.filter(date_created__lt=cutoff_date).delete()
+        old_mails = Message.objects.filter(date_created__lt=cutoff_date)
+        count = old_mails.count()
+        stored = set(old_mails.exclude(stored_message='')
+                     .values_list('stored_message', flat=True))
+        stored_parts = set()
+        for names in old_mails.exclude(stored_parts='')\
+                .values_list('stored_parts', flat=True).distinct():
+            stored_parts.update(parts.split_names(names))
+        # The mails are loaded to delete their logs and queued messages too,
+        # there's no need for their content.
+        old_mails.defer(*BODY_FIELDS).delete()
         logger.warning("Deleted %s mails created before %s " %
                        (count, cutoff_date))
+        # Stored messages which no mail refers to any more.
+        count = self.delete_stored(stored)
+        if count:
+            logger.warning("Deleted %s unreferenced stored messages" % count)
+        # Stored parts (shared by identical attachments) which no mail refers
+        # to any more.
+        count = self.delete_stored_parts(
+            stored_parts, datetime.datetime.combine(cutoff_date,
+                                                    datetime.time()))
+        if count:
+            logger.warning("Deleted %s unreferenced stored parts" % count)
+        # Shared message bodies which no mail refers to any more.
+        count = MessageBody.objects.delete_unreferenced(
+            created_before=cutoff_date)
+        if count:
+            logger.warning("Deleted %s unreferenced message bodies" % count)
+
+    def delete_stored(self, names, batch_size=500):
+        """
+        Delete the stored messages with the given names which no mail refers
+        to, returning how many were deleted.
+
+        """
+        names = sorted(names)
+        count = 0
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            referenced = set(Message.objects.filter(stored_message__in=batch)
+                             .values_list('stored_message', flat=True))
+            for name in batch:
+                if name not in referenced:
+                    streaming.delete_message(name)
+                    count += 1
+        return count
+
+    def delete_stored_parts(self, names, saved_before):
+        """
+        Delete the stored parts with the given names which no mail refers to,
+        returning how many were deleted.
+
+        The names referred to are collected in a single pass over the mails
+        which have stored parts. Parts saved (or reused) since
+        ``saved_before`` are kept, a mail which isn't saved yet may refer to
+        them.
+
+        """
+        if not names:
+            return 0
+        referenced = set()
+        for stored_parts in Message.objects.exclude(stored_parts='')\
+                .values_list('stored_parts', flat=True).distinct()\
+                .iterator():
+            referenced.update(names.intersection(
+                parts.split_names(stored_parts)))
+        count = 0
+        for name in sorted(names - referenced):
+            modified = parts.modified_time(name)
+            if modified is not None and modified >= saved_before:
+                continue
+            parts.delete_part(name)
+            count += 1
+        return count
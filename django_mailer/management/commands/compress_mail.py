@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+import logging
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django version < 1.6
+    from django.db.transaction import commit_on_success as atomic
+
+from django_mailer import compression
+from django_mailer.management.commands import create_handler
+from django_mailer.models import Message, MessageBody
+
+
+class Command(NoArgsCommand):
+    help = ('Compress the bodies of stored mails (or decompress them with '
+            '--decompress).')
+    option_list = NoArgsCommand.option_list + (
+        make_option('-c', '--codec', choices=compression.CODECS,
+            help="The compression codec, defaults to the "
+                "MAILER_COMPRESS_MESSAGES setting (or zlib)."),
+        make_option('-d', '--decompress', action='store_true', default=False,
+            help="Store compressed mail bodies uncompressed again."),
+        make_option('-b', '--batch-size', type='int', default=500,
+            help="The number of mails converted per transaction, defaults "
+                "to 500."),
+    )
+
+    def handle_noargs(self, verbosity, codec=None, decompress=False,
+                      batch_size=500, **options):
+        if not compression.AVAILABLE:
+            raise CommandError("Compressing mails requires Django 1.6 or "
+                               "later.")
+        logger = logging.getLogger('django_mailer')
+        handler = create_handler(verbosity)
+        logger.addHandler(handler)
+
+        codec = codec or compression.get_codec() or 'zlib'
+        # Mails with a shared body are converted through the body, those kept
+        # in the storage aren't converted.
+        count = self.convert(
+            Message.objects.filter(body__isnull=True, stored_message=''),
+            codec, decompress, batch_size)
+        count += self.convert(MessageBody.objects.all(), codec, decompress,
+                              batch_size)
+
+        logger = logging.getLogger('django_mailer.commands.compress_mail')
+        logger.warning("%s mail%s %s" % (count, count != 1 and 's' or '',
+                       decompress and 'decompressed' or 'compressed'))
+        logger.removeHandler(handler)
+
+    def convert(self, queryset, codec, decompress, batch_size):
+        """
+        Compress (or decompress) the bodies stored in a queryset of
+        ``Message`` or ``MessageBody`` rows, returning how many were
+        converted.
+
+        """
+        queryset = queryset.filter(
+            compressed_message__isnull=not decompress).order_by('pk')
+        count = 0
+        last_pk = None
+        while True:
+            batch = queryset
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            with atomic():
+                for instance in batch:
+                    if decompress:
+                        fields = {
+                            # Stored parts are left in the storage.
+                            'encoded_message': compression.decompress(
+                                instance.compressed_message),
+                            'compressed_message': None}
+                    else:
+                        fields = compression.body_fields(
+                            instance.encoded_message, codec=codec)
+                    queryset.model.objects.filter(pk=instance.pk)\
+                        .update(**fields)
+            count += len(batch)
+            last_pk = batch[-1].pk
+        return count
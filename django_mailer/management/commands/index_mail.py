@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+import logging
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import DEFAULT_DB_ALIAS
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django version < 1.6
+    from django.db.transaction import commit_on_success as atomic
+from django.utils.encoding import force_bytes
+
+from django_mailer import mime_index, search
+from django_mailer.management.commands import create_handler
+from django_mailer.models import Message
+
+
+class Command(NoArgsCommand):
+    help = ('Create the search indexes of mails and record the search text '
+            'of the mails queued before it was recorded.')
+    option_list = NoArgsCommand.option_list + (
+        make_option('-b', '--batch-size', type='int', default=500,
+            help="The number of mails indexed per transaction, defaults "
+                "to 500."),
+        make_option('--database', default=DEFAULT_DB_ALIAS,
+            help="The database to index, defaults to the default "
+                "database."),
+    )
+
+    def handle_noargs(self, verbosity, batch_size=500,
+                      database=DEFAULT_DB_ALIAS, **options):
+        logger = logging.getLogger('django_mailer')
+        handler = create_handler(verbosity)
+        logger.addHandler(handler)
+
+        search.create_index(database)
+        queryset = Message.objects.using(database).filter(search_text='')\
+            .order_by('pk')
+        count = 0
+        last_pk = None
+        while True:
+            batch = queryset
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            with atomic(using=database):
+                for message in batch:
+                    msg = mime_index.parse(force_bytes(
+                        message.get_encoded_message(splice_parts=False)))
+                    Message.objects.using(database).filter(pk=message.pk)\
+                        .update(search_text=search.recipient_text(
+                            search.search_text(msg), message.to_address))
+            count += len(batch)
+            last_pk = batch[-1].pk
+
+        logger = logging.getLogger('django_mailer.commands.index_mail')
+        logger.warning("%s mail%s indexed" % (count, count != 1 and 's' or ''))
+        logger.removeHandler(handler)
@@ -1,7 +1,7 @@
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import CommandError, NoArgsCommand
 from django.db import connection
 from django_mailer import models, settings
-from django_mailer.engine import send_all
+from django_mailer.engine import send_all, send_loop
 from django_mailer.management.commands import create_handler
 from optparse import make_option
 import logging
@@ -24,9 +24,22 @@ class Command(NoArgsCommand):
         make_option('-c', '--count', action='store_true', default=False,
             help='Return the number of messages in the queue (without '
                 'actually sending any)'),
+        make_option('-w', '--workers', type='int',
+            help='The number of delivery threads (each with its own '
+                'connection) to send the queue with. Defaults to the '
+                'MAILER_DELIVERY_WORKERS setting.'),
+        make_option('--async', action='store_true', dest='use_async',
+            default=False,
+            help='Send the queue with the asyncio engine, using up to '
+                'MAILER_ASYNC_CONCURRENCY connections (Python 3.5 or '
+                'later).'),
+        make_option('-d', '--daemon', action='store_true', default=False,
+            help='Keep running, sending mail as soon as it is queued, until '
+                'a SIGTERM is received.'),
     )
 
-    def handle_noargs(self, verbosity, block_size, count, **options):
+    def handle_noargs(self, verbosity, block_size, count, workers=None,
+                      use_async=False, daemon=False, **options):
         # If this is just a count request the just calculate, report and exit.
         if count:
             queued = models.QueuedMessage.objects.non_deferred().count()
@@ -43,10 +56,19 @@ class Command(NoArgsCommand):
 
         # if PAUSE_SEND is turned on don't do anything.
         if not settings.PAUSE_SEND:
-            if EMAIL_BACKEND_SUPPORT:
-                send_all(block_size, backend=settings.USE_BACKEND)
+            if daemon:
+                if use_async:
+                    raise CommandError('The --async and --daemon options '
+                                       'can not be combined.')
+                send_loop(block_size=block_size,
+                          backend=settings.USE_BACKEND, workers=workers)
+            elif use_async:
+                send_async(block_size)
+            elif EMAIL_BACKEND_SUPPORT:
+                send_all(block_size, backend=settings.USE_BACKEND,
+                         workers=workers)
             else:
-                send_all(block_size)
+                send_all(block_size, workers=workers)
         else:
             logger = logging.getLogger('django_mailer.commands.send_mail')
             logger.warning("Sending is paused, exiting without sending "
@@ -58,3 +80,14 @@ class Command(NoArgsCommand):
         # Postgres log files caused by the database connection not being
         # explicitly closed.
         connection.close()
+
+
+def send_async(block_size):
+    try:
+        import asyncio
+        from django_mailer.async_engine import send_all_async
+    except (ImportError, SyntaxError):
+        raise CommandError('The --async option requires Python 3.5 or later.')
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(send_all_async(block_size,
+                                           backend=settings.USE_BACKEND))
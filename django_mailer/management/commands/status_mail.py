@@ -41,10 +41,11 @@ class Command(NoArgsCommand):
         # If this is just a count request the just calculate, report and exit.
         queued = QueuedMessage.objects.non_deferred().count()
         deferred = QueuedMessage.objects.deferred().count()
-        oldest = QueuedMessage.objects.non_deferred().order_by('date_queued')[0]
+        oldest = QueuedMessage.objects.non_deferred().order_by('date_queued')\
+            .values_list('date_queued', flat=True)[0]
         if naive:
-            seconds = (now() - oldest.date_queued.replace(tzinfo=None)).seconds
+            seconds = (now() - oldest.replace(tzinfo=None)).seconds
         else:
-            seconds = (now() - oldest.date_queued).seconds
+            seconds = (now() - oldest).seconds
         sys.stdout.write('%s/%s/%s\n' % (queued, deferred, seconds))
         sys.exit()
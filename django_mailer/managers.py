@@ -8,8 +8,17 @@ except ImportError:
     import datetime
     now = datetime.datetime.now
 
-from django.db import models
-from django_mailer import constants
+import datetime
+import hashlib
+
+from django.db import connections, models
+from django.utils.encoding import force_bytes
+from django_mailer import compression, constants, settings
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django version < 1.6
+    from django.db.transaction import commit_on_success as atomic
 
 
 class QueueMethods(object):
@@ -49,10 +58,30 @@ class QueueMethods(object):
     def non_deferred(self):
         """
         Return a QuerySet containing all non-deferred queued messages,
-        excluding "future" messages.
+        excluding "future" messages and those scheduled to be retried later.
+
+        """
+        return self.exclude_future().filter(deferred=None).filter(
+            models.Q(next_attempt=None) | models.Q(next_attempt__lte=now()))
+
+    def scheduled(self):
+        """
+        Return a QuerySet of the messages which failed (or were held back by
+        rate limits) and are scheduled to be retried later (see the
+        ``MAILER_RETRY_BACKOFF`` setting).
+
+        """
+        return self.filter(deferred=None, next_attempt__gt=now())
+
+    def postpone(self, seconds):
+        """
+        Schedule the messages to be sent no sooner than ``seconds`` seconds
+        from now (without counting a failed attempt), releasing any lease.
 
         """
-        return self.exclude_future().filter(deferred=None)
+        next_attempt = now() + datetime.timedelta(seconds=seconds)
+        return self.update(next_attempt=next_attempt, owner='',
+                           lease_expires=None)
 
     def deferred(self):
         """
@@ -60,7 +89,28 @@ class QueueMethods(object):
         "future" messages.
 
         """
-        return self.exclude_future().exclude(deferred=None)
+        return self.exclude_future().filter(deferred__isnull=False)
+
+    def claimable(self):
+        """
+        Return a QuerySet of non-deferred queued messages which aren't
+        currently leased (or whose lease has expired).
+
+        """
+        return self.non_deferred().filter(
+            models.Q(lease_expires=None) | models.Q(lease_expires__lt=now()))
+
+    def with_message(self):
+        """
+        Return a QuerySet of queued messages fetched along with their
+        ``Message``, leaving out its (possibly large) content: only its
+        metadata is loaded, its content is fetched on its own when needed
+        (see ``Message.fetch_body``).
+
+        """
+        from django_mailer.models import BODY_FIELDS
+        return self.select_related('message').defer(
+            *['message__%s' % name for name in BODY_FIELDS])
 
 
 class QueueQuerySet(QueueMethods, models.query.QuerySet):
@@ -72,6 +122,8 @@ class QueueManager(QueueMethods, models.Manager):
 
     def get_queryset(self):
         return QueueQuerySet(self.model, using=self._db)
+    # Django version < 1.6
+    get_query_set = get_queryset
 
     def retry_deferred(self, max_retries=None, new_priority=None):
         """
@@ -89,9 +141,110 @@ class QueueManager(QueueMethods, models.Manager):
         queryset = self.deferred()
         if max_retries:
             queryset = queryset.filter(retries__lte=max_retries)
-        count = queryset.count()
-        update_kwargs = dict(deferred=None, retries=models.F('retries')+1)
+        update_kwargs = dict(deferred=None, next_attempt=None,
+                             retries=models.F('retries')+1)
         if new_priority is not None:
             update_kwargs['priority'] = new_priority
-        queryset.update(**update_kwargs)
+        return queryset.update(**update_kwargs)
+
+    def claim(self, owner, limit, lease_time=None, pks=None):
+        """
+        Lease up to ``limit`` claimable messages to ``owner`` (only from the
+        messages with the given primary keys, if ``pks`` is provided),
+        returning a QuerySet of the messages which were claimed.
+
+        The lease lasts for ``lease_time`` seconds (defaults to the
+        ``MAILER_LEASE_TIME`` setting), after which the messages can be
+        claimed again, for example if the owner crashed.
+
+        On PostgreSQL the rows are claimed with ``SELECT ... FOR UPDATE SKIP
+        LOCKED`` so concurrent claims don't wait on each other. Elsewhere, a
+        conditional ``UPDATE`` ensures that each row is only claimed once
+        (and the claim is repeated if other owners got all the selected rows
+        first).
+
+        """
+        if lease_time is None:
+            lease_time = settings.LEASE_TIME
+        lease_expires = now() + datetime.timedelta(seconds=lease_time)
+        candidates = self.claimable().order_by('priority', 'date_queued')
+        if pks is not None:
+            candidates = candidates.filter(pk__in=pks)
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            opts = self.model._meta
+            qn = connection.ops.quote_name
+            sql, params = candidates.values('pk')[:limit].query\
+                .sql_with_params()
+            with atomic(using=self.db):
+                cursor = connection.cursor()
+                cursor.execute(
+                    'UPDATE %s SET %s = %%s, %s = %%s WHERE %s IN '
+                    '(%s FOR UPDATE SKIP LOCKED)' % (
+                        qn(opts.db_table),
+                        qn(opts.get_field('owner').column),
+                        qn(opts.get_field('lease_expires').column),
+                        qn(opts.pk.column), sql),
+                    [owner, lease_expires] + list(params))
+        else:
+            while True:
+                selected = list(candidates.values_list('pk', flat=True)
+                                [:limit])
+                if not selected:
+                    break
+                # Rows claimed by someone else in the meantime no longer
+                # match, if that was all of them the claim is tried again
+                # with the rows which are left.
+                if self.claimable().filter(pk__in=selected).update(
+                        owner=owner, lease_expires=lease_expires):
+                    break
+        return self.filter(owner=owner, lease_expires=lease_expires)
+
+    def release(self, owner):
+        """
+        Release all messages leased to ``owner``.
+
+        """
+        return self.filter(owner=owner).update(owner='', lease_expires=None)
+
+
+class MessageBodyManager(models.Manager):
+
+    def get_for(self, encoded_message):
+        """
+        Return the stored body for an encoded message, creating it if it
+        doesn't exist yet.
+
+        The creation date of a body which is reused is moved forward, so that
+        ``delete_unreferenced`` doesn't delete it before the new message
+        referring to it is saved.
+
+        """
+        content_hash = hashlib.sha256(force_bytes(encoded_message)).hexdigest()
+        while True:
+            body, created = self.get_or_create(
+                content_hash=content_hash,
+                defaults=compression.body_fields(encoded_message))
+            if created:
+                return body
+            body.date_created = now()
+            if self.filter(pk=body.pk).update(date_created=body.date_created):
+                return body
+            # The body was deleted after it was looked up, store it again.
+
+    def delete_unreferenced(self, created_before=None):
+        """
+        Delete the bodies which no message refers to any more (optionally only
+        those created, or last reused, before ``created_before``), returning
+        how many were deleted.
+
+        Without ``created_before``, a body which is being reused by a message
+        that isn't saved yet may be deleted too.
+
+        """
+        queryset = self.filter(message__isnull=True)
+        if created_before is not None:
+            queryset = queryset.filter(date_created__lt=created_before)
+        count = queryset.count()
+        queryset.delete()
         return count
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blacklist',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('email', models.EmailField(max_length=200)),
+                ('date_added', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ('-date_added',),
+                'verbose_name': 'blacklisted e-mail address',
+                'verbose_name_plural': 'blacklisted e-mail addresses',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Log',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('result', models.PositiveSmallIntegerField(choices=[(0, 'success'), (1, 'not sent (blacklisted)'), (2, 'failure')])),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('log_message', models.TextField()),
+            ],
+            options={
+                'ordering': ('-date',),
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('to_address', models.CharField(max_length=200)),
+                ('from_address', models.CharField(max_length=200)),
+                ('subject', models.CharField(max_length=255)),
+                ('encoded_message', models.TextField()),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ('date_created',),
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='QueuedMessage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('priority', models.PositiveSmallIntegerField(default=3, choices=[(1, 'high'), (3, 'normal'), (5, 'low')])),
+                ('deferred', models.DateTimeField(null=True, blank=True)),
+                ('retries', models.PositiveIntegerField(default=0)),
+                ('date_queued', models.DateTimeField(default=django.utils.timezone.now)),
+                ('message', models.OneToOneField(editable=False, to='django_mailer.Message')),
+            ],
+            options={
+                'ordering': ('priority', 'date_queued'),
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='message',
+            field=models.ForeignKey(editable=False, to='django_mailer.Message'),
+            preserve_default=True,
+        ),
+    ]
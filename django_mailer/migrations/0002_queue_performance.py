@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import django.utils.timezone
+import django_mailer.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_mailer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageBody',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('content_hash', models.CharField(unique=True, max_length=64)),
+                ('encoded_message', models.TextField(blank=True)),
+                ('compressed_message', models.BinaryField(null=True)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('key', models.CharField(unique=True, max_length=300)),
+                ('tokens', models.FloatField()),
+                ('updated', models.FloatField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_manifest',
+            field=models.TextField(editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='body',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, blank=True, editable=False, to='django_mailer.MessageBody', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='compressed_message',
+            field=models.BinaryField(null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='content_hash',
+            field=models.CharField(max_length=64, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='enqueue_marker',
+            field=models.CharField(max_length=32, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='search_text',
+            field=models.TextField(editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='stored_message',
+            field=models.CharField(max_length=255, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='stored_parts',
+            field=models.TextField(editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='queuedmessage',
+            name='lease_expires',
+            field=models.DateTimeField(null=True, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='queuedmessage',
+            name='next_attempt',
+            field=models.DateTimeField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='queuedmessage',
+            name='owner',
+            field=models.CharField(max_length=100, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='blacklist',
+            name='email',
+            field=models.CharField(help_text='An e-mail address, or a domain (e.g. @example.com) to blacklist every address at that domain.', max_length=200, validators=[django_mailer.models.validate_blacklist_entry]),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='date_created',
+            field=models.DateTimeField(default=django.utils.timezone.now, db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='encoded_message',
+            field=models.TextField(blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='queuedmessage',
+            index_together=set([('deferred', 'date_queued'), ('deferred', 'priority', 'date_queued', 'id')]),
+        ),
+    ]
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Parsed message indexes for the admin (see the ``MAILER_ADMIN_CACHE_SIZE``
+setting).
+
+Showing a message, its HTML version or one of its attachments used to load
+and parse the whole encoded message, and decode and hash every attachment,
+on each request. Instead, an encoded message is parsed once into a
+``MessageIndex``: its headers, text and HTML content, and the position,
+size and fingerprint (the md5 of ``mail_utils.Attachment.firma``) of each
+attachment. Indexes are kept in a least recently used cache bounded by
+size, and an attachment is streamed by decoding only its own part of the
+encoded message (or reading it from the storage, see
+``django_mailer.parts``).
+
+The attachments of a message are also recorded when it is queued, as its
+attachment manifest (see ``Message.get_attachment_manifest``), so they can
+be listed and downloaded without parsing the message at all.
+
+"""
+from django.utils import six
+from django.utils.encoding import force_bytes
+from django_mailer import parts, settings
+from django_mailer.mail_utils import get_attachment
+from django_mailer.storage import get_storage
+import binascii
+import collections
+import hashlib
+import threading
+
+# How many bytes of an encoded part are decoded at a time.
+DECODE_SIZE = 64 * 1024
+
+
+class PartInfo(object):
+    """
+    The description of an attachment of an encoded message, as recorded in
+    the attachment manifest of a ``Message``.
+
+    ``offset`` and ``length`` locate its encoded payload in the (UTF-8
+    encoded) message, unless the part is kept in the storage as
+    ``stored_part``.
+
+    """
+
+    def __init__(self, position, filename, content_type, size, firma,
+                 encoding, offset=None, length=None, stored_part=None):
+        self.position = position
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.firma = firma
+        self.encoding = encoding
+        self.offset = offset
+        self.length = length
+        self.stored_part = stored_part
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class MessageIndex(object):
+    """
+    The parsed headers, text and HTML content and attachments of an encoded
+    message.
+
+    """
+
+    def __init__(self, subject, from_address, to, cc, text, html,
+                 attachments):
+        self.subject = subject
+        self.from_address = from_address
+        self.to = to
+        self.cc = cc
+        self.text = text
+        self.html = html
+        self.attachments = attachments
+
+    def get_attachment(self, firma):
+        """
+        Return the attachment with the given fingerprint, or ``None``.
+
+        """
+        for attachment in self.attachments:
+            if attachment.firma == firma:
+                return attachment
+        return None
+
+    def cost(self):
+        """
+        Return roughly how many bytes the index takes up.
+
+        """
+        return (len(self.text or b'') + len(self.html or b'') +
+                256 * (len(self.attachments) + 1))
+
+
+def _stored_part(payload):
+    """
+    Return the name of the stored part an encoded payload refers to, or
+    ``None``.
+
+    """
+    match = parts.MARKER_RE.match(force_bytes(payload))
+    return match and match.group(1).decode('ascii')
+
+
+def _read_stored_part(name):
+    fileobj = get_storage().open(name, 'rb')
+    try:
+        return fileobj.read()
+    finally:
+        fileobj.close()
+
+
+def _attachments(msg, data=None):
+    """
+    Return the ``PartInfo`` of each attachment of a parsed message (a
+    ``PyzMessage``), locating their payloads in the encoded message ``data``
+    if given.
+
+    """
+    attachments = []
+    position = 0
+    for mailpart in msg.mailparts:
+        raw_payload = force_bytes(mailpart.part.get_payload())
+        offset = None
+        if data is not None:
+            # Payloads follow the blank line ending their part's headers,
+            # and parts are found in order, so each is looked for after the
+            # last.
+            offset = data.find(b'\n\n' + raw_payload, position)
+            if offset >= 0:
+                offset += 2
+                position = offset + len(raw_payload)
+            else:
+                offset = None
+        if mailpart.is_body or mailpart.disposition != 'attachment':
+            continue
+        encoding = mailpart.part.get('Content-Transfer-Encoding', '7bit')
+        stored_part = _stored_part(raw_payload)
+        if stored_part:
+            # Stored parts are named after their fingerprint (unless the
+            # storage had to rename one).
+            size = get_storage().size(stored_part)
+            firma = stored_part.rsplit('/', 1)[-1]
+            if len(firma) != 32:
+                firma = hashlib.md5(_read_stored_part(stored_part))\
+                    .hexdigest()
+        else:
+            payload = mailpart.get_payload()
+            size = len(payload)
+            firma = hashlib.md5(payload).hexdigest()
+        attachments.append(PartInfo(
+            len(attachments), mailpart.sanitized_filename, mailpart.type,
+            size, firma, encoding.lower(), offset,
+            None if offset is None else len(raw_payload), stored_part))
+    return attachments
+
+
+def build_manifest(mime_message, encoded_message=None):
+    """
+    Return the ``PartInfo`` of each attachment of a MIME message about to be
+    queued (with its stored parts left out), locating their payloads in its
+    ``encoded_message`` if given.
+
+    """
+    from pyzmail.parse import PyzMessage
+
+    if encoded_message is not None:
+        encoded_message = force_bytes(encoded_message)
+    return _attachments(PyzMessage.factory(mime_message), encoded_message)
+
+
+def parse(data):
+    """
+    Parse an encoded message (as bytes) into a ``PyzMessage``.
+
+    """
+    from pyzmail import parse
+
+    if six.PY3:
+        return parse.message_from_bytes(data)
+    return parse.message_from_string(data)
+
+
+def build_index(encoded_message, attachments=None):
+    """
+    Parse an encoded message (as stored, that is with its stored parts left
+    out) into a ``MessageIndex``. Its ``attachments`` are only looked for if
+    they aren't given (see ``Message.get_attachment_manifest``).
+
+    """
+    data = force_bytes(encoded_message)
+    msg = parse(data)
+    text = html = None
+    for mailpart in msg.mailparts:
+        if mailpart.is_body not in ('text/plain', 'text/html'):
+            continue
+        stored_part = _stored_part(mailpart.part.get_payload())
+        if stored_part:
+            payload = _read_stored_part(stored_part)
+        else:
+            payload = mailpart.get_payload()
+        if mailpart.is_body == 'text/plain' and text is None:
+            text = payload
+        elif mailpart.is_body == 'text/html' and html is None:
+            html = payload
+    if attachments is None:
+        attachments = _attachments(msg, data)
+    return MessageIndex(
+        msg.get_subject(), msg.get_address('from'), msg.get_addresses('to'),
+        msg.get_addresses('cc'), text, html, attachments)
+
+
+class IndexCache(object):
+    """
+    A thread-safe least recently used cache of message indexes, holding up
+    to ``max_size`` bytes of them (see ``MessageIndex.cost``).
+
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            index = self.entries.pop(key, None)
+            if index is not None:
+                self.entries[key] = index
+            return index
+
+    def set(self, key, index):
+        cost = index.cost()
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.cost()
+            if cost > self.max_size:
+                return
+            self.entries[key] = index
+            self.size += cost
+            while self.size > self.max_size:
+                key, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.cost()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Return the index cache, sized by the ``MAILER_ADMIN_CACHE_SIZE``
+    setting.
+
+    """
+    global _cache
+    if _cache is None or _cache.max_size != settings.ADMIN_CACHE_SIZE:
+        _cache = IndexCache(settings.ADMIN_CACHE_SIZE)
+    return _cache
+
+
+def cache_key(message):
+    """
+    Return the key identifying the encoded message of a ``Message``, without
+    loading it: the shared body, the stored message or the message itself.
+
+    """
+    if message.stored_message:
+        return 'stored', message.stored_message
+    if message.body_id is not None:
+        return 'body', message.body_id
+    return 'message', message.pk
+
+
+def get_index(message):
+    """
+    Return the ``MessageIndex`` of a ``Message``, from the cache if
+    possible.
+
+    """
+    cache = get_cache()
+    key = cache_key(message)
+    index = cache.get(key)
+    if index is None:
+        index = build_index(message.get_encoded_message(splice_parts=False),
+                            message.get_attachment_manifest())
+        cache.set(key, index)
+    return index
+
+
+def iter_attachment(message, attachment):
+    """
+    Yield the decoded content of an attachment of a ``Message`` (described
+    by ``attachment``, a ``PartInfo``), a block at a time.
+
+    """
+    if attachment.stored_part:
+        fileobj = get_storage().open(attachment.stored_part, 'rb')
+        try:
+            while True:
+                block = fileobj.read(DECODE_SIZE)
+                if not block:
+                    break
+                yield block
+        finally:
+            fileobj.close()
+        return
+    data = force_bytes(message.get_encoded_message(splice_parts=False))
+    if attachment.offset is None:
+        # The payload couldn't be located, the message is parsed again.
+        msg = parse(data)
+        yield get_attachment(msg, attachment.firma).payload
+        return
+    start = attachment.offset
+    end = start + attachment.length
+    if attachment.encoding == 'base64':
+        decode = binascii.a2b_base64
+    elif attachment.encoding == 'quoted-printable':
+        decode = binascii.a2b_qp
+    else:
+        decode = None
+    while start < end:
+        # Decode whole lines at a time.
+        stop = data.find(b'\n', min(start + DECODE_SIZE, end) - 1, end)
+        stop = end if stop < 0 else stop + 1
+        block = data[start:stop]
+        yield decode(block) if decode else block
+        start = stop
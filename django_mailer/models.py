@@ -2,12 +2,23 @@
 # encoding: utf-8
 # ----------------------------------------------------------------------------
 
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.db import models
-from django_mailer import constants, managers
+from django.db.models.query_utils import DeferredAttribute
+try:
+    from django.db.models.signals import post_migrate
+except ImportError:
+    # Django version < 1.7
+    from django.db.models.signals import post_syncdb as post_migrate
+from django_mailer import (compression, constants, managers, mime_index,
+                           parts, search, settings, streaming)
+import datetime
+import json
+import random
 try:
     from django.utils.timezone import now
 except ImportError:
-    import datetime
     now = datetime.datetime.now
 
 
@@ -24,6 +35,49 @@ RESULT_CODES = (
 )
 
 
+class MessageBody(models.Model):
+    """
+    An encoded email message, stored once however many recipients it is
+    queued for.
+
+    Bodies are identified by the SHA-256 hash of the encoded message and are
+    only used when the ``MAILER_DEDUPLICATE_BODIES`` setting is enabled.
+
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    encoded_message = models.TextField(blank=True)
+    if compression.AVAILABLE:
+        compressed_message = models.BinaryField(null=True, editable=False)
+    else:
+        # Django version < 1.6, bodies are never compressed.
+        compressed_message = None
+    date_created = models.DateTimeField(default=now)
+
+    objects = managers.MessageBodyManager()
+
+    def __unicode__(self):
+        return self.content_hash
+
+    def get_encoded_message(self):
+        """
+        Return the encoded message, decompressing it if necessary.
+
+        """
+        if self.compressed_message is not None:
+            return compression.decompress(self.compressed_message)
+        return self.encoded_message
+
+
+# The fields of a ``Message`` holding the content it is sent with, see
+# ``Message.fetch_body``.
+CONTENT_FIELDS = ('encoded_message',)
+if compression.AVAILABLE:
+    CONTENT_FIELDS += ('compressed_message',)
+# The fields of a ``Message`` holding its (possibly large) content, deferred
+# when only its metadata is needed.
+BODY_FIELDS = CONTENT_FIELDS + ('search_text',)
+
+
 class Message(models.Model):
     """
     An email message.
@@ -31,15 +85,46 @@ class Message(models.Model):
     The ``to_address``, ``from_address`` and ``subject`` fields are merely for
     easy of access for these common values. The ``encoded_message`` field
     contains the entire encoded email message ready to be sent to an SMTP
-    connection.
+    connection, unless it is stored compressed in the ``compressed_message``
+    field, shared with other recipients through ``body`` or kept in file
+    storage as ``stored_message`` instead (see ``get_encoded_message``). Its
+    large parts may be kept in the file storage too, as ``stored_parts``.
 
     """
     to_address = models.CharField(max_length=200)
     from_address = models.CharField(max_length=200)
     subject = models.CharField(max_length=255)
 
-    encoded_message = models.TextField()
-    date_created = models.DateTimeField(default=now)
+    encoded_message = models.TextField(blank=True)
+    if compression.AVAILABLE:
+        compressed_message = models.BinaryField(null=True, editable=False)
+    else:
+        # Django version < 1.6, bodies are never compressed.
+        compressed_message = None
+    body = models.ForeignKey(MessageBody, null=True, blank=True,
+                             editable=False, on_delete=models.PROTECT)
+    # The SHA-256 hash of the encoded message kept in this row, identifying
+    # the messages which can be sent together without loading it.
+    content_hash = models.CharField(max_length=64, blank=True,
+                                    editable=False)
+    # The name of the encoded message in the storage, see
+    # ``django_mailer.streaming``.
+    stored_message = models.CharField(max_length=255, blank=True,
+                                      editable=False)
+    # The names of the parts of the encoded message kept in the storage, one
+    # per line, see ``django_mailer.parts``.
+    stored_parts = models.TextField(blank=True, editable=False)
+    # The attachments of the message, recorded as a JSON list when it is
+    # queued, see ``get_attachment_manifest``.
+    attachment_manifest = models.TextField(blank=True, editable=False)
+    # The decoded headers and plain text body of the message, searched by
+    # the admin, see ``django_mailer.search``.
+    search_text = models.TextField(blank=True, editable=False)
+    date_created = models.DateTimeField(default=now, db_index=True)
+    # A marker shared by the rows written by one bulk insert, used to find
+    # them again (see ``queue_email_messages``).
+    enqueue_marker = models.CharField(max_length=32, blank=True,
+                                      editable=False)
 
     class Meta:
         ordering = ('date_created',)
@@ -47,6 +132,86 @@ class Message(models.Model):
     def __unicode__(self):
         return '%s: %s' % (self.to_address, self.subject)
 
+    def get_encoded_message(self, splice_parts=True):
+        """
+        Return the encoded message, from the storage or the shared message
+        body if there is one, decompressing it if necessary.
+
+        Parts kept in the storage are spliced back in, unless
+        ``splice_parts`` is ``False``.
+
+        """
+        if self.stored_message:
+            encoded_message = streaming.read_message(self.stored_message)
+        elif self.body_id is not None:
+            encoded_message = self.body.get_encoded_message()
+        else:
+            self.fetch_body()
+            if self.compressed_message is not None:
+                encoded_message = compression.decompress(
+                    self.compressed_message)
+            else:
+                encoded_message = self.encoded_message
+        if splice_parts and self.stored_parts:
+            encoded_message = parts.splice(encoded_message,
+                                           self.get_stored_parts())
+        return encoded_message
+
+    def fetch_body(self):
+        """
+        Load the content the message is sent with if it was deferred (see
+        ``QueueMethods.with_message``): its shared message body, or its
+        ``CONTENT_FIELDS`` in a single query. A stored message is left in the
+        storage, it is streamed from there when sent.
+
+        """
+        if self.stored_message:
+            return
+        if self.body_id is not None:
+            # Fetched and cached by the related descriptor.
+            self.body
+            return
+        deferred = [name for name in CONTENT_FIELDS
+                    if name not in self.__dict__]
+        if deferred and self.pk is not None:
+            self.__dict__.update(
+                Message.objects.using(self._state.db).filter(pk=self.pk)
+                .values(*deferred).get())
+
+    def release_body(self):
+        """
+        Forget the content loaded by ``fetch_body`` (if it was deferred), so
+        that a sent message doesn't hold on to it. It is fetched again if it
+        is needed after all.
+
+        """
+        body_cache = self._meta.get_field('body').get_cache_name()
+        if hasattr(self, body_cache):
+            delattr(self, body_cache)
+        for name in CONTENT_FIELDS:
+            if isinstance(type(self).__dict__.get(name), DeferredAttribute):
+                self.__dict__.pop(name, None)
+
+    def get_stored_parts(self):
+        """
+        Return the names of the parts of the message kept in the storage.
+
+        """
+        return parts.split_names(self.stored_parts)
+
+    def get_attachment_manifest(self):
+        """
+        Return the description (a list of ``mime_index.PartInfo``) of the
+        attachments of the message, or ``None`` if they weren't recorded when
+        it was queued.
+
+        """
+        if not self.attachment_manifest:
+            return None
+        return [mime_index.PartInfo(**dict((str(key), value)
+                                           for key, value in info.items()))
+                for info in json.loads(self.attachment_manifest)]
+
 
 class QueuedMessage(models.Model):
     """
@@ -55,6 +220,12 @@ class QueuedMessage(models.Model):
     Messages in the queue can be prioritised so that the higher priority
     messages are sent first (secondarily sorted by the oldest message).
 
+    A message can be leased to a single sending process (the ``owner``) until
+    ``lease_expires``, see ``QueueManager.claim``.
+
+    If the ``MAILER_RETRY_BACKOFF`` setting is enabled, a message which
+    failed isn't sent again until its ``next_attempt``.
+
     """
     message = models.OneToOneField(Message, editable=False)
     priority = models.PositiveSmallIntegerField(choices=PRIORITIES,
@@ -62,26 +233,92 @@ class QueuedMessage(models.Model):
     deferred = models.DateTimeField(null=True, blank=True)
     retries = models.PositiveIntegerField(default=0)
     date_queued = models.DateTimeField(default=now)
+    owner = models.CharField(max_length=100, blank=True, editable=False)
+    lease_expires = models.DateTimeField(null=True, blank=True,
+                                         editable=False)
+    next_attempt = models.DateTimeField(null=True, blank=True)
 
     objects = managers.QueueManager()
 
     class Meta:
         ordering = ('priority', 'date_queued')
+        index_together = (
+            # The non-deferred queue in sending order, also used to page
+            # through the queue by keyset (see ``engine._message_blocks``).
+            ('deferred', 'priority', 'date_queued', 'id'),
+            # Deferred and non-deferred messages by age.
+            ('deferred', 'date_queued'),
+        )
 
     def defer(self):
+        """
+        Put the message aside after a failed delivery attempt.
+
+        If the ``MAILER_RETRY_BACKOFF`` setting is enabled, the message is
+        scheduled to be retried after an exponentially growing delay, until
+        ``MAILER_MAX_ATTEMPTS`` attempts have failed. Otherwise (or once the
+        attempts are exhausted) it is flagged as deferred, and is only retried
+        after ``QueueManager.retry_deferred``.
+
+        """
+        self.owner = ''
+        self.lease_expires = None
+        if settings.RETRY_BACKOFF:
+            self.retries += 1
+            if not settings.MAX_ATTEMPTS or \
+                    self.retries < settings.MAX_ATTEMPTS:
+                self.next_attempt = now() + datetime.timedelta(
+                    seconds=retry_delay(self.retries))
+                self.save()
+                return
         self.deferred = now()
+        self.next_attempt = None
         self.save()
 
 
+def retry_delay(retries):
+    """
+    Return how many seconds to wait before the next attempt to send a message
+    which has failed ``retries`` times: ``MAILER_RETRY_BACKOFF`` doubled for
+    each earlier failure (up to ``MAILER_RETRY_MAX_DELAY``), of which a random
+    part up to a half is taken off to spread the retries of messages which
+    failed together.
+
+    """
+    delay = settings.RETRY_BACKOFF * 2 ** max(retries - 1, 0)
+    if settings.RETRY_MAX_DELAY:
+        delay = min(delay, settings.RETRY_MAX_DELAY)
+    return delay - random.uniform(0, delay / 2.0)
+
+
+def validate_blacklist_entry(value):
+    """
+    Validate an email address, or a domain in the ``@example.com`` form.
+
+    """
+    if value.startswith('@'):
+        try:
+            validate_email('postmaster' + value)
+        except ValidationError:
+            raise ValidationError('Enter a valid domain, e.g. @example.com.')
+    else:
+        validate_email(value)
+
+
 class Blacklist(models.Model):
     """
     A blacklisted email address.
 
     Messages attempted to be sent to e-mail addresses which appear on this
-    blacklist will be skipped entirely.
+    blacklist will be skipped entirely. An entry in the ``@example.com`` form
+    blacklists every address at that domain. Addresses are compared
+    case-insensitively.
 
     """
-    email = models.EmailField(max_length=200)
+    email = models.CharField(max_length=200,
+        validators=[validate_blacklist_entry],
+        help_text='An e-mail address, or a domain (e.g. @example.com) to '
+                  'blacklist every address at that domain.')
     date_added = models.DateTimeField(default=now)
 
     class Meta:
@@ -102,3 +339,19 @@ class Log(models.Model):
 
     class Meta:
         ordering = ('-date',)
+
+
+class RateLimitBucket(models.Model):
+    """
+    The state of a rate limiting token bucket shared by all the sending
+    processes (see the ``MAILER_RATE_LIMIT_STORE`` setting).
+
+    """
+    key = models.CharField(max_length=300, unique=True)
+    tokens = models.FloatField()
+    # A timestamp (seconds since the epoch) of the last refill.
+    updated = models.FloatField()
+
+
+post_migrate.connect(search.create_index_after_migrate,
+                     dispatch_uid='django_mailer.search.create_index')
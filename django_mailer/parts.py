@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Out-of-line storage of large MIME parts (see the
+``MAILER_STORED_PART_MIN_SIZE`` setting).
+
+The decoded content of each large base64 encoded part (usually an
+attachment) is saved in the storage (see ``django_mailer.storage``) under
+its MD5 fingerprint, the same as ``mail_utils.Attachment.firma``, so an
+attachment sent to many recipients, or in many messages, is only stored
+once. In the encoded message, the part's payload is replaced by a single
+marker line naming the stored file; the names are also kept on the
+``Message`` (``stored_parts``). The parts are spliced back in, base64
+encoded again, when the message is read or streamed to the SMTP server.
+
+"""
+from django.core.files.base import ContentFile
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+from django_mailer import settings
+from django_mailer.storage import get_storage
+import base64
+import hashlib
+import os
+import re
+
+MARKER = '[django-mailer-part:%s]'
+# The marker replaces a base64 payload, so it can't be mistaken for one.
+MARKER_RE = re.compile(br'^\[django-mailer-part:([^\]\s]+)\](\r?\n)?$')
+# Base64 lines hold 57 bytes, so parts encoded this many bytes at a time
+# come out exactly as when encoded at once.
+ENCODE_SIZE = 57 * 1024
+# Lines are read at least this many bytes at a time, so that markers are
+# always read whole.
+MARKER_SIZE = 1024
+
+if six.PY2:
+    _encode = base64.encodestring
+else:
+    _encode = base64.encodebytes
+
+
+def store_parts(mime_message, min_size=None):
+    """
+    Move the base64 encoded parts of a MIME message of at least ``min_size``
+    bytes (defaults to the ``MAILER_STORED_PART_MIN_SIZE`` setting) out to
+    the storage, returning the list of their stored names.
+
+    """
+    min_size = min_size or settings.STORED_PART_MIN_SIZE
+    if not min_size:
+        return []
+    names = []
+    for part in mime_message.walk():
+        if part.is_multipart() or \
+                part.get('Content-Transfer-Encoding', '').lower() != 'base64':
+            continue
+        payload = part.get_payload()
+        if len(payload) < min_size:
+            continue
+        content = part.get_payload(decode=True)
+        if force_text(_encode(content)).rstrip('\n') != payload.rstrip('\n'):
+            # Not encoded the way it would be spliced back in.
+            continue
+        name = _save(content)
+        # The encoding's final line break may have been left out.
+        part.set_payload(MARKER % name + payload[len(payload.rstrip('\n')):])
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def _save(content):
+    """
+    Save the content of a part in the storage unless an identical part is
+    already there, returning its name.
+
+    An identical part which is reused has its modification time updated (if
+    the storage keeps local files), so that ``cleanup_mail`` doesn't delete
+    it before the message referring to it is saved.
+
+    """
+    firma = hashlib.md5(content).hexdigest()
+    name = 'django_mailer/parts/%s/%s' % (firma[:2], firma)
+    storage = get_storage()
+    if storage.exists(name):
+        try:
+            os.utime(storage.path(name), None)
+        except NotImplementedError:
+            pass
+        return name
+    return storage.save(name, ContentFile(content))
+
+
+def join_names(names):
+    return '\n'.join(names)
+
+
+def split_names(stored_parts):
+    return [name for name in stored_parts.split('\n') if name]
+
+
+def encoded_part(name, line_break=True):
+    """
+    Yield the base64 encoding of a stored part, a block at a time, with or
+    without its final line break.
+
+    """
+    fileobj = get_storage().open(name, 'rb')
+    try:
+        block = fileobj.read(ENCODE_SIZE)
+        while block:
+            next_block = fileobj.read(ENCODE_SIZE)
+            encoded = _encode(block)
+            if not next_block and not line_break:
+                encoded = encoded[:-1]
+            yield encoded
+            block = next_block
+    finally:
+        fileobj.close()
+
+
+def _expand(line, names):
+    """
+    Return the blocks of the stored part a line of an encoded message refers
+    to, or ``None`` if it isn't the marker of one of the ``names``.
+
+    """
+    match = MARKER_RE.match(line)
+    if not match:
+        return None
+    name = force_text(match.group(1))
+    if name not in names:
+        return None
+    return encoded_part(name, line_break=bool(match.group(2)))
+
+
+def splice(encoded_message, names):
+    """
+    Return an encoded message with the stored parts named in ``names``
+    spliced back in.
+
+    """
+    names = set(names)
+    lines = force_bytes(encoded_message).splitlines(True)
+    for index, line in enumerate(lines):
+        blocks = _expand(line, names)
+        if blocks is not None:
+            lines[index] = b''.join(blocks)
+    return force_text(b''.join(lines))
+
+
+class SplicedFile(object):
+    """
+    A binary file-like object reading an encoded message from ``fileobj``
+    with the stored parts named in ``names`` spliced back in, without ever
+    holding a whole part in memory.
+
+    """
+
+    def __init__(self, fileobj, names, line_size=None):
+        self.fileobj = fileobj
+        self.names = set(names)
+        self.line_size = line_size or settings.STREAM_CHUNK_SIZE
+        self.buffer = b''
+        self.pieces = self._pieces()
+
+    def _pieces(self):
+        at_line_start = True
+        while True:
+            line = self.fileobj.readline(max(self.line_size, MARKER_SIZE))
+            if not line:
+                break
+            blocks = _expand(line, self.names) if at_line_start else None
+            if blocks is not None:
+                for block in blocks:
+                    yield block
+                continue
+            at_line_start = line.endswith(b'\n')
+            yield line
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            try:
+                piece = next(self.pieces)
+            except StopIteration:
+                break
+            chunks.append(piece)
+            length += len(piece)
+        data = b''.join(chunks)
+        if size < 0:
+            self.buffer = b''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        self.fileobj.close()
+
+
+def modified_time(name):
+    """
+    Return when a stored part was saved (or last reused), or ``None`` if the
+    storage can't tell.
+
+    """
+    try:
+        return get_storage().modified_time(name)
+    except (NotImplementedError, OSError):
+        return None
+
+
+def delete_part(name):
+    get_storage().delete(name)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+A process-wide pool of open email backend connections.
+
+Connections are kept per backend (and per ``EMAIL_*`` server settings) so
+that consecutive delivery runs and immediately sent messages don't each pay
+for a new connection (TCP, TLS and authentication). A connection is checked
+with an SMTP ``NOOP`` before it is reused and replaced once it is older than
+``MAILER_CONNECTION_MAX_AGE`` seconds or has sent
+``MAILER_CONNECTION_MAX_MESSAGES`` messages.
+
+"""
+from django.conf import settings as django_settings
+from django.utils.encoding import force_bytes
+from django_mailer import constants, settings
+from socket import error as SocketError
+import atexit
+import hashlib
+import logging
+import smtplib
+import threading
+import time
+
+if constants.EMAIL_BACKEND_SUPPORT:
+    from django.core.mail import get_connection
+else:
+    from django.core.mail import SMTPConnection as get_connection
+
+logger = logging.getLogger('django_mailer.pool')
+
+
+def _pool_key(backend=None, options=None):
+    """
+    Return the key of the connections to the given email backend with the
+    current server settings and the given connection options.
+
+    The password is only kept as a hash, so that connections authenticated
+    with an old password aren't reused once it changes.
+
+    """
+    password = getattr(django_settings, 'EMAIL_HOST_PASSWORD', None) or ''
+    return (backend or getattr(django_settings, 'EMAIL_BACKEND', None),
+            getattr(django_settings, 'EMAIL_HOST', None),
+            getattr(django_settings, 'EMAIL_PORT', None),
+            getattr(django_settings, 'EMAIL_HOST_USER', None),
+            hashlib.sha256(force_bytes(password)).hexdigest(),
+            getattr(django_settings, 'EMAIL_USE_TLS', False),
+            getattr(django_settings, 'EMAIL_USE_SSL', False),
+            tuple(sorted((options or {}).items())))
+
+
+def _new_connection(backend=None, options=None):
+    if constants.EMAIL_BACKEND_SUPPORT:
+        return get_connection(backend=backend, **(options or {}))
+    return get_connection(**(options or {}))
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of open backend connections.
+
+    Connections are taken with ``acquire`` and given back with ``release``
+    (or ``discard``, to close them). ``sent`` should be called as messages
+    are sent so that connections can be recycled.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Idle connections by pool key.
+        self._idle = {}
+        # The [key, opening time, messages sent] of each pooled connection.
+        self._stats = {}
+
+    def acquire(self, backend=None, **options):
+        """
+        Return an open connection to the given email backend (opened with the
+        given ``options``, for example a ``host`` and ``port``), reusing an
+        idle one if possible.
+
+        If a new connection fails to open, it is returned unopened (each
+        message will retry opening it and be deferred if that fails).
+
+        """
+        key = _pool_key(backend, options)
+        while settings.CONNECTION_POOL:
+            with self._lock:
+                idle = self._idle.get(key)
+                connection = idle and idle.pop()
+            if not connection:
+                break
+            if self._usable(connection):
+                return connection
+            self.discard(connection)
+        connection = _new_connection(backend, options)
+        with self._lock:
+            self._stats[connection] = [key, time.time(), 0]
+        _open(connection)
+        return connection
+
+    def release(self, connection):
+        """
+        Give a connection back to the pool, closing it if it can't be reused
+        (or the pool is full).
+
+        """
+        with self._lock:
+            stats = self._stats.get(connection)
+            if stats and settings.CONNECTION_POOL and \
+                    not _expired(stats) and _is_open(connection):
+                idle = self._idle.setdefault(stats[0], [])
+                if len(idle) < settings.CONNECTION_POOL_SIZE:
+                    idle.append(connection)
+                    return
+        self.discard(connection)
+
+    def discard(self, connection):
+        """
+        Close a connection and forget about it.
+
+        """
+        with self._lock:
+            self._stats.pop(connection, None)
+        _close(connection)
+
+    def sent(self, connection, count=1):
+        """
+        Count ``count`` messages sent over a connection, reopening it if it
+        has reached its maximum age or number of messages.
+
+        """
+        with self._lock:
+            stats = self._stats.get(connection)
+            if stats is None:
+                return
+            stats[2] += count
+            if not _expired(stats):
+                return
+            sent = stats[2]
+            stats[1:] = [time.time(), 0]
+        # The connection is only used by the caller, it is reopened outside
+        # of the lock.
+        logger.debug("Recycling connection after %s messages." % sent)
+        _close(connection)
+        _open(connection)
+
+    def close_all(self):
+        """
+        Close all idle connections.
+
+        """
+        with self._lock:
+            connections = [connection for idle in self._idle.values()
+                           for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            self.discard(connection)
+
+    def _usable(self, connection):
+        stats = self._stats.get(connection)
+        if stats is None or _expired(stats) or not _is_open(connection):
+            return False
+        smtp_connection = getattr(connection, 'connection', None)
+        if not hasattr(smtp_connection, 'noop'):
+            return True
+        try:
+            return smtp_connection.noop()[0] == 250
+        except (SocketError, smtplib.SMTPException):
+            return False
+
+
+def _expired(stats):
+    key, opened, messages = stats
+    if settings.CONNECTION_MAX_MESSAGES and \
+            messages >= settings.CONNECTION_MAX_MESSAGES:
+        return True
+    return bool(settings.CONNECTION_MAX_AGE) and \
+        time.time() - opened >= settings.CONNECTION_MAX_AGE
+
+
+def _is_open(connection):
+    # SMTP backends drop their smtplib connection when closed.
+    return getattr(connection, 'connection', True) is not None
+
+
+def _open(connection):
+    try:
+        connection.open()
+    except Exception as err:
+        logger.warning("Failed to open a connection: %s" % err)
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+pool = ConnectionPool()
+atexit.register(pool.close_all)
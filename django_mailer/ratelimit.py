@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Rate limiting of message delivery.
+
+"""
+from django.db import IntegrityError
+from django.utils.encoding import force_bytes
+from django_mailer import models, settings
+from django_mailer.blacklist import get_domain
+try:
+    from django.core.cache import caches
+
+    def get_cache(alias):
+        return caches[alias]
+except ImportError:
+    # Django version < 1.7
+    from django.core.cache import get_cache
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django version < 1.6
+    from django.db.transaction import commit_on_success as atomic
+import hashlib
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    A token bucket allowing ``rate`` actions per second, with bursts of up to
+    ``capacity`` actions.
+
+    The bucket starts full.
+
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.time):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    @classmethod
+    def for_throttle(cls, throttle):
+        """
+        Return a bucket allowing one action every ``throttle`` seconds (the
+        ``MAILER_EMAIL_THROTTLE`` semantics), or ``None`` if there is no
+        throttling.
+
+        """
+        if not throttle or throttle <= 0:
+            return None
+        return cls(1.0 / throttle)
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens=1):
+        """
+        Take ``tokens`` from the bucket if they are available, returning
+        whether they were.
+
+        """
+        self.refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def reserve(self, tokens=1):
+        """
+        Take ``tokens`` from the bucket, going into debt if necessary, and
+        return how many seconds the caller has to wait before acting.
+
+        """
+        self.refill()
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def give(self, tokens=1):
+        """
+        Put ``tokens`` back into the bucket (up to its capacity).
+
+        """
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+def _take(state, rate, capacity):
+    """
+    Take a token from a bucket in the ``(tokens, updated)`` ``state``,
+    returning a ``(taken, state)`` tuple of whether it was available and the
+    new state.
+
+    """
+    bucket = TokenBucket(rate, capacity)
+    if state is not None:
+        bucket.tokens, bucket.updated = state
+    taken = bucket.take()
+    return taken, (bucket.tokens, bucket.updated)
+
+
+class LocalStore(object):
+    """
+    Token buckets kept in the memory of this process.
+
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        with self.lock:
+            taken, self.buckets[key] = _take(self.buckets.get(key), rate,
+                                             capacity)
+        return taken
+
+    def give(self, key, rate, capacity):
+        with self.lock:
+            tokens, updated = self.buckets[key]
+            self.buckets[key] = min(capacity, tokens + 1), updated
+
+
+class CacheStore(object):
+    """
+    Token buckets kept in a Django cache, shared by all the processes using
+    that cache. Updates are serialized with a lock entry added to the cache
+    (if the lock can't be had, the bucket is considered empty).
+
+    """
+
+    def __init__(self, alias='default'):
+        self.cache = get_cache(alias)
+
+    def _cache_key(self, key):
+        return 'django_mailer:ratelimit:%s' % hashlib.md5(
+            force_bytes(key)).hexdigest()
+
+    def _update(self, key, update):
+        cache_key = self._cache_key(key)
+        lock_key = cache_key + ':lock'
+        for attempt in range(50):
+            if self.cache.add(lock_key, 1, 10):
+                break
+            time.sleep(0.01)
+        else:
+            return False
+        try:
+            result, state = update(self.cache.get(cache_key))
+            self.cache.set(cache_key, state, 24 * 60 * 60)
+            return result
+        finally:
+            self.cache.delete(lock_key)
+
+    def take(self, key, rate, capacity):
+        return self._update(key, lambda state: _take(state, rate, capacity))
+
+    def give(self, key, rate, capacity):
+        def give(state):
+            tokens, updated = state or (capacity, time.time())
+            return True, (min(capacity, tokens + 1), updated)
+        self._update(key, give)
+
+
+class DatabaseStore(object):
+    """
+    Token buckets kept in the ``RateLimitBucket`` table, shared by all the
+    processes using the database. Each update locks the bucket's row.
+
+    """
+
+    def _update(self, key, update):
+        with atomic():
+            queryset = models.RateLimitBucket.objects.select_for_update()
+            try:
+                bucket = queryset.get(key=key)
+                state = bucket.tokens, bucket.updated
+            except models.RateLimitBucket.DoesNotExist:
+                bucket = models.RateLimitBucket(key=key)
+                state = None
+            result, (bucket.tokens, bucket.updated) = update(state)
+            try:
+                with atomic():
+                    bucket.save()
+            except IntegrityError:
+                # Created by another process in the meantime.
+                return self._update(key, update)
+        return result
+
+    def take(self, key, rate, capacity):
+        return self._update(key, lambda state: _take(state, rate, capacity))
+
+    def give(self, key, rate, capacity):
+        def give(state):
+            tokens, updated = state or (capacity, time.time())
+            return True, (min(capacity, tokens + 1), updated)
+        self._update(key, give)
+
+
+STORES = {
+    'local': LocalStore,
+    'cache': CacheStore,
+    'database': DatabaseStore,
+}
+
+# Shared by the delivery runs of this process.
+_local_store = LocalStore()
+
+
+class RateLimiter(object):
+    """
+    Token buckets per recipient domain and per sender address.
+
+    ``domain_limits`` and ``sender_limits`` map a (lower case) domain or
+    address to a ``(messages, seconds)`` tuple: up to ``messages`` messages
+    every ``seconds`` seconds, sent in bursts of up to ``messages``. The
+    ``'*'`` entry applies to each domain (or sender) not listed.
+
+    """
+
+    def __init__(self, domain_limits=None, sender_limits=None, store=None):
+        self.domain_limits = domain_limits or {}
+        self.sender_limits = sender_limits or {}
+        self.store = store or _local_store
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Return the limiter configured by the ``MAILER_DOMAIN_RATE_LIMITS``,
+        ``MAILER_SENDER_RATE_LIMITS`` and ``MAILER_RATE_LIMIT_STORE``
+        settings, or ``None`` if there are no limits.
+
+        """
+        if not (settings.DOMAIN_RATE_LIMITS or settings.SENDER_RATE_LIMITS):
+            return None
+        store = settings.RATE_LIMIT_STORE
+        if store == 'local':
+            store = _local_store
+        elif store == 'cache':
+            store = CacheStore(settings.RATE_LIMIT_CACHE)
+        else:
+            store = STORES[store]()
+        return cls(settings.DOMAIN_RATE_LIMITS, settings.SENDER_RATE_LIMITS,
+                   store)
+
+    def _buckets(self, message):
+        domain = get_domain(message.to_address).lower()
+        sender = message.from_address.lower()
+        for kind, limits, name in (('domain', self.domain_limits, domain),
+                                   ('sender', self.sender_limits, sender)):
+            limit = limits.get(name, limits.get('*'))
+            if limit:
+                messages, seconds = limit
+                yield ('%s:%s' % (kind, name), float(messages) / seconds,
+                       messages)
+
+    def allow(self, message):
+        """
+        Take a token from the buckets of the message's recipient domain and
+        sender, returning whether both had one (if not, nothing is taken).
+
+        """
+        taken = []
+        for bucket in self._buckets(message):
+            if not self.store.take(*bucket):
+                for bucket in taken:
+                    self.store.give(*bucket)
+                return False
+            taken.append(bucket)
+        return True
+
+    def retry_after(self, message):
+        """
+        Return how many seconds to hold back a message which wasn't allowed:
+        the time its slowest bucket takes to refill one token.
+
+        """
+        return max([1.0 / rate for key, rate, capacity
+                    in self._buckets(message)] or [0])
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Routing of queued messages to different email backends (or mail servers) by
+recipient domain.
+
+Each message is sent to a *destination*: a backend and the options its
+connections are opened with. Messages for the same destination share
+connections and messages for different destinations are delivered over
+separate connections, so that a slow destination doesn't hold back the
+others.
+
+A route can also deliver directly to the mail exchanger (MX) of each
+recipient domain, in which case every domain is its own destination. MX
+records are looked up with dnspython when it is installed; otherwise (or if
+the domain has no MX record) the domain itself is used, as the implicit MX
+of RFC 5321.
+
+"""
+from collections import namedtuple
+from django_mailer import settings
+from django_mailer.blacklist import get_domain
+import logging
+
+try:
+    import dns.resolver
+    import dns.exception
+except ImportError:
+    dns = None
+
+logger = logging.getLogger('django_mailer.routing')
+
+
+class Destination(namedtuple('Destination', 'backend options')):
+    """
+    Where messages are sent: an email backend (``None`` for the default one)
+    and the connection options, as a sorted tuple of ``(name, value)``
+    items.
+
+    """
+
+    @property
+    def kwargs(self):
+        return dict(self.options)
+
+
+def resolve_mx(domain):
+    """
+    Return the host name of the preferred mail exchanger for ``domain``.
+
+    """
+    if dns is None:
+        return domain
+    resolver = dns.resolver.Resolver()
+    query = getattr(resolver, 'resolve', None) or resolver.query
+    try:
+        answers = query(domain, 'MX')
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return domain
+    except dns.exception.DNSException as err:
+        logger.warning("MX lookup for %s failed: %s" % (domain, err))
+        return domain
+    records = sorted(answers, key=lambda record: record.preference)
+    return records[0].exchange.to_text().rstrip('.') or domain
+
+
+class Router(object):
+    """
+    Map messages to their destination.
+
+    ``routes`` maps recipient domains to routes. An entry for ``example.com``
+    matches that domain only, one for ``.example.com`` matches its
+    subdomains too and a ``'*'`` entry matches any other domain. Messages
+    which match no route go to ``backend``.
+
+    A route is either the dotted path of an email backend or a dictionary
+    with these (optional) keys:
+
+    ``BACKEND``
+        The email backend (the default one if not set).
+
+    ``OPTIONS``
+        Keyword arguments for the backend, for example the ``host`` and
+        ``port`` of a relay.
+
+    ``MX``
+        If true, the ``host`` option is set to the mail exchanger of each
+        recipient domain (see ``resolve_mx``).
+
+    """
+
+    def __init__(self, routes, backend=None):
+        self.routes = dict((pattern.lower(), route)
+                           for pattern, route in routes.items())
+        self.backend = backend
+        self._exchangers = {}
+
+    @classmethod
+    def from_settings(cls, backend=None):
+        """
+        Return the router configured by the ``MAILER_ROUTES`` setting (with
+        no routes, every message goes to ``backend``).
+
+        """
+        return cls(settings.ROUTES or {}, backend)
+
+    def match(self, domain):
+        """
+        Return the route for a (lower case) recipient domain, or ``None``.
+
+        """
+        if domain in self.routes:
+            return self.routes[domain]
+        parts = domain.split('.')
+        for i in range(len(parts)):
+            suffix = '.' + '.'.join(parts[i:])
+            if suffix in self.routes:
+                return self.routes[suffix]
+        return self.routes.get('*')
+
+    def destination(self, message):
+        """
+        Return the ``Destination`` of a message.
+
+        """
+        domain = get_domain(message.to_address).lower()
+        route = self.match(domain)
+        if route is None:
+            return Destination(self.backend, ())
+        if not isinstance(route, dict):
+            return Destination(route, ())
+        options = dict(route.get('OPTIONS') or {})
+        if route.get('MX'):
+            if domain not in self._exchangers:
+                self._exchangers[domain] = resolve_mx(domain)
+            options['host'] = self._exchangers[domain]
+        return Destination(route.get('BACKEND') or self.backend,
+                           tuple(sorted(options.items())))
+
+    def group(self, queued_messages):
+        """
+        Split queued messages by destination, returning a list of
+        ``(destination, queued_messages)`` tuples in the order each
+        destination is first seen.
+
+        """
+        groups = {}
+        ordered_groups = []
+        for queued_message in queued_messages:
+            destination = self.destination(queued_message.message)
+            if destination not in groups:
+                groups[destination] = []
+                ordered_groups.append((destination, groups[destination]))
+            groups[destination].append(queued_message)
+        return ordered_groups
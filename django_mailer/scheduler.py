@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Weighted-fair scheduling of the priority levels of the queue.
+
+By default the queue is sent in strict priority order, so a steady stream of
+high priority mail can hold back low priority mail indefinitely. With the
+``MAILER_PRIORITY_WEIGHTS`` setting, the messages of each block are instead
+taken from every priority level in proportion to its weight (a smooth
+weighted round robin, carried over from one block to the next). With the
+``MAILER_PRIORITY_MAX_AGE`` setting, messages which have waited longer than
+their level's maximum age are promoted ahead of everything else.
+
+"""
+try:
+    from django.utils.timezone import now
+except ImportError:
+    import datetime
+    now = datetime.datetime.now
+
+from django.db.models import Q
+from django.utils import six
+from django_mailer import constants, settings
+import datetime
+import threading
+
+PRIORITY_NAMES = dict((value, name)
+                      for name, value in constants.PRIORITIES.items())
+
+
+def _priority(key):
+    """
+    Return the priority value of a priority name (or value).
+
+    """
+    if isinstance(key, six.string_types):
+        return constants.PRIORITIES[key.lower()]
+    return key
+
+
+class Scheduler(object):
+    """
+    Choose which queued messages make up each block.
+
+    ``weights`` maps priorities (values or names such as ``'low'``) to their
+    share of each block. Priorities without a weight are sent first, in
+    priority order. ``max_age`` maps priorities to the number of seconds
+    after which their messages are promoted.
+
+    The decisions taken are counted in ``stats`` until ``pop_stats`` is
+    called.
+
+    """
+
+    def __init__(self, weights=None, max_age=None):
+        self.weights = dict((_priority(key), weight)
+                            for key, weight in (weights or {}).items()
+                            if weight > 0)
+        self.max_age = dict((_priority(key), seconds)
+                            for key, seconds in (max_age or {}).items()
+                            if seconds is not None)
+        # The round robin credit of each level, and the levels it is for.
+        self._current = dict((priority, 0) for priority in self.weights)
+        self._active = None
+        self._lock = threading.Lock()
+        self.stats = self._new_stats()
+        self.last_stats = None
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Return the scheduler configured by the ``MAILER_PRIORITY_WEIGHTS``
+        and ``MAILER_PRIORITY_MAX_AGE`` settings, or ``None`` if neither is
+        set (the queue is then sent in strict priority order).
+
+        """
+        if not (settings.PRIORITY_WEIGHTS or settings.PRIORITY_MAX_AGE):
+            return None
+        return cls(settings.PRIORITY_WEIGHTS, settings.PRIORITY_MAX_AGE)
+
+    def _new_stats(self):
+        return {'priorities': {}, 'promoted': 0}
+
+    def select(self, queue, limit=None):
+        """
+        Return the primary keys of up to ``limit`` messages of the ``queue``
+        QuerySet, in the order they should be sent.
+
+        """
+        with self._lock:
+            chosen = []
+            taken = set()
+
+            def take(rows, promoted=False):
+                if limit and len(chosen) >= limit:
+                    return
+                for pk, priority in rows:
+                    if pk in taken:
+                        continue
+                    chosen.append(pk)
+                    taken.add(pk)
+                    counts = self.stats['priorities']
+                    counts[priority] = counts.get(priority, 0) + 1
+                    if promoted:
+                        self.stats['promoted'] += 1
+                    if limit and len(chosen) >= limit:
+                        break
+
+            def fetch(queryset, *ordering):
+                queryset = queryset.order_by(*ordering + ('pk',))\
+                    .values_list('pk', 'priority')
+                if limit:
+                    queryset = queryset[:limit + len(chosen)]
+                return list(queryset)
+
+            overdue = self._overdue_filter()
+            if overdue is not None:
+                take(fetch(queue.filter(overdue), 'date_queued'),
+                     promoted=True)
+            take(fetch(queue.exclude(priority__in=list(self.weights)),
+                       'priority', 'date_queued'))
+            levels = {}
+            for priority in self.weights:
+                if limit and len(chosen) >= limit:
+                    break
+                rows = [row for row in fetch(queue.filter(priority=priority),
+                                             'date_queued')
+                        if row[0] not in taken]
+                if rows:
+                    levels[priority] = rows
+            take(self._interleave(levels))
+            return chosen
+
+    def _overdue_filter(self):
+        """
+        Return a ``Q`` object matching the messages older than their
+        priority's maximum age, or ``None``.
+
+        """
+        query = None
+        current_time = now()
+        for priority, seconds in self.max_age.items():
+            q = Q(priority=priority, date_queued__lte=current_time -
+                  datetime.timedelta(seconds=seconds))
+            query = q if query is None else query | q
+        return query
+
+    def _interleave(self, levels):
+        """
+        Yield the rows of each priority level in ``levels`` mixed by weight,
+        with a smooth weighted round robin (each level's credit grows by its
+        weight every turn and the level with the most credit goes next).
+
+        """
+        levels = dict((priority, list(reversed(rows)))
+                      for priority, rows in levels.items())
+        while levels:
+            active = sorted(levels)
+            if active != self._active:
+                # Start afresh whenever a level runs out (or comes back).
+                self._active = active
+                for priority in self._current:
+                    self._current[priority] = 0
+            total = sum(self.weights[priority] for priority in levels)
+            for priority in levels:
+                self._current[priority] += self.weights[priority]
+            priority = max(active,
+                           key=lambda priority: self._current[priority])
+            self._current[priority] -= total
+            rows = levels[priority]
+            yield rows.pop()
+            if not rows:
+                del levels[priority]
+
+    def pop_stats(self):
+        """
+        Return the decisions counted since the last call (see
+        ``format_stats``) and start counting afresh.
+
+        """
+        with self._lock:
+            self.last_stats, self.stats = self.stats, self._new_stats()
+        return self.last_stats
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """
+    Return the scheduler for the current settings (see
+    ``Scheduler.from_settings``), kept from one delivery run to the next so
+    that the mix of priorities carries over between runs.
+
+    """
+    global _scheduler
+    configuration = (dict(settings.PRIORITY_WEIGHTS or {}),
+                     dict(settings.PRIORITY_MAX_AGE or {}))
+    if _scheduler is None or _scheduler[0] != configuration:
+        _scheduler = configuration, Scheduler.from_settings()
+    return _scheduler[1]
+
+
+def format_stats(stats):
+    """
+    Describe the scheduling decisions counted in ``stats``, for example
+    ``"8 high, 3 normal, 1 low (1 promoted by age)"``.
+
+    """
+    parts = ['%s %s' % (count, PRIORITY_NAMES.get(priority, priority))
+             for priority, count in sorted(stats['priorities'].items())]
+    description = ', '.join(parts) or 'nothing'
+    if stats['promoted']:
+        description += ' (%s promoted by age)' % stats['promoted']
+    return description
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Indexed search of messages (see the ``MAILER_INDEX_MESSAGES`` and
+``MAILER_SEARCH_ENCODED_MESSAGE`` settings).
+
+Rather than scanning the encoded messages (whole MIME documents, however
+large their attachments) with ``LIKE``, messages are searched through their
+``search_text``: the decoded headers and plain text body, and the address of
+the recipient the row is sent to, recorded when they are queued (or by the
+``index_mail`` command for older messages).
+
+The search text is indexed by the database where possible: with full text
+and trigram GIN indexes on PostgreSQL, and with an FTS5 table kept up to
+date by triggers on SQLite. Other databases search it with ``LIKE``, which
+is still much cheaper than searching the encoded messages.
+
+"""
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.encoding import force_text
+from django.utils.html import strip_tags
+from django_mailer import mime_index, settings
+import logging
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django version < 1.6
+    from django.db.transaction import commit_on_success as atomic
+
+logger = logging.getLogger('django_mailer.search')
+
+# The search text is cut short to keep the indexes (and PostgreSQL's
+# tsvectors, which are limited to 1MB) to a sensible size.
+MAX_LENGTH = 64 * 1024
+FTS_TABLE = 'django_mailer_message_search'
+# The fields of a message searched when search texts aren't recorded.
+SEARCHED_FIELDS = ('to_address', 'from_address', 'subject')
+
+
+def search_text(msg):
+    """
+    Return the search text of a parsed message (a ``PyzMessage``, with its
+    stored parts left out): its subject, addresses and plain text body (or
+    HTML body without its tags).
+
+    """
+    from pyzmail.parse import decode_text
+
+    lines = [msg.get_subject()]
+    for name in ('from', 'to', 'cc'):
+        for real_name, address in msg.get_addresses(name):
+            if real_name and real_name != address:
+                address = '%s <%s>' % (real_name, address)
+            lines.append(address)
+    body_part = msg.text_part or msg.html_part
+    if body_part is not None:
+        payload = body_part.part.get_payload()
+        stored_part = mime_index._stored_part(payload)
+        if stored_part:
+            payload = mime_index._read_stored_part(stored_part)
+        else:
+            payload = body_part.get_payload()
+        body = decode_text(payload, body_part.charset, None)[0]
+        if body_part is not msg.text_part:
+            body = strip_tags(body)
+        lines.append(body)
+    return '\n'.join(force_text(line) for line in lines)[:MAX_LENGTH]
+
+
+def recipient_text(text, to_address):
+    """
+    Return the search text of the ``Message`` row sending a message with the
+    search text ``text`` to ``to_address``, adding the address if the text
+    doesn't contain it (Bcc recipients aren't named in the headers).
+
+    """
+    if to_address in text:
+        return text
+    return ('%s\n%s' % (to_address, text))[:MAX_LENGTH]
+
+
+def _quote(connection, queryset, column):
+    return '%s.%s' % (connection.ops.quote_name(queryset.model._meta.db_table),
+                      connection.ops.quote_name(column))
+
+
+def has_fts_table(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                   [FTS_TABLE])
+    return cursor.fetchone() is not None
+
+
+def search(queryset, search_term):
+    """
+    Filter a ``Message`` queryset to the messages whose search text
+    contains every word of ``search_term``.
+
+    Messages without a search text (queued while the ``MAILER_INDEX_MESSAGES``
+    setting was disabled) aren't found until the ``index_mail`` command
+    records it.
+
+    """
+    connection = connections[queryset.db]
+    for term in search_term.split():
+        if connection.vendor == 'postgresql':
+            column = _quote(connection, queryset, 'search_text')
+            # Matched by the full text index, or by the trigram index.
+            like = '%%%s%%' % term.replace('\\', '\\\\').replace(
+                '%', '\\%').replace('_', '\\_')
+            queryset = queryset.extra(
+                where=["(to_tsvector('simple', %s) @@ "
+                       "plainto_tsquery('simple', %%s) OR %s ILIKE %%s)"
+                       % (column, column)],
+                params=[term, like])
+        elif connection.vendor == 'sqlite' and has_fts_table(connection):
+            # A prefix search of the term as a phrase.
+            match = '"%s" *' % term.replace('"', '""')
+            queryset = queryset.extra(
+                where=['%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)'
+                       % (_quote(connection, queryset, 'id'), FTS_TABLE,
+                          FTS_TABLE)],
+                params=[match])
+        else:
+            queryset = queryset.filter(search_text__icontains=term)
+    return queryset
+
+
+def search_fields(queryset, search_term):
+    """
+    Filter a ``Message`` queryset to the messages whose ``SEARCHED_FIELDS``
+    contain every word of ``search_term``, used when search texts aren't
+    recorded.
+
+    """
+    for term in search_term.split():
+        query = Q()
+        for name in SEARCHED_FIELDS:
+            query |= Q(**{'%s__icontains' % name: term})
+        queryset = queryset.filter(query)
+    return queryset
+
+
+def create_index(using):
+    """
+    Create the database's search indexes of the search text, if it has any
+    and they don't exist yet.
+
+    """
+    from django_mailer.models import Message
+
+    connection = connections[using]
+    table = Message._meta.db_table
+    if table not in connection.introspection.table_names():
+        return
+    quoted = connection.ops.quote_name(table)
+    if connection.vendor == 'postgresql':
+        statements = [
+            "CREATE INDEX IF NOT EXISTS %s_fts ON %s USING gin "
+            "(to_tsvector('simple', search_text))" % (table, quoted),
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            "CREATE INDEX IF NOT EXISTS %s_trgm ON %s USING gin "
+            "(search_text gin_trgm_ops)" % (table, quoted),
+        ]
+    elif connection.vendor == 'sqlite':
+        if has_fts_table(connection):
+            return
+        statements = [
+            "CREATE VIRTUAL TABLE %s USING fts5(search_text, content=%s, "
+            "content_rowid='id')" % (FTS_TABLE, quoted),
+            "CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN "
+            "INSERT INTO %s(rowid, search_text) "
+            "VALUES (new.id, new.search_text); END"
+            % (FTS_TABLE, quoted, FTS_TABLE),
+            "CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN "
+            "INSERT INTO %s(%s, rowid, search_text) "
+            "VALUES ('delete', old.id, old.search_text); END"
+            % (FTS_TABLE, quoted, FTS_TABLE, FTS_TABLE),
+            "CREATE TRIGGER %s_update AFTER UPDATE OF search_text ON %s "
+            "BEGIN INSERT INTO %s(%s, rowid, search_text) "
+            "VALUES ('delete', old.id, old.search_text); "
+            "INSERT INTO %s(rowid, search_text) "
+            "VALUES (new.id, new.search_text); END"
+            % (FTS_TABLE, quoted, FTS_TABLE, FTS_TABLE, FTS_TABLE),
+            "INSERT INTO %s(%s) VALUES ('rebuild')" % (FTS_TABLE, FTS_TABLE),
+        ]
+    else:
+        return
+    for statement in statements:
+        try:
+            with atomic(using=using):
+                connection.cursor().execute(statement)
+        except DatabaseError as e:
+            # For example without the pg_trgm extension or SQLite's FTS5,
+            # the search text is then searched with LIKE instead.
+            logger.warning("The message search index couldn't be "
+                           "created: %s" % e)
+            break
+
+
+def create_index_after_migrate(sender, **kwargs):
+    """
+    Create the search indexes once the tables are created (connected to the
+    ``post_migrate`` or ``post_syncdb`` signal), if the
+    ``MAILER_INDEX_MESSAGES`` setting is enabled.
+
+    """
+    if getattr(sender, 'name', getattr(sender, '__name__', None)) not in \
+            ('django_mailer', 'django_mailer.models'):
+        return
+    if not settings.INDEX_MESSAGES:
+        return
+    create_index(kwargs.get('using') or kwargs.get('db') or 'default')
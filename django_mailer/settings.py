@@ -13,9 +13,34 @@ MAIL_ADMINS_PRIORITY = getattr(settings, 'MAILER_MAIL_ADMINS_PRIORITY',
 MAIL_MANAGERS_PRIORITY = getattr(settings, 'MAILER_MAIL_MANAGERS_PRIORITY',
                                  None)
 
+# Queue messages using bulk inserts inside a single transaction rather than
+# saving a row at a time, and how many rows to write per insert.
+BULK_ENQUEUE = getattr(settings, 'MAILER_BULK_ENQUEUE', False)
+BULK_ENQUEUE_BATCH_SIZE = getattr(settings, 'MAILER_BULK_ENQUEUE_BATCH_SIZE',
+                                  500)
+
+# Store message bodies compressed in a binary column: False, 'zlib' (or True)
+# or 'zstd' (requires the zstandard package).
+COMPRESS_MESSAGES = getattr(settings, 'MAILER_COMPRESS_MESSAGES', False)
+
+# Store each distinct message body once (identified by its hash) rather than
+# once per recipient.
+DEDUPLICATE_BODIES = getattr(settings, 'MAILER_DEDUPLICATE_BODIES', False)
+
 # When queue is empty, how long to wait (in seconds) before checking again.
 EMPTY_QUEUE_SLEEP = getattr(settings, "MAILER_EMPTY_QUEUE_SLEEP", 30)
 
+# The first wait of an idle send_loop, doubled on each empty check up to
+# EMPTY_QUEUE_SLEEP.
+EMPTY_QUEUE_MIN_SLEEP = getattr(settings, "MAILER_EMPTY_QUEUE_MIN_SLEEP", 1)
+
+# Wake up a waiting send_loop as soon as mail is queued, with a NOTIFY on
+# NOTIFY_CHANNEL (PostgreSQL) or a datagram sent to the WAKEUP_SOCKET local
+# socket (other databases; defaults to the lock path with a .sock suffix).
+NOTIFY_QUEUE = getattr(settings, "MAILER_NOTIFY_QUEUE", False)
+NOTIFY_CHANNEL = getattr(settings, "MAILER_NOTIFY_CHANNEL", "django_mailer")
+WAKEUP_SOCKET = getattr(settings, "MAILER_WAKEUP_SOCKET", None)
+
 # Lock timeout value. how long to wait for the lock to become available.
 # default behavior is to never wait for the lock to be available.
 # lockfile has a bug dealing with negative values so ensure it's always >= 0
@@ -25,6 +50,12 @@ LOCK_WAIT_TIMEOUT = max(getattr(settings, "MAILER_LOCK_WAIT_TIMEOUT", 0), 0)
 # projects running on the same server.
 LOCK_PATH = getattr(settings, "MAILER_LOCK_PATH", None)
 
+# Lease blocks of queued messages in the database rather than using a lock
+# file, allowing several sending processes (on several hosts) to share the
+# queue. A lease which hasn't been released lasts LEASE_TIME seconds.
+LEASE_QUEUE = getattr(settings, "MAILER_LEASE_QUEUE", False)
+LEASE_TIME = getattr(settings, "MAILER_LEASE_TIME", 600)
+
 
 # Controls for delivery
 # Allow sending a fixed/limited amount of emails in each delivery run
@@ -38,3 +69,114 @@ EMAIL_MAX_DEFERRED = getattr(settings, "MAILER_EMAIL_MAX_DEFERRED", None)
 # When delivering, wait some time between emails to avoid server overload
 # defaults to 0 for no waiting
 EMAIL_THROTTLE = getattr(settings, "MAILER_EMAIL_THROTTLE", 0)
+
+# How many delivery threads (each with its own backend connection) are used
+# when sending the queue. defaults to 1 which sends one message at a time.
+DELIVERY_WORKERS = max(getattr(settings, "MAILER_DELIVERY_WORKERS", 1), 1)
+
+# The outcomes of delivery attempts (logs and removal of sent messages from
+# the queue) are written in batches of RESULT_BATCH_SIZE, or at least every
+# RESULT_FLUSH_INTERVAL seconds.
+RESULT_BATCH_SIZE = getattr(settings, "MAILER_RESULT_BATCH_SIZE", 100)
+RESULT_FLUSH_INTERVAL = getattr(settings, "MAILER_RESULT_FLUSH_INTERVAL", 5)
+
+# The maximum number of recipients of messages with the same sender and body
+# which are sent in a single SMTP transaction (one RCPT TO per recipient).
+# defaults to 1 which sends each queued message in its own transaction.
+MAX_RECIPIENTS_PER_TRANSACTION = max(
+    getattr(settings, "MAILER_MAX_RECIPIENTS_PER_TRANSACTION", 1), 1)
+
+# Keep backend connections open in a process-wide pool between delivery runs
+# and immediately sent messages. At most CONNECTION_POOL_SIZE idle connections
+# are kept per backend, and a connection is replaced once it is older than
+# CONNECTION_MAX_AGE seconds or has sent CONNECTION_MAX_MESSAGES messages
+# (None for no limit). Disabled by default.
+CONNECTION_POOL = getattr(settings, "MAILER_CONNECTION_POOL", False)
+CONNECTION_POOL_SIZE = getattr(settings, "MAILER_CONNECTION_POOL_SIZE", 4)
+CONNECTION_MAX_AGE = getattr(settings, "MAILER_CONNECTION_MAX_AGE", 300)
+CONNECTION_MAX_MESSAGES = getattr(settings, "MAILER_CONNECTION_MAX_MESSAGES",
+                                  1000)
+
+# How many backend connections are used at once by the asyncio delivery
+# engine (``async_engine.send_all_async``, Python 3.5 or later).
+ASYNC_CONCURRENCY = max(getattr(settings, "MAILER_ASYNC_CONCURRENCY", 10), 1)
+
+# When the connection to the mail server is lost while sending, how many
+# times to try reopening it (waiting RECONNECT_BACKOFF seconds, doubled after
+# each attempt) before stopping the delivery run. The message being sent is
+# retried once the connection is back.
+RECONNECT_ATTEMPTS = max(getattr(settings, "MAILER_RECONNECT_ATTEMPTS", 3), 1)
+RECONNECT_BACKOFF = getattr(settings, "MAILER_RECONNECT_BACKOFF", 1)
+
+# Retry failed messages automatically, RETRY_BACKOFF seconds after the first
+# failure and doubling the delay (up to RETRY_MAX_DELAY seconds, with some
+# jitter) after each further one, rather than flagging them as deferred.
+# Messages are only flagged as deferred after MAX_ATTEMPTS failed attempts
+# (None for no limit). defaults to None which defers any failed message.
+RETRY_BACKOFF = getattr(settings, "MAILER_RETRY_BACKOFF", None)
+RETRY_MAX_DELAY = getattr(settings, "MAILER_RETRY_MAX_DELAY", 6 * 60 * 60)
+MAX_ATTEMPTS = getattr(settings, "MAILER_MAX_ATTEMPTS", 10)
+
+# Rate limits per recipient domain and per sender address, as dictionaries
+# mapping a (lower case) domain or address to a (messages, seconds) tuple. A
+# '*' entry applies to every domain (or sender) not listed. Messages over a
+# limit stay queued but aren't due again until their bucket has refilled. The
+# token buckets are kept in this process' memory ('local'), in the
+# RATE_LIMIT_CACHE cache ('cache') or in the database ('database'), the
+# latter two being shared by all senders.
+DOMAIN_RATE_LIMITS = getattr(settings, "MAILER_DOMAIN_RATE_LIMITS", {})
+SENDER_RATE_LIMITS = getattr(settings, "MAILER_SENDER_RATE_LIMITS", {})
+RATE_LIMIT_STORE = getattr(settings, "MAILER_RATE_LIMIT_STORE", "local")
+RATE_LIMIT_CACHE = getattr(settings, "MAILER_RATE_LIMIT_CACHE", "default")
+
+# Routes sending the mail for some recipient domains through other email
+# backends or mail servers (or directly to their MX), see
+# django_mailer.routing. Each destination has its own connections and
+# delivery threads, up to MAX_DESTINATIONS destinations at once.
+ROUTES = getattr(settings, "MAILER_ROUTES", {})
+MAX_DESTINATIONS = getattr(settings, "MAILER_MAX_DESTINATIONS", 10)
+
+# Mix the priority levels of each block by weight, for example
+# {'high': 8, 'normal': 3, 'low': 1}, instead of sending in strict priority
+# order (see django_mailer.scheduler). PRIORITY_MAX_AGE maps priorities to
+# how many seconds their messages may wait before they are sent first.
+PRIORITY_WEIGHTS = getattr(settings, "MAILER_PRIORITY_WEIGHTS", None)
+PRIORITY_MAX_AGE = getattr(settings, "MAILER_PRIORITY_MAX_AGE", None)
+
+# Serialize queued messages straight to file storage and stream them to the
+# SMTP server in chunks of STREAM_CHUNK_SIZE bytes, rather than building and
+# storing them as strings (see django_mailer.streaming). The storage is an
+# instance of the STORAGE class if set, otherwise a file system storage in
+# the STORAGE_LOCATION directory.
+STREAM_MESSAGES = getattr(settings, "MAILER_STREAM_MESSAGES", False)
+STREAM_CHUNK_SIZE = getattr(settings, "MAILER_STREAM_CHUNK_SIZE", 64 * 1024)
+STORAGE = getattr(settings, "MAILER_STORAGE", None)
+STORAGE_LOCATION = getattr(settings, "MAILER_STORAGE_LOCATION", None)
+
+# The size (in bytes, once base64 encoded) from which MIME parts, usually
+# attachments, are kept in the storage rather than in the encoded message,
+# only once however many messages they are in (see django_mailer.parts). If
+# None, every part is kept in the encoded message.
+STORED_PART_MIN_SIZE = getattr(settings, "MAILER_STORED_PART_MIN_SIZE", None)
+
+# The most bytes of parsed messages the admin keeps in memory, so that
+# showing a message or downloading one of its attachments doesn't parse the
+# whole message every time (see django_mailer.mime_index).
+ADMIN_CACHE_SIZE = getattr(settings, "MAILER_ADMIN_CACHE_SIZE",
+                           10 * 1024 * 1024)
+
+# Record the search text (decoded headers and plain text body) of messages
+# when they are queued, and index it, so that the admin searches their
+# content (see django_mailer.search). Otherwise the admin only searches their
+# recipient, sender and subject.
+INDEX_MESSAGES = getattr(settings, "MAILER_INDEX_MESSAGES", False)
+
+# Search the whole encoded messages in the admin (scanning them with LIKE),
+# rather than their search text or fields.
+SEARCH_ENCODED_MESSAGE = getattr(settings, "MAILER_SEARCH_ENCODED_MESSAGE",
+                                 False)
+
+# Page through the admin's change lists by primary key, with estimated
+# counts and no date hierarchy, so that they stay fast however large the
+# tables grow (see django_mailer.changelist).
+ADMIN_LARGE_TABLES = getattr(settings, "MAILER_ADMIN_LARGE_TABLES", False)
@@ -24,7 +24,12 @@ class EmailBackend(BaseEmailBackend):
         if not email_messages:
             return
 
-        from django_mailer import queue_email_message
+        from django_mailer import (queue_email_message, queue_email_messages,
+                                   settings)
+
+        if settings.BULK_ENQUEUE:
+            queue_email_messages(email_messages)
+            return len(email_messages)
 
         num_sent = 0
         for email_message in email_messages:
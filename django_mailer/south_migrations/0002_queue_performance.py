@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from django_mailer import compression
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'RateLimitBucket'
+        db.create_table(u'django_mailer_ratelimitbucket', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('key', self.gf('django.db.models.fields.CharField')(unique=True, max_length=300)),
+            ('tokens', self.gf('django.db.models.fields.FloatField')()),
+            ('updated', self.gf('django.db.models.fields.FloatField')()),
+        ))
+        db.send_create_signal(u'django_mailer', ['RateLimitBucket'])
+
+        # Adding model 'MessageBody'
+        db.create_table(u'django_mailer_messagebody', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('content_hash', self.gf('django.db.models.fields.CharField')(unique=True, max_length=64)),
+            ('encoded_message', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('date_created', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+        ))
+        db.send_create_signal(u'django_mailer', ['MessageBody'])
+
+
+        # Changing field 'Blacklist.email'
+        db.alter_column(u'django_mailer_blacklist', 'email', self.gf('django.db.models.fields.CharField')(max_length=200))
+        # Adding field 'QueuedMessage.owner'
+        db.add_column(u'django_mailer_queuedmessage', 'owner',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=100, blank=True),
+                      keep_default=False)
+
+        # Adding field 'QueuedMessage.lease_expires'
+        db.add_column(u'django_mailer_queuedmessage', 'lease_expires',
+                      self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'QueuedMessage.next_attempt'
+        db.add_column(u'django_mailer_queuedmessage', 'next_attempt',
+                      self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True),
+                      keep_default=False)
+
+        # Adding index on 'QueuedMessage', fields ['deferred', 'date_queued']
+        db.create_index(u'django_mailer_queuedmessage', ['deferred', 'date_queued'])
+
+        # Adding index on 'QueuedMessage', fields ['deferred', 'priority', 'date_queued', u'id']
+        db.create_index(u'django_mailer_queuedmessage', ['deferred', 'priority', 'date_queued', u'id'])
+
+        if compression.AVAILABLE:
+            # Adding field 'MessageBody.compressed_message'
+            db.add_column(u'django_mailer_messagebody', 'compressed_message',
+                          self.gf('django.db.models.fields.BinaryField')(null=True),
+                          keep_default=False)
+
+            # Adding field 'Message.compressed_message'
+            db.add_column(u'django_mailer_message', 'compressed_message',
+                          self.gf('django.db.models.fields.BinaryField')(null=True),
+                          keep_default=False)
+
+        # Adding field 'Message.body'
+        db.add_column(u'django_mailer_message', 'body',
+                      self.gf('django.db.models.fields.related.ForeignKey')(to=orm['django_mailer.MessageBody'], null=True, on_delete=models.PROTECT, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Message.content_hash'
+        db.add_column(u'django_mailer_message', 'content_hash',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=64, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Message.stored_message'
+        db.add_column(u'django_mailer_message', 'stored_message',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=255, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Message.stored_parts'
+        db.add_column(u'django_mailer_message', 'stored_parts',
+                      self.gf('django.db.models.fields.TextField')(default='', blank=True),
+                      keep_default=False)
+
+        # Adding field 'Message.attachment_manifest'
+        db.add_column(u'django_mailer_message', 'attachment_manifest',
+                      self.gf('django.db.models.fields.TextField')(default='', blank=True),
+                      keep_default=False)
+
+        # Adding field 'Message.search_text'
+        db.add_column(u'django_mailer_message', 'search_text',
+                      self.gf('django.db.models.fields.TextField')(default='', blank=True),
+                      keep_default=False)
+
+        # Adding field 'Message.enqueue_marker'
+        db.add_column(u'django_mailer_message', 'enqueue_marker',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=32, blank=True),
+                      keep_default=False)
+
+        # Adding index on 'Message', fields ['date_created']
+        db.create_index(u'django_mailer_message', ['date_created'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Message', fields ['date_created']
+        db.delete_index(u'django_mailer_message', ['date_created'])
+
+        # Removing index on 'QueuedMessage', fields ['deferred', 'priority', 'date_queued', u'id']
+        db.delete_index(u'django_mailer_queuedmessage', ['deferred', 'priority', 'date_queued', u'id'])
+
+        # Removing index on 'QueuedMessage', fields ['deferred', 'date_queued']
+        db.delete_index(u'django_mailer_queuedmessage', ['deferred', 'date_queued'])
+
+        # Deleting model 'RateLimitBucket'
+        db.delete_table(u'django_mailer_ratelimitbucket')
+
+        # Deleting model 'MessageBody'
+        db.delete_table(u'django_mailer_messagebody')
+
+
+        # Changing field 'Blacklist.email'
+        db.alter_column(u'django_mailer_blacklist', 'email', self.gf('django.db.models.fields.EmailField')(max_length=200))
+        # Deleting field 'QueuedMessage.owner'
+        db.delete_column(u'django_mailer_queuedmessage', 'owner')
+
+        # Deleting field 'QueuedMessage.lease_expires'
+        db.delete_column(u'django_mailer_queuedmessage', 'lease_expires')
+
+        # Deleting field 'QueuedMessage.next_attempt'
+        db.delete_column(u'django_mailer_queuedmessage', 'next_attempt')
+
+        if compression.AVAILABLE:
+            # Deleting field 'Message.compressed_message'
+            db.delete_column(u'django_mailer_message', 'compressed_message')
+
+        # Deleting field 'Message.body'
+        db.delete_column(u'django_mailer_message', 'body_id')
+
+        # Deleting field 'Message.content_hash'
+        db.delete_column(u'django_mailer_message', 'content_hash')
+
+        # Deleting field 'Message.stored_message'
+        db.delete_column(u'django_mailer_message', 'stored_message')
+
+        # Deleting field 'Message.stored_parts'
+        db.delete_column(u'django_mailer_message', 'stored_parts')
+
+        # Deleting field 'Message.attachment_manifest'
+        db.delete_column(u'django_mailer_message', 'attachment_manifest')
+
+        # Deleting field 'Message.search_text'
+        db.delete_column(u'django_mailer_message', 'search_text')
+
+        # Deleting field 'Message.enqueue_marker'
+        db.delete_column(u'django_mailer_message', 'enqueue_marker')
+
+
+    models = {
+        u'django_mailer.blacklist': {
+            'Meta': {'ordering': "('-date_added',)", 'object_name': 'Blacklist'},
+            'date_added': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'django_mailer.log': {
+            'Meta': {'ordering': "('-date',)", 'object_name': 'Log'},
+            'date': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'log_message': ('django.db.models.fields.TextField', [], {}),
+            'message': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['django_mailer.Message']"}),
+            'result': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        },
+        u'django_mailer.message': {
+            'Meta': {'ordering': "('date_created',)", 'object_name': 'Message'},
+            'attachment_manifest': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'body': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['django_mailer.MessageBody']", 'null': 'True', 'on_delete': 'models.PROTECT', 'blank': 'True'}),
+            'compressed_message': ('django.db.models.fields.BinaryField', [], {'null': 'True'}),
+            'content_hash': ('django.db.models.fields.CharField', [], {'max_length': '64', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'encoded_message': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'enqueue_marker': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'from_address': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'search_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'stored_message': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'stored_parts': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'to_address': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'django_mailer.messagebody': {
+            'Meta': {'object_name': 'MessageBody'},
+            'compressed_message': ('django.db.models.fields.BinaryField', [], {'null': 'True'}),
+            'content_hash': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'encoded_message': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'django_mailer.queuedmessage': {
+            'Meta': {'ordering': "('priority', 'date_queued')", 'object_name': 'QueuedMessage', 'index_together': "(('deferred', 'priority', 'date_queued', 'id'), ('deferred', 'date_queued'))"},
+            'date_queued': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'deferred': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'lease_expires': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'message': ('django.db.models.fields.related.OneToOneField', [], {'to': u"orm['django_mailer.Message']", 'unique': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'owner': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'priority': ('django.db.models.fields.PositiveSmallIntegerField', [], {'default': '3'}),
+            'retries': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'django_mailer.ratelimitbucket': {
+            'Meta': {'object_name': 'RateLimitBucket'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '300'}),
+            'tokens': ('django.db.models.fields.FloatField', [], {}),
+            'updated': ('django.db.models.fields.FloatField', [], {})
+        }
+    }
+
+    if not compression.AVAILABLE:
+        # Django version < 1.6
+        del models[u'django_mailer.message']['compressed_message']
+        del models[u'django_mailer.messagebody']['compressed_message']
+
+    complete_apps = ['django_mailer']
\ No newline at end of file
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+The file storage used to keep message data out of the database (see the
+``MAILER_STORAGE`` and ``MAILER_STORAGE_LOCATION`` settings).
+
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django_mailer import settings
+
+_storage = None
+
+
+def get_storage():
+    """
+    Return the storage instance configured by the settings: an instance of
+    the ``MAILER_STORAGE`` class if set, otherwise a file system storage in
+    the ``MAILER_STORAGE_LOCATION`` directory.
+
+    """
+    global _storage
+    configuration = (settings.STORAGE, settings.STORAGE_LOCATION)
+    if _storage is None or _storage[0] != configuration:
+        if settings.STORAGE:
+            storage = get_storage_class(settings.STORAGE)()
+        elif settings.STORAGE_LOCATION:
+            storage = FileSystemStorage(location=settings.STORAGE_LOCATION)
+        else:
+            # Never the media directory, which is usually served publicly.
+            raise ImproperlyConfigured(
+                "MAILER_STORAGE_LOCATION (or MAILER_STORAGE) must be set to "
+                "store messages outside of the database.")
+        _storage = configuration, storage
+    return _storage[1]
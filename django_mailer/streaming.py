@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Streaming of encoded messages to and from file storage (see the
+``MAILER_STREAM_MESSAGES`` setting).
+
+Instead of being built as one string and stored in the database, a queued
+message is serialized straight to a temporary file and saved in the storage
+(see ``django_mailer.storage``). When it is sent, the stored file is read in
+chunks of ``MAILER_STREAM_CHUNK_SIZE`` bytes and fed to the SMTP ``DATA``
+command, so the memory used per message stays bounded however large its
+attachments are.
+
+"""
+from email.generator import Generator
+from django.core.files import File
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text, smart_str
+from django.utils.six import BytesIO
+from django_mailer import parts, settings
+from django_mailer.storage import get_storage
+import smtplib
+import tempfile
+import uuid
+
+
+class _BinaryWriter(object):
+    """
+    A file-like object writing the text it is given to a binary file.
+
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        self.fileobj.write(force_bytes(data))
+
+
+def store_message(mime_message):
+    """
+    Serialize a MIME message (as ``as_string`` would) to the storage,
+    returning the name of the stored file.
+
+    """
+    temp = tempfile.TemporaryFile()
+    try:
+        generator = Generator(_BinaryWriter(temp), mangle_from_=False)
+        if six.PY2:
+            generator.flatten(mime_message, unixfrom=False)
+        else:
+            generator.flatten(mime_message, unixfrom=False, linesep='\n')
+        temp.seek(0)
+        name = uuid.uuid4().hex
+        return get_storage().save(
+            'django_mailer/messages/%s/%s.eml' % (name[:2], name), File(temp))
+    finally:
+        temp.close()
+
+
+def open_message(name):
+    """
+    Open a stored message for reading (in binary mode).
+
+    """
+    return get_storage().open(name, 'rb')
+
+
+def read_message(name):
+    """
+    Return the whole text of a stored message.
+
+    """
+    fileobj = open_message(name)
+    try:
+        return force_text(fileobj.read())
+    finally:
+        fileobj.close()
+
+
+def delete_message(name):
+    get_storage().delete(name)
+
+
+def sendmail(connection, message, recipients):
+    """
+    Send a ``Message`` from its sender to ``recipients`` over an SMTP
+    connection, returning the refused recipients like ``SMTP.sendmail``.
+
+    A stored message, or a message with stored parts, is streamed to an
+    ``smtplib`` connection in chunks (other connections, such as those of
+    test backends, are given the whole message).
+
+    """
+    if not (message.stored_message or message.stored_parts) or \
+            not hasattr(connection, 'docmd'):
+        return connection.sendmail(message.from_address, recipients,
+                                   smart_str(message.get_encoded_message()))
+    if message.stored_message:
+        fileobj = open_message(message.stored_message)
+    else:
+        fileobj = BytesIO(force_bytes(
+            message.get_encoded_message(splice_parts=False)))
+    if message.stored_parts:
+        fileobj = parts.SplicedFile(fileobj, message.get_stored_parts())
+    try:
+        return _sendmail(connection, message.from_address, recipients,
+                         fileobj)
+    finally:
+        fileobj.close()
+
+
+def _sendmail(smtp, from_addr, to_addrs, fileobj):
+    """
+    ``SMTP.sendmail``, with the message read from ``fileobj`` in chunks.
+
+    """
+    smtp.ehlo_or_helo_if_needed()
+    options = []
+    size = getattr(fileobj, 'size', None)
+    if size and smtp.does_esmtp and smtp.has_extn('size'):
+        options.append('size=%d' % size)
+    code, response = smtp.mail(from_addr, options)
+    if code != 250:
+        _rset(smtp)
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+    refused = {}
+    for address in to_addrs:
+        code, response = smtp.rcpt(address)
+        if code not in (250, 251):
+            refused[address] = (code, response)
+    if len(refused) == len(to_addrs):
+        _rset(smtp)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, response = smtp.docmd('data')
+    if code != 354:
+        _rset(smtp)
+        raise smtplib.SMTPDataError(code, response)
+    for chunk in data_chunks(fileobj):
+        smtp.send(chunk)
+    code, response = smtp.getreply()
+    if code != 250:
+        _rset(smtp)
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+def _rset(smtp):
+    try:
+        smtp.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def data_chunks(fileobj, chunk_size=None):
+    """
+    Yield the SMTP ``DATA`` of the message read from ``fileobj``, about
+    ``chunk_size`` bytes at a time (defaults to the
+    ``MAILER_STREAM_CHUNK_SIZE`` setting): lines end with CRLF, those
+    starting with a dot are dot-stuffed and the final ``.`` line is
+    included.
+
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    at_line_start = True
+    tail = b''
+    while True:
+        block = fileobj.read(chunk_size)
+        lines = (tail + block).split(b'\n')
+        tail = lines.pop()
+        if not block and tail:
+            # The last line has no line break.
+            lines.append(tail)
+            tail = b''
+        output = []
+        for line in lines:
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            if at_line_start and line.startswith(b'.'):
+                line = b'.' + line
+            output.append(line + b'\r\n')
+            at_line_start = True
+        if len(tail) > chunk_size:
+            # Don't buffer an overly long line (the last byte is kept back
+            # in case it is the CR of a line break).
+            piece, tail = tail[:-1], tail[-1:]
+            if at_line_start and piece.startswith(b'.'):
+                piece = b'.' + piece
+            output.append(piece)
+            at_line_start = False
+        if output:
+            yield b''.join(output)
+        if not block:
+            break
+    if not at_line_start:
+        yield b'\r\n'
+    yield b'.\r\n'
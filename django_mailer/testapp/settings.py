@@ -11,6 +11,8 @@ DATABASES = {
     },
 }
 
+MAILER_INDEX_MESSAGES = True
+
 INSTALLED_APPS = (
     'django.contrib.auth',
     'django.contrib.contenttypes',
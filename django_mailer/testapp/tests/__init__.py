@@ -5,4 +5,23 @@
 from .commands import TestCommands
 from .engine import LockTest #COULD DROP THIS TEST
 from .engine import TestSendConfiguration
+from .engine import TestResultBuffer
+from .engine import TestBlacklist
+from .engine import TestMessageBlocks
+from .engine import TestQueueLeases
+from .engine import TestTokenBucket
+from .engine import TestReconnect
+from .engine import TestRetryBackoff
+from .engine import TestSendLoop
+from .engine import TestAsyncEngine
 from .backend import TestBackend
+from .queries import TestQueryPlans
+from .pool import TestConnectionPool
+from .ratelimit import TestRateLimiter
+from .routing import TestRouting
+from .scheduler import TestScheduler
+from .streaming import TestStreaming
+from .parts import TestStoredParts
+from .mime_index import TestMimeIndex
+from .search import TestSearch
+from .changelist import TestKeysetChangeList
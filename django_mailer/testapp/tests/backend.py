@@ -4,7 +4,10 @@
 
 from django.conf import settings as django_settings
 from django.core import mail
-from django_mailer import models, constants, queue_email_message
+from django.utils import six
+from django.utils.unittest import skipIf
+from django_mailer import (models, constants, queue_email_message,
+                           queue_email_messages, settings)
 from .base import MailerTestCase
 
 
@@ -81,6 +84,7 @@ class TestBackend(MailerTestCase):
             self.assertEqual(queued_message.priority,
                              constants.PRIORITY_NORMAL)
 
+    @skipIf(six.PY3, "Django refuses the address when the message is built.")
     def testUnicodeQueuedMessage(self):
         """
         Checks that we capture unicode errors on mail
@@ -122,3 +126,85 @@ class TestBackend(MailerTestCase):
 
         queued_messages = models.QueuedMessage.objects.all()
         self.assertEqual(queued_messages.count(), 0)
+
+    def testBulkEnqueue(self):
+        old_bulk_enqueue = settings.BULK_ENQUEUE
+        old_batch_size = settings.BULK_ENQUEUE_BATCH_SIZE
+        settings.BULK_ENQUEUE = True
+        settings.BULK_ENQUEUE_BATCH_SIZE = 2
+        try:
+            recipients = ['mail_to%s@abc.com' % i for i in range(5)]
+            msg = mail.EmailMessage(subject='subject', body='body',
+                        from_email='mail_from@abc.com', to=recipients,
+                        headers={'X-Mail-Queue-Priority': 'low'})
+            self.assertEqual(queue_email_message(msg), 5)
+
+            msg = mail.EmailMessage(subject='subject', body='body',
+                        from_email='mail_from@abc.com', to=['mail_to@abc.com'])
+            now_msg = mail.EmailMessage(subject='subject', body='body',
+                        from_email='mail_from@abc.com', to=['mail_to@abc.com'],
+                        headers={'X-Mail-Queue-Priority': 'now'})
+            self.assertEqual(queue_email_messages([msg, now_msg]), 1)
+        finally:
+            settings.BULK_ENQUEUE = old_bulk_enqueue
+            settings.BULK_ENQUEUE_BATCH_SIZE = old_batch_size
+
+        self.assertEqual(models.Message.objects.count(), 6)
+        self.assertEqual(models.QueuedMessage.objects.count(), 6)
+        self.assertEqual(
+            models.QueuedMessage.objects.low_priority().count(), 5)
+        queued_to = models.QueuedMessage.objects.low_priority()\
+                        .values_list('message__to_address', flat=True)
+        self.assertEqual(sorted(queued_to), recipients)
+        encoded = set(models.Message.objects.values_list('encoded_message',
+                                                         flat=True))
+        self.assertEqual(len(encoded), 2)
+
+    def testBulkEnqueueSameDate(self):
+        """
+        Rows which aren't queued (sent or sent immediately) aren't queued
+        again by a bulk insert created at the same time.
+
+        """
+        from django.utils import timezone
+        date_created = timezone.now()
+        models.Message.objects.create(
+            to_address='sent@abc.com', from_address='mail_from@abc.com',
+            subject='subject', date_created=date_created)
+        old_now = timezone.now
+        timezone.now = lambda: date_created
+        try:
+            msg = mail.EmailMessage(subject='subject', body='body',
+                        from_email='mail_from@abc.com',
+                        to=['one@abc.com', 'two@abc.com'])
+            self.assertEqual(queue_email_messages([msg]), 2)
+        finally:
+            timezone.now = old_now
+        queued_to = models.QueuedMessage.objects.values_list(
+            'message__to_address', flat=True)
+        self.assertEqual(sorted(queued_to), ['one@abc.com', 'two@abc.com'])
+
+    def testDeduplicatedBodies(self):
+        old_deduplicate = settings.DEDUPLICATE_BODIES
+        old_bulk_enqueue = settings.BULK_ENQUEUE
+        settings.DEDUPLICATE_BODIES = True
+        try:
+            msg = mail.EmailMessage(subject='subject', body='body',
+                        from_email='mail_from@abc.com',
+                        to=['one@abc.com', 'two@abc.com', 'three@abc.com'])
+            self.assertEqual(queue_email_message(msg), 3)
+            settings.BULK_ENQUEUE = True
+            self.assertEqual(queue_email_message(msg), 3)
+        finally:
+            settings.DEDUPLICATE_BODIES = old_deduplicate
+            settings.BULK_ENQUEUE = old_bulk_enqueue
+
+        self.assertEqual(models.Message.objects.count(), 6)
+        # Each queueing encodes the message (with a new Message-ID) once.
+        self.assertEqual(models.MessageBody.objects.count(), 2)
+        for body in models.MessageBody.objects.all():
+            self.assertEqual(body.message_set.count(), 3)
+        for message in models.Message.objects.all():
+            self.assertEqual(message.encoded_message, '')
+            self.assertEqual(message.get_encoded_message(),
+                             message.body.encoded_message)
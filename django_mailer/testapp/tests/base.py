@@ -3,6 +3,7 @@
 # ----------------------------------------------------------------------------
 
 import smtplib
+import socket
 from django.core import mail
 from django.test import TestCase
 from django_mailer import queue_email_message
@@ -16,21 +17,36 @@ class FakeConnection(object):
     sending.
 
     """
-    def __init__(self, error=False):
+    def __init__(self, error=False, crash_after=None, refuse_prefix=None):
         self._error = error
+        self._crash_after = crash_after
+        self._refuse_prefix = refuse_prefix
 
-    def sendmail(self, *args, **kwargs):
+    def sendmail(self, from_addr, to_addrs, msg, *args, **kwargs):
         """
         Divert an email to the test buffer.
 
+        Recipients starting with ``refuse_prefix`` are refused.
+
         """
+        if self._crash_after is not None and \
+                len(mail.outbox) >= self._crash_after:
+            raise RuntimeError("Unexpected failure")
         #FUTURE: the EmailMessage attributes could be found by introspecting
         # the encoded message.
-        message = mail.EmailMessage('SUBJECT', 'BODY', 'FROM', ['TO'])
+        message = mail.EmailMessage('SUBJECT', 'BODY', 'FROM', to_addrs)
         mail.outbox.append(message)
 
         if self._error:
             raise smtplib.SMTPSenderRefused(1, "BODY", "FROM")
+        refused = {}
+        if self._refuse_prefix:
+            for address in to_addrs:
+                if address.startswith(self._refuse_prefix):
+                    refused[address] = (550, "User unknown")
+        if refused and len(refused) == len(to_addrs):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
 
 
 class TestEmailBackend(BaseEmailBackend):
@@ -58,6 +74,63 @@ class FailEmailBackend(BaseEmailBackend):
         self.connection = FakeConnection(error=True)
 
 
+class CrashEmailBackend(BaseEmailBackend):
+    '''
+    An EmailBackend which raises an unexpected exception after two messages
+    have been sent.
+
+    '''
+    def __init__(self, fail_silently=False, **kwargs):
+        super(CrashEmailBackend, self).__init__(fail_silently=fail_silently)
+        self.connection = FakeConnection(crash_after=2)
+
+
+class RefuseEmailBackend(BaseEmailBackend):
+    '''
+    An EmailBackend which refuses the recipients starting with "refused".
+
+    '''
+    def __init__(self, fail_silently=False, **kwargs):
+        super(RefuseEmailBackend, self).__init__(fail_silently=fail_silently)
+        self.connection = FakeConnection(refuse_prefix='refused')
+
+
+class DisconnectEmailBackend(BaseEmailBackend):
+    '''
+    An EmailBackend whose connection is dropped by the server after two
+    messages have been sent (``drops`` times). It can only be reopened while
+    ``server_up`` is true.
+
+    '''
+    drops = 1
+    server_up = True
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super(DisconnectEmailBackend, self).__init__(
+            fail_silently=fail_silently)
+        self.connection = None
+
+    def open(self):
+        if self.connection:
+            return False
+        if not DisconnectEmailBackend.server_up:
+            raise socket.error("Connection refused")
+        self.connection = FakeConnection()
+        sendmail = self.connection.sendmail
+
+        def disconnecting_sendmail(*args, **kwargs):
+            if DisconnectEmailBackend.drops and len(mail.outbox) >= 2:
+                DisconnectEmailBackend.drops -= 1
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly "
+                                                     "closed")
+            return sendmail(*args, **kwargs)
+        self.connection.sendmail = disconnecting_sendmail
+        return True
+
+    def close(self):
+        self.connection = None
+
+
 class MailerTestCase(TestCase):
     """
     A base class for Django Mailer test cases which diverts emails to the test
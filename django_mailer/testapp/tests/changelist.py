@@ -0,0 +1,80 @@
+from django.contrib.admin import site
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.utils.unittest import skipUnless
+from django_mailer import admin, changelist, models, settings
+from .base import MailerTestCase
+
+
+class TestKeysetChangeList(MailerTestCase):
+
+    def setUp(self):
+        super(TestKeysetChangeList, self).setUp()
+        self._backup = settings.ADMIN_LARGE_TABLES
+        settings.ADMIN_LARGE_TABLES = True
+        for i in range(7):
+            self.queue_message(subject='message %s' % i)
+        self.pks = list(models.Message.objects.order_by('-pk')
+                        .values_list('pk', flat=True))
+
+    def tearDown(self):
+        super(TestKeysetChangeList, self).tearDown()
+        settings.ADMIN_LARGE_TABLES = self._backup
+
+    def changelist(self, **params):
+        request = RequestFactory().get('/', params)
+        model_admin = admin.Message(models.Message, site)
+        model_admin.list_per_page = 3
+        ChangeList = model_admin.get_changelist(request)
+        self.assertTrue(ChangeList is changelist.KeysetChangeList)
+        return ChangeList(
+            request, models.Message, model_admin.list_display,
+            model_admin.list_display_links, model_admin.list_filter,
+            model_admin.date_hierarchy, model_admin.search_fields,
+            model_admin.list_select_related, model_admin.list_per_page,
+            model_admin.list_max_show_all, model_admin.list_editable,
+            model_admin)
+
+    def test_pages(self):
+        cl = self.changelist()
+        self.assertEqual(cl.date_hierarchy, None)
+        self.assertEqual([message.pk for message in cl.result_list],
+                         self.pks[:3])
+        self.assertEqual(cl.previous_url, None)
+        self.assertEqual(cl.next_url, '?after=%s' % self.pks[2])
+        # The content of the messages isn't loaded.
+        self.assertTrue('encoded_message' not in cl.result_list[0].__dict__)
+
+        cl = self.changelist(after=self.pks[5])
+        self.assertEqual([message.pk for message in cl.result_list],
+                         self.pks[6:])
+        self.assertEqual(cl.next_url, None)
+        self.assertEqual(cl.previous_url, '?before=%s' % self.pks[6])
+
+        cl = self.changelist(before=self.pks[6])
+        self.assertEqual([message.pk for message in cl.result_list],
+                         self.pks[3:6])
+        self.assertEqual(cl.previous_url, '?before=%s' % self.pks[3])
+        self.assertEqual(cl.next_url, '?after=%s' % self.pks[5])
+        # Other links start from the first page again.
+        self.assertEqual(cl.get_query_string({'q': 'message'}),
+                         '?q=message')
+
+    def test_counts(self):
+        cl = self.changelist()
+        # Estimated from the highest primary key without statistics.
+        self.assertEqual(cl.full_result_count, self.pks[0])
+        self.assertEqual(cl.result_count_display, 'about %s' % self.pks[0])
+        cl = self.changelist(subject='message 1')
+        self.assertEqual(cl.result_count, 1)
+        self.assertEqual(cl.result_count_display, '1')
+        self.assertEqual(changelist.limited_count(
+            models.Message.objects.all(), limit=4), 5)
+
+    # Before Django 1.6, SQLite's ANALYZE commits the test's transaction.
+    @skipUnless(hasattr(transaction, 'atomic'),
+                "Requires Django 1.6 or later.")
+    def test_estimated_count(self):
+        connection.cursor().execute('ANALYZE')
+        self.assertEqual(changelist.estimated_count(
+            models.Message.objects.all()), 7)
@@ -1,6 +1,7 @@
 from django.core import mail
 from django.core.management import call_command
-from django_mailer import models
+from django_mailer import compression, models, settings
+from django.utils.unittest import skipUnless
 from .base import MailerTestCase
 import datetime
 try:
@@ -75,7 +76,7 @@ class TestCommands(MailerTestCase):
         """
         import re
         import sys
-        from cStringIO import StringIO
+        from django.utils.six import StringIO
         import time
 
         re_string  = r"(?P<queued>\d+)/(?P<deferred>\d+)/(?P<seconds>\d+)"
@@ -118,3 +119,61 @@ class TestCommands(MailerTestCase):
         models.Message.objects.create(date_created=prev)
         call_command('cleanup_mail', days=30)
         self.assertEqual(models.Message.objects.count(), 1)
+
+    def test_cleanup_mail_bodies(self):
+        """
+        The ``cleanup_mail`` command also deletes the shared message bodies
+        which are no longer used.
+
+        """
+        prev = now() - datetime.timedelta(31)
+        used = models.MessageBody.objects.create(content_hash='used',
+                                                 date_created=prev)
+        models.Message.objects.create(body=used)
+        old = models.MessageBody.objects.create(content_hash='old',
+                                                date_created=prev)
+        models.Message.objects.create(body=old, date_created=prev)
+        # Recent bodies are kept, they may be about to be used.
+        models.MessageBody.objects.create(content_hash='new')
+        call_command('cleanup_mail', days=30, verbosity='0')
+        self.assertEqual(
+            sorted(models.MessageBody.objects.values_list('content_hash',
+                                                          flat=True)),
+            ['new', 'used'])
+
+    def test_cleanup_mail_reused_bodies(self):
+        """
+        Shared message bodies are kept while they are being reused, before
+        the message referring to them is saved.
+
+        """
+        old = models.MessageBody.objects.get_for('reused body')
+        models.MessageBody.objects.filter(pk=old.pk).update(
+            date_created=now() - datetime.timedelta(31))
+        body = models.MessageBody.objects.get_for('reused body')
+        self.assertEqual(body.pk, old.pk)
+        call_command('cleanup_mail', days=30, verbosity='0')
+        self.assertTrue(models.MessageBody.objects.filter(pk=body.pk).exists())
+
+    @skipUnless(compression.AVAILABLE, "Requires Django 1.6 or later.")
+    def test_compress_mail(self):
+        """
+        The ``compress_mail`` command compresses the bodies of stored mails,
+        or decompresses them with ``--decompress``.
+
+        """
+        self.queue_message(subject='first')
+        self.queue_message(subject='second')
+        encoded = dict(models.Message.objects.values_list('subject',
+                                                          'encoded_message'))
+        call_command('compress_mail', verbosity='0', batch_size=1)
+        for message in models.Message.objects.all():
+            self.assertEqual(message.encoded_message, '')
+            self.assertTrue(message.compressed_message is not None)
+            self.assertEqual(message.get_encoded_message(),
+                             encoded[message.subject])
+        call_command('compress_mail', verbosity='0', decompress=True)
+        for message in models.Message.objects.all():
+            self.assertEqual(message.compressed_message, None)
+            self.assertEqual(message.encoded_message,
+                             encoded[message.subject])
@@ -1,15 +1,25 @@
+from django.core import mail
 from django.test import TestCase
-from django_mailer import engine, models, settings
+from django_mailer import (compression, constants, engine, mime_index,
+                           models, settings, wakeup)
+from django_mailer.blacklist import BlacklistCache
+from django_mailer.pool import pool
+from django_mailer.ratelimit import TokenBucket
+from django.utils.unittest import skipUnless
 from lockfile import FileLock
 from django.utils.six import StringIO
-from .base import MailerTestCase
+from .base import DisconnectEmailBackend, MailerTestCase
 import logging
+import os
+import signal
+import sys
+import threading
 import time
 
+import datetime
 try:
     from django.utils.timezone import now
 except ImportError:
-    import datetime
     now = datetime.datetime.now
 
 
@@ -100,6 +110,9 @@ class TestSendConfiguration(MailerTestCase):
             "EMAIL_MAX_SENT": settings.EMAIL_MAX_SENT,
             "EMAIL_MAX_DEFERRED": settings.EMAIL_MAX_DEFERRED,
             "EMAIL_THROTTLE": settings.EMAIL_THROTTLE,
+            "LEASE_QUEUE": settings.LEASE_QUEUE,
+            "MAX_RECIPIENTS_PER_TRANSACTION":
+                settings.MAX_RECIPIENTS_PER_TRANSACTION,
         }
         self.test_backend = "django_mailer.testapp.tests.base.TestEmailBackend"
         self.fail_backend = "django_mailer.testapp.tests.base.FailEmailBackend"
@@ -110,6 +123,9 @@ class TestSendConfiguration(MailerTestCase):
         settings.EMAIL_MAX_SENT = self._backup["EMAIL_MAX_SENT"]
         settings.EMAIL_MAX_DEFERRED = self._backup["EMAIL_MAX_DEFERRED"]
         settings.EMAIL_THROTTLE = self._backup["EMAIL_THROTTLE"]
+        settings.LEASE_QUEUE = self._backup["LEASE_QUEUE"]
+        settings.MAX_RECIPIENTS_PER_TRANSACTION = \
+            self._backup["MAX_RECIPIENTS_PER_TRANSACTION"]
 
     def test_control_max_sent_amount(self):
         settings.EMAIL_MAX_SENT = 2
@@ -160,6 +176,134 @@ class TestSendConfiguration(MailerTestCase):
         self.assertEqual(models.QueuedMessage.objects.deferred().count(), 0)
         self.assertEqual(models.Log.objects.count(), 5)
 
+    def test_parallel_delivery(self):
+        for i in range(7):
+            self.queue_message()
+
+        engine.send_all(backend=self.test_backend, workers=3)
+
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.count(), 7)
+
+    def test_parallel_control_max_sent_amount(self):
+        settings.EMAIL_MAX_SENT = 2
+
+        for i in range(5):
+            self.queue_message()
+
+        engine.send_all(backend=self.test_backend, workers=3)
+
+        self.assertEqual(models.QueuedMessage.objects.count(), 3)
+        self.assertEqual(models.Log.objects.count(), 2)
+
+    def test_parallel_control_max_deferred_amount(self):
+        settings.EMAIL_MAX_DEFERRED = 2
+
+        for i in range(8):
+            self.queue_message()
+
+        engine.send_all(backend=self.fail_backend, workers=2, block_size=4)
+
+        # Messages already in flight when the limit is reached are still
+        # recorded, but no further block is fetched.
+        deferred = models.QueuedMessage.objects.deferred().count()
+        self.assertTrue(2 <= deferred <= 4)
+        self.assertEqual(models.Log.objects.count(), deferred)
+        self.assertEqual(models.QueuedMessage.objects.count(), 8)
+
+    def test_recipients_per_transaction(self):
+        settings.MAX_RECIPIENTS_PER_TRANSACTION = 2
+        settings.EMAIL_MAX_SENT = 4
+        self.queue_message(recipient_list=[
+            'one@djangomailer', 'two@djangomailer', 'refused@djangomailer',
+            'three@djangomailer', 'four@djangomailer'])
+        self.queue_message(subject='other')
+
+        engine.send_all(
+            backend="django_mailer.testapp.tests.base.RefuseEmailBackend")
+
+        self.assertEqual([message.to for message in mail.outbox], [
+            ['one@djangomailer', 'two@djangomailer'],
+            ['refused@djangomailer', 'three@djangomailer'],
+            ['four@djangomailer']])
+        # The refused recipient is deferred on its own.
+        refused = models.QueuedMessage.objects.deferred().get()
+        self.assertEqual(refused.message.to_address, 'refused@djangomailer')
+        log = models.Log.objects.get(result=constants.RESULT_FAILED)
+        self.assertTrue('User unknown' in log.log_message)
+        self.assertEqual(models.Log.objects.filter(
+            result=constants.RESULT_SENT).count(), 4)
+        # The message with a different body is left for the next run.
+        self.assertEqual(models.QueuedMessage.objects.non_deferred().get()
+                         .message.subject, 'other')
+
+    def test_transactions_by_content_hash(self):
+        settings.MAX_RECIPIENTS_PER_TRANSACTION = 3
+        self.queue_message(recipient_list=['one@djangomailer',
+                                           'two@djangomailer'])
+        self.queue_message(subject='other')
+        block = next(engine._message_blocks(10))
+        # Messages are grouped without loading their content.
+        with self.assertNumQueries(0):
+            transactions = list(engine._transactions(block))
+        self.assertEqual([[m.message.to_address for m in transaction]
+                          for transaction in transactions],
+                         [['one@djangomailer', 'two@djangomailer'],
+                          ['recipient@djangomailer']])
+        # Messages queued before the hash was recorded are sent on their own.
+        models.Message.objects.update(content_hash='')
+        block = next(engine._message_blocks(10))
+        self.assertEqual(len(list(engine._transactions(block))), 3)
+
+    def test_max_deferred_per_transaction(self):
+        settings.MAX_RECIPIENTS_PER_TRANSACTION = 3
+        settings.EMAIL_MAX_DEFERRED = 2
+        recipients = ['one@djangomailer', 'two@djangomailer',
+                      'three@djangomailer']
+        self.queue_message(recipient_list=recipients)
+        self.queue_message(subject='other', recipient_list=recipients)
+
+        engine.send_all(backend=self.fail_backend)
+
+        # The first transaction takes the count past the limit, so the
+        # second one isn't attempted.
+        self.assertEqual(models.QueuedMessage.objects.deferred().count(), 3)
+        self.assertEqual(models.Log.objects.count(), 3)
+        self.assertEqual(models.QueuedMessage.objects.non_deferred().filter(
+            message__subject='other').count(), 3)
+
+    @skipUnless(compression.AVAILABLE, "Requires Django 1.6 or later.")
+    def test_compressed_messages(self):
+        settings.COMPRESS_MESSAGES = 'zlib'
+        try:
+            self.queue_message(message=u'compressed body \xe1')
+        finally:
+            settings.COMPRESS_MESSAGES = False
+        message = models.Message.objects.get()
+        self.assertEqual(message.encoded_message, '')
+        index = mime_index.build_index(message.get_encoded_message())
+        self.assertEqual(index.text, u'compressed body \xe1'.encode('utf-8'))
+
+        engine.send_all(backend=self.test_backend)
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.get().result,
+                         constants.RESULT_SENT)
+
+    def test_lease_queue(self):
+        settings.LEASE_QUEUE = True
+        # The lock file isn't used when leasing.
+        lock = FileLock(engine.LOCK_PATH)
+        lock.acquire(0)
+        try:
+            for i in range(3):
+                self.queue_message()
+            engine.send_all(backend=self.test_backend, block_size=2)
+        finally:
+            lock.release()
+
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.count(), 3)
+
     def test_throttling_delivery(self):
         TIME = 1  # throttle time = 1 second
 
@@ -193,3 +337,457 @@ class TestSendConfiguration(MailerTestCase):
         # NOTE This is a bit tricky to test due to possible fluctuations on
         # execution time. This test may sometimes fail
         self.assertAlmostEqual(unthrottled_time, throttled_time, places=1)
+
+
+class TestResultBuffer(MailerTestCase):
+    def test_flush(self):
+        for i in range(3):
+            self.queue_message()
+        queued = list(models.QueuedMessage.objects.all())
+        result_buffer = engine.ResultBuffer(size=2, interval=None)
+
+        result_buffer.add(queued[0], constants.RESULT_SENT, '')
+        self.assertEqual(models.QueuedMessage.objects.count(), 3)
+        self.assertEqual(models.Log.objects.count(), 0)
+        # Deferrals are written straight away, the buffer is flushed once it
+        # holds two logs.
+        result_buffer.add(queued[1], constants.RESULT_FAILED, 'failure')
+        self.assertEqual(models.QueuedMessage.objects.deferred().count(), 1)
+        self.assertEqual(models.QueuedMessage.objects.count(), 2)
+        self.assertEqual(models.Log.objects.count(), 2)
+        result_buffer.add(queued[2], constants.RESULT_SKIPPED, '')
+        self.assertEqual(models.Log.objects.count(), 2)
+        result_buffer.flush()
+        self.assertEqual(models.QueuedMessage.objects.count(), 1)
+        self.assertEqual(models.Log.objects.count(), 3)
+
+    def test_flushed_on_exception(self):
+        for i in range(4):
+            self.queue_message()
+        backend = "django_mailer.testapp.tests.base.CrashEmailBackend"
+        self.assertRaises(RuntimeError, engine.send_all, backend=backend)
+        self.assertEqual(models.QueuedMessage.objects.count(), 2)
+        self.assertEqual(models.Log.objects.count(), 2)
+
+
+class TestBlacklist(MailerTestCase):
+    def setUp(self):
+        super(TestBlacklist, self).setUp()
+        self.test_backend = "django_mailer.testapp.tests.base.TestEmailBackend"
+
+    def test_blacklist_cache(self):
+        cache = BlacklistCache()
+        models.Blacklist.objects.create(email='Someone@Example.com')
+        models.Blacklist.objects.create(email='@spam.example.com')
+        cache.refresh()
+        self.assertTrue('someone@example.COM' in cache)
+        self.assertTrue('anyone@SPAM.example.com' in cache)
+        self.assertFalse('someone.else@example.com' in cache)
+
+        # Only new entries are loaded, removed ones cause a full reload.
+        models.Blacklist.objects.create(email='new@example.com',
+            date_added=now() + datetime.timedelta(seconds=1))
+        cache.refresh()
+        self.assertTrue('new@example.com' in cache)
+        self.assertEqual(len(cache), 3)
+        models.Blacklist.objects.filter(email='Someone@Example.com').delete()
+        cache.refresh()
+        self.assertFalse('someone@example.com' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_blacklisted_messages_skipped(self):
+        models.Blacklist.objects.create(email='Blocked@djangomailer')
+        models.Blacklist.objects.create(email='@spam.djangomailer')
+        self.queue_message(recipient_list=['blocked@DjangoMailer'])
+        self.queue_message(recipient_list=['someone@spam.djangomailer'])
+        self.queue_message()
+
+        engine.send_all(backend=self.test_backend)
+
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.filter(
+            result=constants.RESULT_SKIPPED).count(), 2)
+        self.assertEqual(models.Log.objects.filter(
+            result=constants.RESULT_SENT).count(), 1)
+
+        self.queue_message(recipient_list=['someone@spam.djangomailer'])
+        result = engine.send_queued_message(
+            models.QueuedMessage.objects.get())
+        self.assertEqual(result, constants.RESULT_SKIPPED)
+
+
+class TestMessageBlocks(MailerTestCase):
+    def test_keyset_pagination(self):
+        for i in range(5):
+            self.queue_message(subject='normal %s' % i)
+        blocks = engine._message_blocks(2)
+
+        block = next(blocks)
+        self.assertEqual([m.message.subject for m in block],
+                         ['normal 0', 'normal 1'])
+        # Deferred messages are no longer in the queue, but the next block
+        # starts after them regardless.
+        for queued_message in block:
+            queued_message.defer()
+        block = next(blocks)
+        self.assertEqual([m.message.subject for m in block],
+                         ['normal 2', 'normal 3'])
+
+        # Messages with a higher priority than the current position are
+        # picked up before the rest of the queue.
+        for queued_message in block:
+            queued_message.delete()
+        self.queue_message(subject='high', priority=constants.PRIORITY_HIGH)
+        block = next(blocks)
+        self.assertEqual([m.message.subject for m in block], ['high'])
+        block[0].delete()
+
+        block = next(blocks)
+        self.assertEqual([m.message.subject for m in block], ['normal 4'])
+        block[0].delete()
+        self.assertRaises(StopIteration, next, blocks)
+
+    def test_content_deferred(self):
+        self.queue_message(message='the content')
+        message = next(engine._message_blocks(2))[0].message
+        # Only the metadata of the messages is loaded with the blocks.
+        for name in models.BODY_FIELDS:
+            self.assertTrue(name not in message.__dict__)
+        self.assertEqual(message.to_address, 'recipient@djangomailer')
+        with self.assertNumQueries(1):
+            message.fetch_body()
+            self.assertTrue('the content' in message.get_encoded_message())
+        message.release_body()
+        self.assertTrue('encoded_message' not in message.__dict__)
+        self.assertTrue('the content' in message.get_encoded_message())
+
+
+class TestQueueLeases(MailerTestCase):
+    def test_claim(self):
+        for i in range(3):
+            self.queue_message()
+        queue = models.QueuedMessage.objects
+
+        claimed = queue.claim('worker-a', 2)
+        self.assertEqual(claimed.count(), 2)
+        self.assertEqual(queue.claimable().count(), 1)
+
+        # Another worker only gets what is left.
+        self.assertEqual(queue.claim('worker-b', 2).count(), 1)
+        self.assertEqual(queue.claim('worker-b', 2).count(), 0)
+
+        # Expired leases can be claimed again.
+        queue.filter(owner='worker-a').update(
+            lease_expires=now() - datetime.timedelta(seconds=1))
+        self.assertEqual(queue.claim('worker-b', 5).count(), 2)
+        self.assertEqual(queue.filter(owner='worker-b').count(), 3)
+
+        self.assertEqual(queue.release('worker-b'), 3)
+        self.assertEqual(queue.claimable().count(), 3)
+
+    def test_claim_race(self):
+        for i in range(3):
+            self.queue_message()
+        queue = models.QueuedMessage.objects
+        pks = list(queue.order_by('pk').values_list('pk', flat=True))
+        claimable = queue.claimable
+        calls = [0]
+
+        def racing_claimable():
+            # Another worker claims the first selected rows just before the
+            # conditional update.
+            calls[0] += 1
+            if calls[0] == 2:
+                queue.filter(pk__in=pks[:2]).update(
+                    owner='worker-b',
+                    lease_expires=now() + datetime.timedelta(seconds=60))
+            return claimable()
+        queue.claimable = racing_claimable
+        try:
+            claimed = queue.claim('worker-a', 2)
+            self.assertEqual([m.pk for m in claimed], pks[2:])
+        finally:
+            del queue.claimable
+
+    def test_defer_releases_lease(self):
+        self.queue_message()
+        queued_message = models.QueuedMessage.objects.claim('worker-a', 1)[0]
+        queued_message.defer()
+        queued_message = models.QueuedMessage.objects.get()
+        self.assertEqual(queued_message.owner, '')
+        self.assertEqual(queued_message.lease_expires, None)
+
+
+class TestTokenBucket(TestCase):
+    def test_take(self):
+        clock = [0]
+        bucket = TokenBucket(2, capacity=2, clock=lambda: clock[0])
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        clock[0] = 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+    def test_reserve(self):
+        clock = [0]
+        bucket = TokenBucket.for_throttle(2)
+        bucket.clock = lambda: clock[0]
+        bucket.updated = 0
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 2)
+        self.assertEqual(bucket.reserve(), 4)
+        self.assertEqual(TokenBucket.for_throttle(0), None)
+
+
+
+class TestReconnect(MailerTestCase):
+    backend = "django_mailer.testapp.tests.base.DisconnectEmailBackend"
+
+    def setUp(self):
+        super(TestReconnect, self).setUp()
+        self.original_backoff = settings.RECONNECT_BACKOFF
+        self.original_pool = settings.CONNECTION_POOL
+        settings.RECONNECT_BACKOFF = 0
+        settings.CONNECTION_POOL = True
+        DisconnectEmailBackend.drops = 1
+        DisconnectEmailBackend.server_up = True
+
+    def tearDown(self):
+        super(TestReconnect, self).tearDown()
+        settings.RECONNECT_BACKOFF = self.original_backoff
+        settings.CONNECTION_POOL = self.original_pool
+        pool.close_all()
+
+    def test_reconnect(self):
+        for i in range(4):
+            self.queue_message()
+
+        engine.send_all(backend=self.backend)
+
+        # The message being sent when the connection dropped is retried.
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.filter(
+            result=constants.RESULT_SENT).count(), 4)
+
+    def test_connection_lost(self):
+        DisconnectEmailBackend.server_up = False
+        for i in range(4):
+            self.queue_message()
+        # The first two messages use a connection which is already open.
+        connection = pool.acquire(self.backend)
+        DisconnectEmailBackend.server_up = True
+        connection.open()
+        DisconnectEmailBackend.server_up = False
+        pool.release(connection)
+
+        engine.send_all(backend=self.backend)
+
+        # Nothing is deferred, the remaining messages wait for the next run.
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(models.QueuedMessage.objects.deferred().count(), 0)
+        self.assertEqual(models.QueuedMessage.objects.count(), 2)
+        self.assertEqual(models.Log.objects.count(), 2)
+
+
+class TestRetryBackoff(MailerTestCase):
+    backend = "django_mailer.testapp.tests.base.FailEmailBackend"
+
+    def setUp(self):
+        super(TestRetryBackoff, self).setUp()
+        self._backup = (settings.RETRY_BACKOFF, settings.RETRY_MAX_DELAY,
+                        settings.MAX_ATTEMPTS)
+        settings.RETRY_BACKOFF = 60
+        settings.RETRY_MAX_DELAY = 200
+        settings.MAX_ATTEMPTS = 3
+
+    def tearDown(self):
+        super(TestRetryBackoff, self).tearDown()
+        (settings.RETRY_BACKOFF, settings.RETRY_MAX_DELAY,
+         settings.MAX_ATTEMPTS) = self._backup
+
+    def test_retry_delay(self):
+        for i in range(20):
+            self.assertTrue(30 <= models.retry_delay(1) <= 60)
+            self.assertTrue(60 <= models.retry_delay(2) <= 120)
+            # Limited by MAILER_RETRY_MAX_DELAY.
+            self.assertTrue(100 <= models.retry_delay(3) <= 200)
+
+    def test_backoff(self):
+        self.queue_message()
+        queue = models.QueuedMessage.objects
+
+        engine.send_all(backend=self.backend)
+        queued_message = queue.get()
+        self.assertEqual(queued_message.deferred, None)
+        self.assertEqual(queued_message.retries, 1)
+        delay = queued_message.next_attempt - now()
+        self.assertTrue(datetime.timedelta(seconds=25) < delay <=
+                        datetime.timedelta(seconds=60))
+        self.assertEqual(queue.non_deferred().count(), 0)
+        self.assertEqual(queue.scheduled().count(), 1)
+
+        # Not retried before the next attempt is due.
+        engine.send_all(backend=self.backend)
+        self.assertEqual(models.Log.objects.count(), 1)
+
+        queue.update(next_attempt=now())
+        engine.send_all(backend=self.backend)
+        self.assertEqual(queue.get().retries, 2)
+        self.assertEqual(queue.deferred().count(), 0)
+
+        # The last attempt moves the message to the deferred (dead letter)
+        # state.
+        queue.update(next_attempt=now())
+        engine.send_all(backend=self.backend)
+        queued_message = queue.get()
+        self.assertEqual(queued_message.retries, 3)
+        self.assertNotEqual(queued_message.deferred, None)
+        self.assertEqual(queued_message.next_attempt, None)
+        self.assertEqual(queue.scheduled().count(), 0)
+        self.assertEqual(models.Log.objects.count(), 3)
+
+
+class TestSendLoop(MailerTestCase):
+    backend = "django_mailer.testapp.tests.base.TestEmailBackend"
+
+    def setUp(self):
+        super(TestSendLoop, self).setUp()
+        self._notify_queue = settings.NOTIFY_QUEUE
+        settings.NOTIFY_QUEUE = True
+
+    def tearDown(self):
+        super(TestSendLoop, self).tearDown()
+        settings.NOTIFY_QUEUE = self._notify_queue
+
+    def test_wakeup(self):
+        listener = wakeup.QueueListener()
+        try:
+            self.assertFalse(listener.wait(0))
+            self.queue_message()
+            self.assertTrue(listener.wait(1))
+            # Notifications are drained by a wait.
+            self.assertFalse(listener.wait(0))
+            listener.interrupt()
+            self.assertTrue(listener.wait(1))
+        finally:
+            listener.close()
+
+    def test_interrupt_without_fcntl(self):
+        fcntl = wakeup.fcntl
+        wakeup.fcntl = None
+        try:
+            listener = wakeup.QueueListener()
+        finally:
+            wakeup.fcntl = fcntl
+        try:
+            self.assertFalse(listener.wait(0))
+            listener.interrupt()
+            self.assertTrue(listener.wait(1))
+            self.assertFalse(listener.wait(0))
+        finally:
+            listener.close()
+
+    def test_stops_on_sigterm(self):
+        self.queue_message()
+        self.queue_message()
+        timer = threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        try:
+            engine.send_loop(backend=self.backend)
+        finally:
+            timer.cancel()
+
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.count(), 2)
+        # The lock file is released.
+        self.assertFalse(engine.FileLock(engine.LOCK_PATH).is_locked())
+
+    def test_stops_between_transactions(self):
+        backup = settings.LEASE_QUEUE
+        settings.LEASE_QUEUE = True
+        try:
+            for i in range(3):
+                self.queue_message()
+            blocks, release = engine._open_queue(500)
+            try:
+                totals = engine._send_queue(
+                    blocks, backend=self.backend,
+                    stopped=lambda: len(mail.outbox) >= 1)
+            finally:
+                release()
+        finally:
+            settings.LEASE_QUEUE = backup
+
+        self.assertEqual(totals, (1, 0, 0))
+        self.assertEqual(models.Log.objects.count(), 1)
+        # The messages which weren't sent are left in the queue, unleased.
+        self.assertEqual(models.QueuedMessage.objects.count(), 2)
+        self.assertEqual(
+            models.QueuedMessage.objects.filter(owner='').count(), 2)
+
+
+@skipUnless(sys.version_info >= (3, 5), 'asyncio requires Python 3.5')
+class TestAsyncEngine(MailerTestCase):
+    def setUp(self):
+        super(TestAsyncEngine, self).setUp()
+        import asyncio
+        from concurrent.futures import Executor, Future
+        from django_mailer.async_engine import send_all_async
+
+        class InlineExecutor(Executor):
+            # The test database is only usable from this thread.
+            def submit(self, func, *args, **kwargs):
+                future = Future()
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except Exception as err:
+                    future.set_exception(err)
+                return future
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = InlineExecutor()
+        self.send_all_async = send_all_async
+        self.original_max_sent = settings.EMAIL_MAX_SENT
+
+    def tearDown(self):
+        super(TestAsyncEngine, self).tearDown()
+        settings.EMAIL_MAX_SENT = self.original_max_sent
+        self.loop.close()
+
+    def send(self, backend, **kwargs):
+        return self.loop.run_until_complete(self.send_all_async(
+            backend=backend, db_executor=self.executor, **kwargs))
+
+    def test_send_all_async(self):
+        for i in range(7):
+            self.queue_message()
+
+        totals = self.send("django_mailer.testapp.tests.base.TestEmailBackend",
+                           concurrency=3, block_size=3)
+
+        self.assertEqual(totals, (7, 0, 0))
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(models.QueuedMessage.objects.count(), 0)
+        self.assertEqual(models.Log.objects.count(), 7)
+
+    def test_control_max_sent_amount(self):
+        settings.EMAIL_MAX_SENT = 2
+        for i in range(5):
+            self.queue_message()
+
+        self.send("django_mailer.testapp.tests.base.TestEmailBackend",
+                  concurrency=3)
+
+        self.assertEqual(models.QueuedMessage.objects.count(), 3)
+        self.assertEqual(models.Log.objects.count(), 2)
+
+    def test_deferred(self):
+        self.queue_message()
+
+        totals = self.send("django_mailer.testapp.tests.base.FailEmailBackend")
+
+        self.assertEqual(totals, (0, 1, 0))
+        self.assertEqual(models.QueuedMessage.objects.deferred().count(), 1)
@@ -0,0 +1,140 @@
+import shutil
+import tempfile
+from django.core import mail
+from django_mailer import mime_index, models, queue_email_message, settings
+from django_mailer.mail_utils import get_attachments
+from .base import MailerTestCase
+
+ATTACHMENT = b'\x00\x01\x02' * 20000
+TEXT_ATTACHMENT = 'Line with an =equals sign\n' * 500
+
+
+class TestMimeIndex(MailerTestCase):
+
+    def setUp(self):
+        super(TestMimeIndex, self).setUp()
+        self._backup = (settings.STORED_PART_MIN_SIZE,
+                        settings.STORAGE_LOCATION, mime_index.DECODE_SIZE)
+        settings.STORAGE_LOCATION = tempfile.mkdtemp()
+        # Decode attachments a few lines at a time.
+        mime_index.DECODE_SIZE = 200
+        mime_index.get_cache().clear()
+
+    def tearDown(self):
+        super(TestMimeIndex, self).tearDown()
+        shutil.rmtree(settings.STORAGE_LOCATION)
+        (settings.STORED_PART_MIN_SIZE, settings.STORAGE_LOCATION,
+         mime_index.DECODE_SIZE) = self._backup
+
+    def queue_attachment_message(self):
+        email_message = mail.EmailMultiAlternatives(
+            'Attached', 'Text body', 'sender@djangomailer',
+            ['recipient@djangomailer'], cc=['copy@djangomailer'])
+        email_message.attach_alternative('<p>HTML body</p>', 'text/html')
+        email_message.attach('data.bin', ATTACHMENT,
+                             'application/octet-stream')
+        email_message.attach('notes.txt', TEXT_ATTACHMENT, 'text/plain')
+        queue_email_message(email_message)
+        return models.Message.objects.defer(
+            *models.CONTENT_FIELDS).get(
+            to_address='recipient@djangomailer')
+
+    def check_index(self, message):
+        index = mime_index.get_index(message)
+        self.assertEqual(index.subject, 'Attached')
+        self.assertEqual(index.from_address[1], 'sender@djangomailer')
+        self.assertEqual(index.cc[0][1], 'copy@djangomailer')
+        self.assertEqual(index.text, b'Text body')
+        self.assertEqual(index.html, b'<p>HTML body</p>')
+        # The same attachments as found by parsing the whole message.
+        expected = get_attachments(mime_index.parse(
+            message.get_encoded_message().encode('utf-8')))
+        self.assertEqual([(a.filename, a.content_type, a.size, a.firma)
+                          for a in index.attachments],
+                         [(a.filename, a.tipus, a.length, a.firma)
+                          for a in expected])
+        for attachment, payload in zip(index.attachments,
+                                       [ATTACHMENT, TEXT_ATTACHMENT]):
+            content = list(mime_index.iter_attachment(message, attachment))
+            self.assertEqual(b''.join(content), payload.encode('utf-8')
+                             if not isinstance(payload, bytes) else payload)
+        return index
+
+    def test_index(self):
+        index = self.check_index(self.queue_attachment_message())
+        self.assertTrue(all(attachment.offset is not None
+                            for attachment in index.attachments))
+
+    def test_stored_parts(self):
+        settings.STORED_PART_MIN_SIZE = 1024
+        message = self.queue_attachment_message()
+        index = self.check_index(message)
+        self.assertEqual(index.attachments[0].stored_part,
+                         message.get_stored_parts()[0])
+
+    def test_cache(self):
+        message = self.queue_attachment_message()
+        index = mime_index.get_index(message)
+        message = models.Message.objects.defer(
+            *models.CONTENT_FIELDS).get(pk=message.pk)
+        # The encoded message isn't loaded again.
+        with self.assertNumQueries(0):
+            self.assertTrue(mime_index.get_index(message) is index)
+
+    def test_eviction(self):
+        cache = mime_index.IndexCache(1000)
+        indexes = [mime_index.MessageIndex('', '', [], [], b'x' * 50, None,
+                                           []) for i in range(4)]
+        for key, index in enumerate(indexes[:3]):
+            cache.set(key, index)
+        # The least recently used index is evicted first.
+        cache.get(0)
+        cache.set(3, indexes[3])
+        self.assertTrue(cache.get(0) is indexes[0])
+        self.assertEqual(cache.get(1), None)
+        self.assertTrue(cache.get(3) is indexes[3])
+        self.assertTrue(cache.size <= 1000)
+        # Indexes larger than the cache aren't kept.
+        cache.set(4, mime_index.MessageIndex('', '', [], [], b'x' * 2000,
+                                             None, []))
+        self.assertEqual(cache.get(4), None)
+
+    def test_manifest(self):
+        message = self.queue_attachment_message()
+        manifest = message.get_attachment_manifest()
+        self.assertEqual([(attachment.position, attachment.filename)
+                          for attachment in manifest],
+                         [(0, 'data.bin'), (1, 'notes.txt')])
+        # The manifest is used by the index rather than the attachments being
+        # looked for again.
+        index = self.check_index(message)
+        self.assertEqual([attachment.to_dict()
+                          for attachment in index.attachments],
+                         [attachment.to_dict() for attachment in manifest])
+        mime_index.get_cache().clear()
+        models.Message.objects.filter(pk=message.pk).update(
+            attachment_manifest='')
+        message = models.Message.objects.get(pk=message.pk)
+        self.assertEqual(message.get_attachment_manifest(), None)
+        index = self.check_index(message)
+        self.assertEqual([attachment.to_dict()
+                          for attachment in index.attachments],
+                         [attachment.to_dict() for attachment in manifest])
+
+    def test_manifest_stream_messages(self):
+        backup = settings.STREAM_MESSAGES
+        settings.STREAM_MESSAGES = True
+        try:
+            message = self.queue_attachment_message()
+        finally:
+            settings.STREAM_MESSAGES = backup
+        # The payloads aren't located, attachments are still served.
+        manifest = message.get_attachment_manifest()
+        self.assertEqual(len(manifest), 2)
+        self.assertEqual(manifest[0].offset, None)
+        self.check_index(message)
+
+    def test_no_attachments(self):
+        self.queue_message()
+        message = models.Message.objects.get()
+        self.assertEqual(message.get_attachment_manifest(), [])
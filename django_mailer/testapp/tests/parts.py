@@ -0,0 +1,174 @@
+import base64
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+from django.core import mail
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.encoding import force_bytes
+from django.utils.six import BytesIO
+from django.utils.unittest import skipUnless
+from django_mailer import (engine, models, parts, queue_email_message,
+                           settings)
+from django_mailer.mail_utils import get_attachments
+from django_mailer.pool import pool
+from django_mailer.storage import get_storage
+from pyzmail.parse import message_from_string
+from .base import MailerTestCase
+from . import streaming as streaming_tests
+
+ATTACHMENT = b'\x00\x01\x02' * 20000
+
+
+class TestStoredParts(MailerTestCase):
+    backend = 'django_mailer.testapp.tests.base.TestEmailBackend'
+
+    def setUp(self):
+        super(TestStoredParts, self).setUp()
+        self._backup = (settings.STORED_PART_MIN_SIZE,
+                        settings.STORAGE_LOCATION, settings.STREAM_MESSAGES)
+        settings.STORED_PART_MIN_SIZE = 1024
+        settings.STORAGE_LOCATION = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestStoredParts, self).tearDown()
+        shutil.rmtree(settings.STORAGE_LOCATION)
+        (settings.STORED_PART_MIN_SIZE, settings.STORAGE_LOCATION,
+         settings.STREAM_MESSAGES) = self._backup
+
+    def queue_attachment_message(self, to=('recipient@djangomailer',),
+                                 content=ATTACHMENT):
+        email_message = mail.EmailMessage(
+            'Attached', 'Short body', 'sender@djangomailer', list(to))
+        email_message.attach('data.bin', content, 'application/octet-stream')
+        queue_email_message(email_message)
+        return email_message
+
+    def stored_files(self):
+        storage = get_storage()
+        names = []
+        for directory in storage.listdir('django_mailer/parts')[0]:
+            path = 'django_mailer/parts/%s' % directory
+            names.extend('%s/%s' % (path, name)
+                         for name in storage.listdir(path)[1])
+        return names
+
+    def test_queue(self):
+        self.queue_attachment_message(
+            to=['recipient@djangomailer', 'other@djangomailer'])
+        encoded = base64.b64encode(ATTACHMENT).decode('ascii')
+        messages = list(models.Message.objects.all())
+        self.assertEqual(len(messages), 2)
+        # The attachment is stored once, and only referred to by the rows.
+        self.assertEqual(len(self.stored_files()), 1)
+        for message in messages:
+            self.assertEqual(message.get_stored_parts(), self.stored_files())
+            self.assertFalse(encoded[:76] in message.encoded_message)
+            self.assertTrue(len(message.encoded_message) < 1024)
+        # It is spliced back in when the message is read.
+        encoded_message = messages[0].get_encoded_message()
+        attachments = get_attachments(message_from_string(encoded_message))
+        self.assertEqual(len(attachments), 1)
+        self.assertEqual(attachments[0].payload, ATTACHMENT)
+        self.assertEqual(self.stored_files()[0].split('/')[-1],
+                         attachments[0].firma)
+
+    def test_deduplicate(self):
+        self.queue_attachment_message()
+        self.queue_attachment_message()
+        self.queue_attachment_message(content=ATTACHMENT[::-1])
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_small_parts(self):
+        self.queue_attachment_message(content=b'small')
+        message = models.Message.objects.get()
+        self.assertEqual(message.stored_parts, '')
+        self.assertFalse(get_storage().exists('django_mailer/parts'))
+
+    def test_stream_messages(self):
+        settings.STREAM_MESSAGES = True
+        self.queue_attachment_message()
+        message = models.Message.objects.get()
+        self.assertTrue(message.stored_message)
+        self.assertEqual(len(message.get_stored_parts()), 1)
+        self.assertTrue(get_storage().size(message.stored_message) < 1024)
+        self.assertTrue(base64.b64encode(ATTACHMENT[:57]).decode('ascii')
+                        in message.get_encoded_message())
+
+    def test_spliced_file(self):
+        self.queue_attachment_message()
+        message = models.Message.objects.get()
+        raw = message.get_encoded_message(splice_parts=False)
+        spliced = parts.SplicedFile(BytesIO(raw.encode('ascii')),
+                                    message.get_stored_parts(), line_size=8)
+        data = b''
+        while True:
+            block = spliced.read(1000)
+            if not block:
+                break
+            self.assertTrue(len(block) <= 1000)
+            data += block
+        self.assertEqual(data.decode('ascii'), message.get_encoded_message())
+
+    def test_send(self):
+        self.queue_attachment_message()
+        engine.send_all(backend=self.backend)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(models.QueuedMessage.objects.exists())
+
+    def age_stored_files(self):
+        storage = get_storage()
+        for name in self.stored_files():
+            os.utime(storage.path(name), (946684800, 946684800))
+
+    def test_cleanup(self):
+        self.queue_attachment_message()
+        self.queue_attachment_message(content=ATTACHMENT[::-1])
+        kept, old = list(models.Message.objects.order_by('pk'))
+        old.date_created = datetime.datetime(2000, 1, 1)
+        old.save()
+        self.age_stored_files()
+        # A recent mail with the same attachment keeps it in the storage.
+        self.queue_attachment_message(content=ATTACHMENT[::-1])
+        call_command('cleanup_mail', verbosity='0')
+        self.assertEqual(len(self.stored_files()), 2)
+        models.Message.objects.filter(pk=kept.pk).update(
+            date_created=datetime.datetime(2000, 1, 1))
+        call_command('cleanup_mail', verbosity='0')
+        self.assertEqual(self.stored_files(), old.get_stored_parts())
+
+    def test_cleanup_reused_parts(self):
+        self.queue_attachment_message()
+        models.Message.objects.update(
+            date_created=datetime.datetime(2000, 1, 1))
+        self.age_stored_files()
+        # Reusing the part (for a mail which isn't saved yet) keeps it.
+        parts._save(ATTACHMENT)
+        call_command('cleanup_mail', verbosity='0')
+        self.assertEqual(models.Message.objects.count(), 0)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    @skipUnless(streaming_tests.smtpd, 'smtpd is not available')
+    def test_smtp_data(self):
+        server = streaming_tests._RecordingServer(('localhost', 0), None)
+        port = server.socket.getsockname()[1]
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        try:
+            self.queue_attachment_message()
+            encoded_message = models.Message.objects.get()\
+                .get_encoded_message()
+            pool.close_all()
+            with override_settings(EMAIL_HOST='localhost', EMAIL_PORT=port):
+                engine.send_all(
+                    backend='django.core.mail.backends.smtp.EmailBackend')
+                pool.close_all()
+        finally:
+            server.shutdown()
+            thread.join()
+        self.assertEqual(len(server.messages), 1)
+        mailfrom, rcpttos, data = server.messages[0]
+        self.assertEqual(force_bytes(data).rstrip(b'\n'),
+                         force_bytes(encoded_message).rstrip(b'\n'))
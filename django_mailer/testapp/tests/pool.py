@@ -0,0 +1,112 @@
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django_mailer import constants, settings
+from django_mailer.pool import pool
+from .base import FakeConnection, MailerTestCase
+
+
+class CountingEmailBackend(BaseEmailBackend):
+    """
+    An EmailBackend which counts how many times it is opened and closed and
+    answers NOOP commands with ``noop_code``.
+
+    """
+    opened = 0
+    closed = 0
+    noop_code = 250
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super(CountingEmailBackend, self).__init__(
+            fail_silently=fail_silently)
+        self.connection = None
+
+    def open(self):
+        if self.connection:
+            return False
+        CountingEmailBackend.opened += 1
+        self.connection = FakeConnection()
+        self.connection.noop = lambda: (CountingEmailBackend.noop_code, '')
+        return True
+
+    def close(self):
+        if self.connection:
+            CountingEmailBackend.closed += 1
+        self.connection = None
+
+
+class TestConnectionPool(MailerTestCase):
+    backend = 'django_mailer.testapp.tests.pool.CountingEmailBackend'
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        pool.close_all()
+        CountingEmailBackend.opened = CountingEmailBackend.closed = 0
+        CountingEmailBackend.noop_code = 250
+        self._backup = {
+            'CONNECTION_POOL': settings.CONNECTION_POOL,
+            'CONNECTION_MAX_MESSAGES': settings.CONNECTION_MAX_MESSAGES,
+            'USE_BACKEND': settings.USE_BACKEND,
+        }
+        settings.CONNECTION_POOL = True
+
+    def tearDown(self):
+        super(TestConnectionPool, self).tearDown()
+        for name, value in self._backup.items():
+            setattr(settings, name, value)
+        pool.close_all()
+
+    def test_reuse(self):
+        connection = pool.acquire(self.backend)
+        pool.release(connection)
+        self.assertTrue(pool.acquire(self.backend) is connection)
+        # Another connection is opened while the first one is in use.
+        other = pool.acquire(self.backend)
+        self.assertFalse(other is connection)
+        pool.release(connection)
+        pool.release(other)
+        self.assertEqual(CountingEmailBackend.opened, 2)
+        self.assertEqual(CountingEmailBackend.closed, 0)
+
+    def test_health_check(self):
+        connection = pool.acquire(self.backend)
+        pool.release(connection)
+        CountingEmailBackend.noop_code = 421
+        self.assertFalse(pool.acquire(self.backend) is connection)
+        self.assertEqual(CountingEmailBackend.closed, 1)
+
+    def test_max_messages(self):
+        settings.CONNECTION_MAX_MESSAGES = 2
+        connection = pool.acquire(self.backend)
+        pool.sent(connection)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        pool.sent(connection)
+        # The connection is reopened in place.
+        self.assertEqual(CountingEmailBackend.opened, 2)
+        self.assertEqual(CountingEmailBackend.closed, 1)
+        pool.release(connection)
+        self.assertTrue(pool.acquire(self.backend) is connection)
+
+    def test_credentials(self):
+        with self.settings(EMAIL_HOST_PASSWORD='old'):
+            connection = pool.acquire(self.backend)
+            pool.release(connection)
+        # Connections authenticated with other credentials aren't reused.
+        with self.settings(EMAIL_HOST_PASSWORD='new'):
+            self.assertFalse(pool.acquire(self.backend) is connection)
+        with self.settings(EMAIL_HOST_PASSWORD='old'):
+            self.assertTrue(pool.acquire(self.backend) is connection)
+
+    def test_disabled(self):
+        settings.CONNECTION_POOL = False
+        connection = pool.acquire(self.backend)
+        pool.release(connection)
+        self.assertFalse(pool.acquire(self.backend) is connection)
+        self.assertEqual(CountingEmailBackend.closed, 1)
+
+    def test_send_now(self):
+        settings.USE_BACKEND = self.backend
+        for i in range(3):
+            self.queue_message(priority=constants.PRIORITY_EMAIL_NOW)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(CountingEmailBackend.closed, 0)
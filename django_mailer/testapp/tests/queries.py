@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+import datetime
+from django.db import connection
+from django.test import TestCase
+from django.utils.unittest import skipUnless
+from django_mailer import models
+
+
+class TestQueryPlans(TestCase):
+    """
+    Check that the queue's frequent queries are backed by an index rather
+    than a full table scan.
+
+    """
+
+    def get_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        # The tables are tiny, so make sure PostgreSQL only falls back to a
+        # sequential scan if no index applies.
+        cursor.execute('SET enable_seqscan = off')
+        try:
+            cursor.execute('EXPLAIN ' + sql, params)
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.execute('SET enable_seqscan = on')
+
+    def assertIndexed(self, queryset, table):
+        sql = queryset.query.sql_with_params()[0]
+        plan = self.get_plan(queryset)
+        if connection.vendor == 'sqlite':
+            scans = [line for line in plan if table in line and
+                     ' INDEX ' not in line and 'PRIMARY KEY' not in line]
+        else:
+            scans = [line for line in plan if 'Seq Scan on %s' % table in line]
+        self.assertFalse(scans, '%s\n%s' % (sql, '\n'.join(plan)))
+
+    def get_querysets(self):
+        queue = models.QueuedMessage.objects
+        cutoff_date = datetime.date.today() - datetime.timedelta(30)
+        return [
+            (queue.non_deferred(), 'django_mailer_queuedmessage'),
+            (queue.non_deferred()[:500], 'django_mailer_queuedmessage'),
+            (queue.deferred(), 'django_mailer_queuedmessage'),
+            (queue.non_deferred().order_by('date_queued')[:1],
+             'django_mailer_queuedmessage'),
+            (queue.claimable().order_by('priority', 'date_queued')[:500],
+             'django_mailer_queuedmessage'),
+            (models.Message.objects.filter(date_created__lt=cutoff_date),
+             'django_mailer_message'),
+        ]
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'),
+                'Query plans are only checked on SQLite and PostgreSQL')
+    def test_queue_queries_use_indexes(self):
+        for queryset, table in self.get_querysets():
+            self.assertIndexed(queryset, table)
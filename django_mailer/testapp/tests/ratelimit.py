@@ -0,0 +1,82 @@
+from django.core import mail
+from django_mailer import engine, models, ratelimit, settings
+from .base import MailerTestCase
+
+
+class TestRateLimiter(MailerTestCase):
+    def setUp(self):
+        super(TestRateLimiter, self).setUp()
+        self._backup = (settings.DOMAIN_RATE_LIMITS,
+                        settings.SENDER_RATE_LIMITS, settings.RATE_LIMIT_STORE)
+        ratelimit._local_store.buckets.clear()
+
+    def tearDown(self):
+        super(TestRateLimiter, self).tearDown()
+        (settings.DOMAIN_RATE_LIMITS, settings.SENDER_RATE_LIMITS,
+         settings.RATE_LIMIT_STORE) = self._backup
+
+    def message(self, to_address, from_address='sender@djangomailer'):
+        return models.Message(to_address=to_address,
+                              from_address=from_address)
+
+    def check_store(self, store):
+        limiter = ratelimit.RateLimiter(
+            domain_limits={'example.com': (2, 3600)},
+            sender_limits={'*': (3, 3600)}, store=store)
+        self.assertTrue(limiter.allow(self.message('one@example.com')))
+        self.assertTrue(limiter.allow(self.message('two@Example.com')))
+        self.assertFalse(limiter.allow(self.message('three@example.com')))
+        # Another domain has no limit, but the sender has one token left.
+        self.assertTrue(limiter.allow(self.message('one@example.org')))
+        self.assertFalse(limiter.allow(self.message('two@example.org')))
+        self.assertTrue(limiter.allow(self.message('two@example.org',
+                                                   'other@djangomailer')))
+
+    def test_local_store(self):
+        self.check_store(ratelimit.LocalStore())
+
+    def test_cache_store(self):
+        store = ratelimit.CacheStore()
+        store.cache.clear()
+        self.check_store(store)
+
+    def test_database_store(self):
+        self.check_store(ratelimit.DatabaseStore())
+        self.assertEqual(models.RateLimitBucket.objects.count(), 3)
+
+    def test_retry_after(self):
+        limiter = ratelimit.RateLimiter(
+            domain_limits={'*': (10, 60)},
+            sender_limits={'sender@djangomailer': (2, 60)})
+        self.assertEqual(limiter.retry_after(self.message('one@example.com')),
+                         30)
+        self.assertEqual(limiter.retry_after(
+            self.message('one@example.com', 'other@djangomailer')), 6)
+
+    def test_tokens_given_back(self):
+        limiter = ratelimit.RateLimiter(
+            domain_limits={'example.com': (1, 3600)},
+            sender_limits={'blocked@djangomailer': (0.001, 3600)})
+        limiter.allow(self.message('one@example.org', 'blocked@djangomailer'))
+        # The domain token isn't used up when the sender has none left.
+        self.assertFalse(limiter.allow(
+            self.message('one@example.com', 'blocked@djangomailer')))
+        self.assertTrue(limiter.allow(self.message('one@example.com')))
+
+    def test_messages_held_back(self):
+        settings.DOMAIN_RATE_LIMITS = {'djangomailer': (2, 3600)}
+        for i in range(3):
+            self.queue_message()
+        self.queue_message(recipient_list=['recipient@example.com'])
+
+        engine.send_all(
+            backend='django_mailer.testapp.tests.base.TestEmailBackend')
+
+        self.assertEqual(len(mail.outbox), 3)
+        # The message over the limit is left in the queue, not deferred, but
+        # isn't due again until its bucket has refilled.
+        queued_message = models.QueuedMessage.objects.scheduled().get()
+        self.assertEqual(queued_message.message.to_address,
+                         'recipient@djangomailer')
+        self.assertEqual(queued_message.retries, 0)
+        self.assertFalse(models.QueuedMessage.objects.non_deferred().exists())
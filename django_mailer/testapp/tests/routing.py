@@ -0,0 +1,162 @@
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.test.utils import override_settings
+from django_mailer import constants, engine, models, routing, settings
+from django_mailer.pool import pool
+from .base import FakeConnection, MailerTestCase
+
+
+class RecordingEmailBackend(BaseEmailBackend):
+    """
+    An EmailBackend which records the ``host`` it was created for and the
+    recipients sent to over each connection.
+
+    """
+    # A list of (host, connection number, recipients) tuples.
+    sent = []
+    opened = 0
+
+    def __init__(self, fail_silently=False, host=None, **kwargs):
+        super(RecordingEmailBackend, self).__init__(
+            fail_silently=fail_silently)
+        self.host = host
+        self.connection = None
+
+    def open(self):
+        if self.connection:
+            return False
+        RecordingEmailBackend.opened += 1
+        number = RecordingEmailBackend.opened
+        self.connection = FakeConnection()
+        sendmail = self.connection.sendmail
+
+        def record(from_addr, to_addrs, msg, *args, **kwargs):
+            RecordingEmailBackend.sent.append((self.host, number,
+                                               list(to_addrs)))
+            return sendmail(from_addr, to_addrs, msg, *args, **kwargs)
+        self.connection.sendmail = record
+        return True
+
+    def close(self):
+        self.connection = None
+
+
+class TestRouting(MailerTestCase):
+    backend = 'django_mailer.testapp.tests.routing.RecordingEmailBackend'
+
+    def setUp(self):
+        super(TestRouting, self).setUp()
+        pool.close_all()
+        RecordingEmailBackend.sent = []
+        RecordingEmailBackend.opened = 0
+        self._backup = settings.ROUTES, routing.dns
+        # Use the implicit MX rather than looking up DNS records.
+        routing.dns = None
+
+    def tearDown(self):
+        super(TestRouting, self).tearDown()
+        settings.ROUTES, routing.dns = self._backup
+        pool.close_all()
+
+    def destination(self, router, to_address):
+        return router.destination(models.Message(to_address=to_address))
+
+    def test_match(self):
+        router = routing.Router({
+            'example.com': 'example.Backend',
+            '.example.org': {'OPTIONS': {'host': 'relay.example.org'}},
+            '*': {'BACKEND': 'mx.Backend', 'OPTIONS': {'port': 25},
+                  'MX': True},
+        }, backend='default.Backend')
+        self.assertEqual(self.destination(router, 'one@Example.com'),
+                         ('example.Backend', ()))
+        self.assertEqual(self.destination(router, 'one@mail.example.org'),
+                         ('default.Backend', (('host', 'relay.example.org'),)))
+        self.assertEqual(self.destination(router, 'one@example.org'),
+                         ('default.Backend', (('host', 'relay.example.org'),)))
+        # A subdomain only matches entries starting with a dot.
+        self.assertEqual(self.destination(router, 'one@mail.example.com'),
+                         ('mx.Backend', (('host', 'mail.example.com'),
+                                         ('port', 25))))
+
+    def test_no_routes(self):
+        router = routing.Router({}, backend='default.Backend')
+        self.assertEqual(self.destination(router, 'one@example.com'),
+                         ('default.Backend', ()))
+
+    def test_connection_per_destination(self):
+        settings.ROUTES = {
+            'example.com': {'OPTIONS': {'host': 'relay.example.com'}},
+            '*': {'MX': True},
+        }
+        for address in ('one@example.com', 'one@example.org',
+                        'two@example.com', 'two@example.org',
+                        'one@example.net'):
+            self.queue_message(recipient_list=[address])
+
+        engine.send_all(backend=self.backend)
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(models.QueuedMessage.objects.exists())
+        self.assertEqual(RecordingEmailBackend.opened, 3)
+        recipients = {}
+        connections = {}
+        for host, number, to_addrs in RecordingEmailBackend.sent:
+            recipients.setdefault(host, []).extend(to_addrs)
+            connections.setdefault(host, set()).add(number)
+        self.assertEqual(sorted(recipients['relay.example.com']),
+                         ['one@example.com', 'two@example.com'])
+        self.assertEqual(sorted(recipients['example.org']),
+                         ['one@example.org', 'two@example.org'])
+        self.assertEqual(recipients['example.net'], ['one@example.net'])
+        # Each destination's messages share one connection.
+        for numbers in connections.values():
+            self.assertEqual(len(numbers), 1)
+
+    def test_max_destinations(self):
+        settings.ROUTES = {'*': {'MX': True}}
+        backup = settings.MAX_DESTINATIONS
+        settings.MAX_DESTINATIONS = 1
+        try:
+            for domain in ('example.com', 'example.org', 'example.net'):
+                self.queue_message(recipient_list=['one@%s' % domain])
+            engine.send_all(backend=self.backend)
+        finally:
+            settings.MAX_DESTINATIONS = backup
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(RecordingEmailBackend.opened, 3)
+
+    def test_smtp_server(self):
+        # The SMTP server started by the test runner on localhost:1025 is
+        # the implicit MX of the localhost domain.
+        settings.ROUTES = {
+            'localhost': {
+                'BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+                'OPTIONS': {'port': 1025},
+                'MX': True,
+            },
+        }
+        self.queue_message(recipient_list=['someone@localhost'])
+        self.queue_message(recipient_list=['someone@example.com'])
+
+        engine.send_all(backend=self.backend)
+
+        self.assertFalse(models.QueuedMessage.objects.exists())
+        self.assertEqual(models.Log.objects.filter(
+            result=constants.RESULT_SENT).count(), 2)
+        # Only the message which wasn't routed went to the default backend.
+        self.assertEqual([to_addrs for host, number, to_addrs
+                          in RecordingEmailBackend.sent],
+                         [['someone@example.com']])
+
+    def test_send_message_not_routed(self):
+        settings.ROUTES = {'*': {'BACKEND': self.backend, 'MX': True}}
+        email_message = mail.EmailMessage('subject', 'body', 'from@example.com',
+                                          ['one@example.com'])
+        with override_settings(
+                EMAIL_BACKEND='django_mailer.testapp.tests.base.'
+                              'TestEmailBackend'):
+            self.assertEqual(engine.send_message(email_message),
+                             constants.RESULT_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(RecordingEmailBackend.sent, [])
@@ -0,0 +1,134 @@
+import datetime
+from django.core import mail
+from django_mailer import constants, engine, models, scheduler, settings
+from .base import MailerTestCase
+
+
+class TestScheduler(MailerTestCase):
+    backend = 'django_mailer.testapp.tests.base.TestEmailBackend'
+
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self._backup = (settings.PRIORITY_WEIGHTS, settings.PRIORITY_MAX_AGE,
+                        settings.EMAIL_MAX_SENT, settings.LEASE_QUEUE)
+
+    def tearDown(self):
+        super(TestScheduler, self).tearDown()
+        (settings.PRIORITY_WEIGHTS, settings.PRIORITY_MAX_AGE,
+         settings.EMAIL_MAX_SENT, settings.LEASE_QUEUE) = self._backup
+
+    def queue_levels(self, count=12):
+        for priority in ('high', 'normal', 'low'):
+            for i in range(count):
+                self.queue_message(subject=priority,
+                                   priority=constants.PRIORITIES[priority])
+
+    def priorities(self, pks):
+        priorities = dict(models.QueuedMessage.objects.filter(pk__in=pks)
+                          .values_list('pk', 'priority'))
+        return [priorities[pk] for pk in pks]
+
+    def test_weights(self):
+        self.queue_levels()
+        weighted = scheduler.Scheduler({'high': 8, 'normal': 3, 'low': 1})
+        queue = models.QueuedMessage.objects.non_deferred()
+        pks = weighted.select(queue, 12)
+        priorities = self.priorities(pks)
+        self.assertEqual(priorities.count(constants.PRIORITY_HIGH), 8)
+        self.assertEqual(priorities.count(constants.PRIORITY_NORMAL), 3)
+        self.assertEqual(priorities.count(constants.PRIORITY_LOW), 1)
+        # The levels are interleaved rather than sent one after the other.
+        self.assertEqual(priorities[:3], [constants.PRIORITY_HIGH,
+                                          constants.PRIORITY_NORMAL,
+                                          constants.PRIORITY_HIGH])
+        self.assertEqual(weighted.pop_stats(), {
+            'priorities': {constants.PRIORITY_HIGH: 8,
+                           constants.PRIORITY_NORMAL: 3,
+                           constants.PRIORITY_LOW: 1},
+            'promoted': 0})
+
+    def test_weights_carry_over(self):
+        self.queue_levels()
+        weighted = scheduler.Scheduler({'high': 8, 'normal': 3, 'low': 1})
+        priorities = []
+        for i in range(4):
+            queue = models.QueuedMessage.objects.non_deferred()
+            pks = weighted.select(queue, 3)
+            priorities.extend(self.priorities(pks))
+            models.QueuedMessage.objects.filter(pk__in=pks).delete()
+        self.assertEqual(priorities.count(constants.PRIORITY_LOW), 1)
+        self.assertEqual(priorities.count(constants.PRIORITY_NORMAL), 3)
+
+    def test_unweighted_priorities_first(self):
+        self.queue_levels(2)
+        weighted = scheduler.Scheduler({'normal': 1, 'low': 1})
+        queue = models.QueuedMessage.objects.non_deferred()
+        priorities = self.priorities(weighted.select(queue))
+        self.assertEqual(priorities, [
+            constants.PRIORITY_HIGH, constants.PRIORITY_HIGH,
+            constants.PRIORITY_NORMAL, constants.PRIORITY_LOW,
+            constants.PRIORITY_NORMAL, constants.PRIORITY_LOW])
+
+    def test_promotion(self):
+        self.queue_levels(2)
+        old = models.QueuedMessage.objects.filter(
+            priority=constants.PRIORITY_LOW)[0]
+        old.date_queued -= datetime.timedelta(hours=2)
+        old.save()
+        weighted = scheduler.Scheduler({'high': 8, 'normal': 3, 'low': 1},
+                                       max_age={'low': 3600})
+        queue = models.QueuedMessage.objects.non_deferred()
+        pks = weighted.select(queue, 3)
+        self.assertEqual(pks[0], old.pk)
+        self.assertEqual(self.priorities(pks[1:]), [constants.PRIORITY_HIGH,
+                                                    constants.PRIORITY_NORMAL])
+        stats = weighted.pop_stats()
+        self.assertEqual(stats['promoted'], 1)
+        self.assertEqual(scheduler.format_stats(stats),
+                         '1 high, 1 normal, 1 low (1 promoted by age)')
+
+    def check_send_all(self):
+        settings.PRIORITY_WEIGHTS = {'high': 8, 'normal': 3, 'low': 1}
+        settings.EMAIL_MAX_SENT = 12
+        self.queue_levels()
+
+        engine.send_all(block_size=12, backend=self.backend)
+
+        self.assertEqual(len(mail.outbox), 12)
+        sent = models.Log.objects.values_list('message__subject', flat=True)
+        self.assertEqual(sorted(sent), ['high'] * 8 + ['low'] + ['normal'] * 3)
+        stats = scheduler.get_scheduler().last_stats
+        self.assertEqual(stats['priorities'][constants.PRIORITY_LOW], 1)
+
+    def test_send_all(self):
+        self.check_send_all()
+
+    def test_send_all_leased(self):
+        settings.LEASE_QUEUE = True
+        self.check_send_all()
+        self.assertFalse(models.QueuedMessage.objects.exclude(
+            owner='').exists())
+
+    def test_claimed_blocks_race(self):
+        settings.PRIORITY_WEIGHTS = {'high': 8, 'normal': 3, 'low': 1}
+        self.queue_levels(count=2)
+        weighted = scheduler.get_scheduler()
+        select = weighted.select
+        calls = [0]
+
+        def racing_select(queue, limit):
+            # Another sender claims the first selection before this one.
+            pks = select(queue, limit)
+            calls[0] += 1
+            if calls[0] == 1:
+                models.QueuedMessage.objects.claim('other', limit, pks=pks)
+            return pks
+        weighted.select = racing_select
+        try:
+            block = next(engine._claimed_blocks(2, 'mine'))
+        finally:
+            del weighted.select
+        self.assertEqual(len(block), 2)
+        self.assertEqual(set(m.owner for m in block), set(['mine']))
+        self.assertEqual(models.QueuedMessage.objects.filter(
+            owner='other').count(), 2)
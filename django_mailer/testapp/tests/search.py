@@ -0,0 +1,105 @@
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django_mailer import models, queue_email_message, search, settings
+from .base import MailerTestCase
+
+
+class TestSearch(MailerTestCase):
+
+    def setUp(self):
+        super(TestSearch, self).setUp()
+        email_message = mail.EmailMessage(
+            'Quarterly report', 'The figures are attached.',
+            'reports@djangomailer', ['alice@djangomailer'])
+        email_message.attach('figures.csv', 'secretnumbers\n' * 100,
+                             'text/csv')
+        queue_email_message(email_message)
+        email_message = mail.EmailMultiAlternatives(
+            'Invitation', '', 'events@djangomailer', ['bob@djangomailer'])
+        email_message.attach_alternative(
+            '<p>Join us for <b>dinner</b></p>', 'text/html')
+        queue_email_message(email_message)
+
+    def search(self, search_term):
+        queryset = search.search(models.Message.objects.all(), search_term)
+        return sorted(queryset.values_list('to_address', flat=True))
+
+    def check_search(self):
+        self.assertEqual(self.search('quarterly'), ['alice@djangomailer'])
+        self.assertEqual(self.search('figures report'),
+                         ['alice@djangomailer'])
+        self.assertEqual(self.search('bob@djangomailer'),
+                         ['bob@djangomailer'])
+        self.assertEqual(self.search('dinner'), ['bob@djangomailer'])
+        self.assertEqual(self.search('djangomailer'),
+                         ['alice@djangomailer', 'bob@djangomailer'])
+        # Neither attachments nor markup are searched.
+        self.assertEqual(self.search('secretnumbers'), [])
+        self.assertEqual(self.search('figures dinner'), [])
+
+    def test_search_text(self):
+        message = models.Message.objects.get(to_address='bob@djangomailer')
+        self.assertEqual(message.search_text.split('\n'),
+                         ['Invitation', 'events@djangomailer',
+                          'bob@djangomailer', 'Join us for dinner'])
+
+    def test_search(self):
+        self.assertTrue(search.has_fts_table(connection))
+        self.check_search()
+
+    def test_search_like(self):
+        has_fts_table = search.has_fts_table
+        search.has_fts_table = lambda connection: False
+        try:
+            self.check_search()
+        finally:
+            search.has_fts_table = has_fts_table
+
+    def test_delete(self):
+        models.Message.objects.filter(to_address='bob@djangomailer').delete()
+        self.assertEqual(self.search('djangomailer'), ['alice@djangomailer'])
+
+    def test_index_mail(self):
+        models.Message.objects.update(search_text='')
+        self.assertEqual(self.search('figures'), [])
+        call_command('index_mail', verbosity='0')
+        self.check_search()
+
+    def test_recipient_text(self):
+        email_message = mail.EmailMessage(
+            'Minutes', 'Nothing to report.', 'clerk@djangomailer',
+            ['board@djangomailer'], bcc=['carol@djangomailer'])
+        queue_email_message(email_message)
+        # Bcc recipients aren't in the headers of the message, their address
+        # is added to the search text of their own row only.
+        self.assertEqual(self.search('carol'), ['carol@djangomailer'])
+        self.assertEqual(self.search('minutes'),
+                         ['board@djangomailer', 'carol@djangomailer'])
+        self.assertEqual(self.search('100%'), [])
+
+    def test_recipient_text_like(self):
+        has_fts_table = search.has_fts_table
+        search.has_fts_table = lambda connection: False
+        try:
+            self.test_recipient_text()
+        finally:
+            search.has_fts_table = has_fts_table
+
+    def test_not_indexed(self):
+        settings.INDEX_MESSAGES = False
+        try:
+            queue_email_message(mail.EmailMessage(
+                'Minutes', 'Nothing to report.', 'clerk@djangomailer',
+                ['board@djangomailer']))
+        finally:
+            settings.INDEX_MESSAGES = True
+        message = models.Message.objects.get(subject='Minutes')
+        self.assertEqual(message.search_text, '')
+        # It is found by its fields only.
+        self.assertEqual(self.search('minutes'), [])
+        queryset = search.search_fields(models.Message.objects.all(),
+                                        'minutes clerk')
+        self.assertEqual([m.pk for m in queryset], [message.pk])
+        self.assertEqual(list(search.search_fields(
+            models.Message.objects.all(), 'nothing')), [])
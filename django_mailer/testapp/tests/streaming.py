@@ -0,0 +1,159 @@
+import datetime
+import shutil
+import tempfile
+import threading
+from django.core import mail
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.encoding import force_bytes
+from django.utils.six import BytesIO
+from django.utils.unittest import skipUnless
+from django_mailer import (engine, models, queue_email_message, settings,
+                           streaming)
+from django_mailer.mail_utils import get_attachments
+from django_mailer.pool import pool
+from django_mailer.storage import get_storage
+from pyzmail.parse import message_from_string
+from .base import MailerTestCase
+try:
+    import asyncore
+    import smtpd
+except ImportError:
+    # Removed in Python 3.12.
+    smtpd = None
+
+
+class TestStreaming(MailerTestCase):
+    backend = 'django_mailer.testapp.tests.base.TestEmailBackend'
+
+    def setUp(self):
+        super(TestStreaming, self).setUp()
+        self._backup = settings.STREAM_MESSAGES, settings.STORAGE_LOCATION
+        settings.STREAM_MESSAGES = True
+        settings.STORAGE_LOCATION = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestStreaming, self).tearDown()
+        shutil.rmtree(settings.STORAGE_LOCATION)
+        settings.STREAM_MESSAGES, settings.STORAGE_LOCATION = self._backup
+
+    def queue_attachment_message(self, to='recipient@djangomailer'):
+        email_message = mail.EmailMessage(
+            'Attached', 'First line\n.A line starting with a dot\n',
+            'sender@djangomailer', [to])
+        email_message.attach('data.bin', b'\x00\x01' * 50000,
+                             'application/octet-stream')
+        queue_email_message(email_message)
+        return email_message
+
+    def test_data_chunks(self):
+        data = b'Subject: dots\r\n\r\n.one\nt.wo\n..three\nlast'
+        self.assertEqual(
+            b''.join(streaming.data_chunks(BytesIO(data), 4)),
+            b'Subject: dots\r\n\r\n..one\r\nt.wo\r\n...three\r\nlast\r\n'
+            b'.\r\n')
+        # Long lines are passed on in pieces, dots only being stuffed at the
+        # start of lines.
+        data = b'.' * 20 + b'\n'
+        chunks = list(streaming.data_chunks(BytesIO(data), 8))
+        self.assertTrue(max(len(chunk) for chunk in chunks) <= 16)
+        self.assertEqual(b''.join(chunks), b'.' * 21 + b'\r\n.\r\n')
+
+    def test_queue(self):
+        email_message = self.queue_attachment_message()
+        message = models.Message.objects.get()
+        self.assertEqual(message.encoded_message, '')
+        self.assertTrue(get_storage().exists(message.stored_message))
+        # The stored message is the message as it would have been encoded.
+        encoded_message = message_from_string(message.get_encoded_message())
+        self.assertEqual(encoded_message.get_subject(), email_message.subject)
+        self.assertEqual(encoded_message.text_part.get_payload(),
+                         email_message.body.encode('ascii'))
+        attachments = get_attachments(encoded_message)
+        self.assertEqual(len(attachments), 1)
+        self.assertEqual(attachments[0].payload,
+                         email_message.attachments[0][1])
+
+    def test_send(self):
+        self.queue_attachment_message()
+        self.queue_attachment_message(to='other@djangomailer')
+        self.assertEqual(len(set(models.Message.objects.values_list(
+            'stored_message', flat=True))), 2)
+        engine.send_all(backend=self.backend)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(models.QueuedMessage.objects.exists())
+
+    def test_cleanup(self):
+        self.queue_attachment_message()
+        name = models.Message.objects.get().stored_message
+        models.Message.objects.update(
+            date_created=datetime.datetime(2000, 1, 1))
+        call_command('cleanup_mail', verbosity='0')
+        self.assertFalse(models.Message.objects.exists())
+        self.assertFalse(get_storage().exists(name))
+
+    @skipUnless(smtpd, 'smtpd is not available')
+    def test_smtp_data(self):
+        server = _RecordingServer(('localhost', 0), None)
+        port = server.socket.getsockname()[1]
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        try:
+            self.queue_attachment_message()
+            encoded_message = models.Message.objects.get()\
+                .get_encoded_message()
+            pool.close_all()
+            with override_settings(EMAIL_HOST='localhost', EMAIL_PORT=port):
+                engine.send_all(
+                    backend='django.core.mail.backends.smtp.EmailBackend')
+                pool.close_all()
+        finally:
+            server.shutdown()
+            thread.join()
+        self.assertFalse(models.QueuedMessage.objects.exists())
+        self.assertEqual(len(server.messages), 1)
+        mailfrom, rcpttos, data = server.messages[0]
+        self.assertEqual(rcpttos, ['recipient@djangomailer'])
+        self.assertEqual(force_bytes(data).rstrip(b'\n'),
+                         force_bytes(encoded_message).rstrip(b'\n'))
+
+
+if smtpd is not None:
+    class _RecordingServer(smtpd.SMTPServer):
+        """
+        An SMTP server recording the messages it receives, served by its own
+        asyncore map.
+
+        """
+
+        def __init__(self, localaddr, remoteaddr):
+            self.map = {}
+            self.messages = []
+            asyncore.dispatcher.__init__(self, map=self.map)
+            self.create_socket(smtpd.socket.AF_INET,
+                               smtpd.socket.SOCK_STREAM)
+            self.set_reuse_addr()
+            self.bind(localaddr)
+            self.listen(5)
+
+        def handle_accept(self):
+            pair = self.accept()
+            if pair is not None:
+                channel = smtpd.SMTPChannel(self, *pair)
+                # Serve the channel from this server's map.
+                del asyncore.socket_map[channel._fileno]
+                channel._map = self.map
+                channel.add_channel()
+
+        def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+            self.messages.append((mailfrom, rcpttos, data))
+
+        def serve(self):
+            self.running = True
+            while self.running:
+                asyncore.loop(timeout=0.05, map=self.map, count=1)
+            for dispatcher in list(self.map.values()):
+                asyncore.dispatcher.close(dispatcher)
+
+        def shutdown(self):
+            self.running = False
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# ----------------------------------------------------------------------------
+
+"""
+Waking up a sleeping ``send_loop`` as soon as new mail is queued.
+
+On PostgreSQL a ``NOTIFY`` is sent on the ``MAILER_NOTIFY_CHANNEL`` channel
+(delivered when the queuing transaction commits). With other databases a
+datagram is sent to the local socket at ``MAILER_WAKEUP_SOCKET``. Either way,
+notifying is cheap and harmless when no loop is listening.
+
+"""
+from django.db import connections, router
+from django_mailer import settings
+import errno
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+import logging
+import os
+import select
+import socket
+import tempfile
+import threading
+
+logger = logging.getLogger('django_mailer.wakeup')
+
+# Next to the lock file by default, so that projects with their own lock file
+# don't wake each other up.
+SOCKET_PATH = settings.WAKEUP_SOCKET or '%s.sock' % (
+    settings.LOCK_PATH or os.path.join(tempfile.gettempdir(), 'send_mail'))
+
+
+def _connection():
+    """
+    Return the connection to the database the queue is written to.
+
+    """
+    from django_mailer.models import QueuedMessage
+    return connections[router.db_for_write(QueuedMessage)]
+
+
+def _use_postgresql():
+    return _connection().vendor == 'postgresql'
+
+
+def notify():
+    """
+    Notify a listening ``send_loop`` that new mail has been queued.
+
+    """
+    if not settings.NOTIFY_QUEUE:
+        return
+    if _use_postgresql():
+        cursor = _connection().cursor()
+        cursor.execute('NOTIFY "%s"' % settings.NOTIFY_CHANNEL)
+        return
+    if not hasattr(socket, 'AF_UNIX'):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(0)
+        sock.sendto(b'1', SOCKET_PATH)
+    except socket.error:
+        # Nothing is listening (or it already has a wake up pending).
+        pass
+    finally:
+        sock.close()
+
+
+class QueueListener(object):
+    """
+    Wait for queued mail notifications.
+
+    A pipe is always watched so that ``interrupt`` (which is safe to call from
+    a signal handler) ends a wait early, for example to shut down. Pipes
+    can't be watched on Windows, where an event is used instead and only
+    the interruptions are waited for.
+
+    """
+
+    def __init__(self):
+        self._interrupted = threading.Event()
+        self._pipe = ()
+        if fcntl is not None:
+            self._pipe = os.pipe()
+            for fd in self._pipe:
+                _set_nonblocking(fd)
+        self._pg_connection = None
+        self._socket = None
+        if not settings.NOTIFY_QUEUE:
+            return
+        if _use_postgresql():
+            self._listen_postgresql()
+        elif hasattr(socket, 'AF_UNIX'):
+            self._listen_socket()
+
+    def _listen_postgresql(self):
+        # A separate connection so that the listening session isn't affected
+        # by the transactions of the sending one.
+        connection = _connection()
+        try:
+            pg_connection = connection.get_new_connection(
+                connection.get_connection_params())
+            pg_connection.autocommit = True
+            pg_connection.cursor().execute('LISTEN "%s"' %
+                                           settings.NOTIFY_CHANNEL)
+        except Exception as err:
+            logger.warning("Failed to listen for queued mail: %s" % err)
+            return
+        self._pg_connection = pg_connection
+
+    def _listen_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            # A stale socket file is left behind by a killed loop.
+            if os.path.exists(SOCKET_PATH):
+                os.unlink(SOCKET_PATH)
+            sock.bind(SOCKET_PATH)
+        except (OSError, socket.error) as err:
+            sock.close()
+            logger.warning("Failed to listen for queued mail on %s: %s" %
+                           (SOCKET_PATH, err))
+            return
+        sock.setblocking(0)
+        self._socket = sock
+
+    def wait(self, timeout):
+        """
+        Wait up to ``timeout`` seconds, returning whether a notification (or
+        an interruption) was received.
+
+        """
+        if not self._pipe:
+            interrupted = self._interrupted.wait(timeout)
+            self._interrupted.clear()
+            return interrupted
+        readers = [self._pipe[0]]
+        if self._pg_connection is not None:
+            readers.append(self._pg_connection)
+        if self._socket is not None:
+            readers.append(self._socket)
+        try:
+            ready = select.select(readers, [], [], timeout)[0]
+        except (select.error, OSError) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            # Interrupted by a signal.
+            return True
+        if not ready:
+            return False
+        self._drain()
+        return True
+
+    def _drain(self):
+        try:
+            while self._pipe and os.read(self._pipe[0], 512):
+                pass
+        except OSError:
+            pass
+        if self._socket is not None:
+            try:
+                while self._socket.recv(512):
+                    pass
+            except socket.error:
+                pass
+        if self._pg_connection is not None:
+            try:
+                self._pg_connection.poll()
+                del self._pg_connection.notifies[:]
+            except Exception as err:
+                logger.warning("Lost the queued mail notifications "
+                               "connection: %s" % err)
+                self._close_postgresql()
+                self._listen_postgresql()
+
+    def interrupt(self):
+        """
+        End the current (or next) ``wait`` early.
+
+        """
+        if not self._pipe:
+            self._interrupted.set()
+            return
+        try:
+            os.write(self._pipe[1], b'1')
+        except OSError:
+            pass
+
+    def _close_postgresql(self):
+        try:
+            self._pg_connection.close()
+        except Exception:
+            pass
+        self._pg_connection = None
+
+    def close(self):
+        if self._pg_connection is not None:
+            self._close_postgresql()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(SOCKET_PATH)
+            except OSError:
+                pass
+        for fd in self._pipe:
+            os.close(fd)
+        self._pipe = ()
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
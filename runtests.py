@@ -20,7 +20,11 @@ try:
 except AttributeError:
     pass
 
-from django.test.simple import DjangoTestSuiteRunner
+try:
+    from django.test.simple import DjangoTestSuiteRunner
+except ImportError:
+    # Django version >= 1.8
+    from django.test.runner import DiscoverRunner as DjangoTestSuiteRunner
 
 
 # Helper functions to check if the smtpd server is listening
@@ -81,7 +85,11 @@ def runtests(*test_args):
         # Daemon failed to start
         sys.exit(-1)
 
-    test_args = test_args or ['testapp']
+    if not test_args:
+        if DjangoTestSuiteRunner.__name__ == 'DiscoverRunner':
+            test_args = ['django_mailer.testapp.tests']
+        else:
+            test_args = ['testapp']
 
     parent = os.path.dirname(os.path.abspath(__file__))
     sys.path.insert(0, parent)
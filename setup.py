@@ -15,14 +15,18 @@ setup(
     author_email='antoni.aloy@gmail.com',
     url='http://github.com/APSL/django-mailer-2',
     install_requires = [
-        'Django>=1.4',
-        'pyzmail>=1.0.3',
+        'Django>=1.5',
+        'pyzmail>=1.0.3; python_version < "3"',
+        # pyzmail itself only installs on Python 2.
+        'pyzmail36>=1.0.4; python_version >= "3"',
         'lockfile>=0.8',
     ],
     packages=[
         'django_mailer',
         'django_mailer.management',
         'django_mailer.management.commands',
+        'django_mailer.migrations',
+        'django_mailer.south_migrations',
     ],
     include_package_data=True,
     classifiers=[